@@ -1,72 +1,102 @@
 import streamlit as st
 import streamlit.components.v1 as components
 import pandas as pd
-import google.genai as genai
 import os
-import json
+import re
 import base64
+import io
+import csv
+import sqlite3
+import time
+import uuid
+from datetime import datetime
 from typing import Optional
 
-# File per salvare le preferenze utente
-PREFS_FILE = os.path.join(os.path.dirname(__file__), "user_preferences.json")
-
-def load_preferences():
-    """Carica le preferenze salvate dall'ultimo uso."""
-    defaults = {
-        "goals": ["Ipertrofia (Massa)"],
-        "days": 4,
-        "split_type": "Full Body",
-        "focus_area": [],
-        "equipment_pref": "Con attrezzi",
-        "sex_pref": "Maschio",
-        "age": 30,
-        "training_level": "Beginner",
-        "duration": 60
-    }
+from bulk_generation import Checkpoint, read_roster, run_roster, zip_results
+from catalog import CatalogIndex, CatalogMetadata
+import exercise_images
+from plan_engine import build_plan
+from generation import ENGINE_LOCAL, ENGINE_OPTIONS, GENERATION_ERRORS, generate_plan, regenerate_day
+from hevy_export import ExportStore, HevyClient, export_plan
+import metrics
+import pdf_export
+import profiling
+import warmup
+from periodization import build_program, program_markdown, week_title
+from plan_engine import DURATION_TOLERANCE, patch_plan, reshuffle_day, swap_candidates, swap_exercise
+from jobs import DONE as JOB_DONE, PENDING as JOB_PENDING, RUNNING as JOB_RUNNING, JobManager
+from plan_cache import AGE_BANDS, PlanCache
+from plan_history import PlanHistory
+from plan_ir import plan_from_markdown, plan_to_markdown
+from plan_store import PlanStore, plan_hash
+from prefs_store import PreferenceStore, default_preferences
+from session_time import annotate_plan
+from storage import DATA_DIR
+
+@st.cache_resource
+def get_preference_store() -> PreferenceStore:
+    """Store preferenze condiviso dal processo (SQLite WAL + cache in memoria)."""
+    return PreferenceStore()
+
+def get_user_token() -> str:
+    """Token utente: dal parametro ?u= dell'URL, altrimenti ne genera uno nuovo."""
+    token = st.session_state.get("user_token") or st.query_params.get("u", "")
+    if not re.fullmatch(r"[A-Za-z0-9_-]{8,64}", token):
+        token = uuid.uuid4().hex[:16]
+    st.session_state["user_token"] = token
+    # Il token resta nell'URL così chi ricarica o salva il link ritrova le sue preferenze
+    if st.query_params.get("u") != token:
+        st.query_params["u"] = token
+    return token
+
+def load_preferences(token: str):
+    """Carica le preferenze salvate dall'ultimo uso di questo utente."""
+    defaults = default_preferences()
     try:
-        if os.path.exists(PREFS_FILE):
-            with open(PREFS_FILE, "r") as f:
-                saved = json.load(f)
-                defaults.update(saved)
-    except Exception:
+        defaults.update(get_preference_store().get(token) or {})
+    except sqlite3.Error:
         pass
     return defaults
 
-def save_preferences(prefs: dict):
-    """Salva le preferenze correnti su file."""
+def save_preferences(token: str, prefs: dict):
+    """Salva le preferenze correnti (scrive solo se sono cambiate)."""
     try:
-        with open(PREFS_FILE, "w") as f:
-            json.dump(prefs, f)
-    except Exception:
-        pass
+        get_preference_store().set(token, prefs)
+    except sqlite3.Error as e:
+        st.warning(f"Impossibile salvare le preferenze: {e}")
 
 def get_api_key():
     """Ottiene la API key da Streamlit secrets o variabile d'ambiente."""
-    # Prima prova Streamlit secrets (per Streamlit Cloud)
+    return warmup.gemini_api_key()
+
+def get_shared_hevy_api_key() -> str:
+    """API key Hevy del server, solo con HEVY_SHARED_ACCOUNT=1; non va mai mostrata nella pagina."""
+    if os.environ.get("HEVY_SHARED_ACCOUNT") != "1":
+        return ""
     try:
-        return st.secrets["GEMINI_API_KEY"]
+        return st.secrets["HEVY_API_KEY"]
     except Exception:
-        pass
-    # Poi prova variabile d'ambiente
-    env_key = os.environ.get("GEMINI_API_KEY")
-    if env_key:
-        return env_key
-    # Nessuna chiave trovata
-    return None
-
-# Carica preferenze all'avvio
-saved_prefs = load_preferences()
-
-# --- CONFIGURAZIONE ---
-st.set_page_config(
-    page_title="Hevy AI Architect", 
-    page_icon="🏋️‍♂️", 
-    layout="wide",
-    initial_sidebar_state="collapsed"  # Migliore per mobile
-)
-
-# --- CSS PERSONALIZZATO PER MOBILE E DESIGN PROFESSIONALE ---
-st.markdown("""
+        return os.environ.get("HEVY_API_KEY", "")
+
+# Profilazione opt-in del rerun (HEVY_PROFILE=1 o ?profile=1): altrimenti un oggetto nullo
+profiler = profiling.start(profiling.requested(st.query_params), "preferenze")
+
+try:
+    # Carica preferenze all'avvio
+    user_token = get_user_token()
+    saved_prefs = load_preferences(user_token)
+
+    # --- CONFIGURAZIONE ---
+    st.set_page_config(
+        page_title="Hevy AI Architect", 
+        page_icon="🏋️‍♂️", 
+        layout="wide",
+        initial_sidebar_state="collapsed"  # Migliore per mobile
+    )
+
+    # --- CSS PERSONALIZZATO PER MOBILE E DESIGN PROFESSIONALE ---
+    profiler.mark("css")
+    st.markdown("""
 <style>
     /* Import Google Fonts */
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap');
@@ -186,7 +216,7 @@ st.markdown("""
     }
     
     /* ===== BOTTONI ===== */
-    .stButton > button {
+    .stButton > button, .stFormSubmitButton > button {
         width: 100%;
         background: linear-gradient(135deg, #FF4B4B 0%, #FF6B6B 100%);
         color: white !important;
@@ -199,7 +229,7 @@ st.markdown("""
         box-shadow: 0 4px 15px rgba(255,75,75,0.3);
     }
     
-    .stButton > button:hover {
+    .stButton > button:hover, .stFormSubmitButton > button:hover {
         transform: translateY(-2px);
         box-shadow: 0 6px 20px rgba(255,75,75,0.5);
         background: linear-gradient(135deg, #FF6B6B 0%, #FF8E53 100%);
@@ -364,7 +394,7 @@ st.markdown("""
             width: 100% !important;
         }
         
-        .stButton > button {
+        .stButton > button, .stFormSubmitButton > button {
             padding: 0.8rem;
             font-size: 1rem;
         }
@@ -681,314 +711,226 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Ottieni API key
-GOOGLE_API_KEY = get_api_key()
+    profiler.mark("api e stato")
 
-# Verifica che la chiave sia configurata
-if not GOOGLE_API_KEY:
-    st.error("⚠️ API Key non configurata! Aggiungi GEMINI_API_KEY nei secrets di Streamlit Cloud o come variabile d'ambiente.")
-    st.stop()
+    # Ottieni API key
+    GOOGLE_API_KEY = get_api_key()
 
-# Configura il modello
-try:
-    client = genai.Client(api_key=GOOGLE_API_KEY)
-except Exception as e:
-    st.error(f"Errore configurazione API: {e}")
-    st.stop()
+    # Verifica che la chiave sia configurata
+    if not GOOGLE_API_KEY:
+        st.error("⚠️ API Key non configurata! Aggiungi GEMINI_API_KEY nei secrets di Streamlit Cloud o come variabile d'ambiente.")
+        st.stop()
 
-# Stato iniziale per la scheda generata
-if "plan_md" not in st.session_state:
-    st.session_state["plan_md"] = ""
+    # Configura il modello (client condiviso dal processo)
+    try:
+        client = warmup.genai_client(GOOGLE_API_KEY)
+    except Exception as e:
+        st.error(f"Errore configurazione API: {e}")
+        st.stop()
 
+    # Senza serve.py il warm-up parte con la prima sessione (no-op se già avviato)
+    warmup.start(GOOGLE_API_KEY)
 
-def build_pdf_from_markdown(md_text: str) -> Optional[bytes]:
-    """Crea un PDF dal markdown con supporto migliorato alle tabelle."""
-    try:
-        from fpdf import FPDF
-    except ImportError:
-        st.error("Installa il pacchetto fpdf: pip install fpdf==1.7.2")
-        return None
-
-    def sanitize_text(text):
-        """Rimuove o sostituisce caratteri non supportati da latin-1."""
-        # Mappa emoji e caratteri speciali a testo ASCII
-        replacements = {
-            '✅': '[OK]', '❌': '[X]', '⚠️': '[!]', '💪': '', '🎯': '', 
-            '🤖': '', '📅': '', '📋': '', '🏠': '', '⚧': '', '🎂': '',
-            '📊': '', '⏱️': '', '🚀': '', '📥': '', '📚': '', '🏋️': '',
-            '❤️': '', '→': '->', '←': '<-', '↔': '<->', '•': '-',
-            '–': '-', '—': '-', '"': '"', '"': '"', ''': "'", ''': "'",
-            '…': '...', '°': 'deg', '×': 'x', '÷': '/', '≤': '<=',
-            '≥': '>=', '≠': '!=', '±': '+/-', '€': 'EUR', '£': 'GBP',
-            '¥': 'YEN', '©': '(c)', '®': '(R)', '™': '(TM)',
-        }
-        for old, new in replacements.items():
-            text = text.replace(old, new)
-        
-        # Rimuovi tutti i caratteri non latin-1
+    # Stato iniziale per la scheda generata
+    if "plan_md" not in st.session_state:
+        st.session_state["plan_md"] = ""
+    if "plan_ir" not in st.session_state:
+        st.session_state["plan_ir"] = None
+    # Profilo usato per l'ultima scheda (serve per le modifiche parziali)
+    if "plan_profile" not in st.session_state:
+        st.session_state["plan_profile"] = None
+
+
+    def build_pdf_from_markdown(md_text: str, images: Optional[list] = None) -> Optional[bytes]:
+        """Crea un PDF dal markdown con supporto migliorato alle tabelle."""
         try:
-            return text.encode('latin-1', errors='ignore').decode('latin-1')
-        except Exception:
-            # Fallback: rimuovi tutti i caratteri non ASCII
-            return ''.join(c if ord(c) < 128 else '' for c in text)
-
-    # Pulisci il testo markdown all'inizio
-    md_text = sanitize_text(md_text)
-
-    pdf = FPDF(orientation='L', format='A4')  # Landscape per tabelle più larghe
-    pdf.add_page()
-    pdf.set_auto_page_break(auto=True, margin=10)
-    
-    page_width = pdf.w - pdf.l_margin - pdf.r_margin
-    
-    def clean_markdown(text):
-        """Rimuove i marcatori markdown dal testo."""
-        return text.replace("**", "").replace("*", "").replace("__", "").replace("_", "")
-    
-    def is_bold_text(text):
-        """Controlla se il testo è in grassetto markdown."""
-        return text.strip().startswith("**") and text.strip().endswith("**")
-
-    def render_table(table_lines):
-        # Parse table lines
-        rows = []
-        for line in table_lines:
-            stripped = line.strip()
-            if stripped.startswith("|") and stripped.endswith("|"):
-                cells = stripped.split("|")[1:-1]
-                cells = [cell.strip() for cell in cells]
-                rows.append(cells)
-            elif "|" in stripped:
-                cells = [cell.strip() for cell in stripped.strip("|").split("|")]
-                rows.append(cells)
-        
-        if not rows:
-            return
-        
-        # Remove separator row (dashes like |---|---|)
-        cleaned_rows = []
-        for r in rows:
-            is_separator = all(
-                set(c.replace(" ", "").replace(":", "")) <= set("-") 
-                for c in r if c
+            return pdf_export.build_pdf_from_markdown(md_text, images)
+        except ImportError as e:
+            st.error(str(e))
+            return None
+
+    def thumbnails_enabled() -> bool:
+        """Miniature disponibili: mirror delle immagini presente e file statici serviti da Streamlit."""
+        return bool(st.get_option("server.enableStaticServing")) and os.path.isdir(exercise_images.IMAGES_DIR)
+
+    def display_markdown(md_text: str) -> str:
+        """Markdown della scheda per lo schermo, con la miniatura di ogni esercizio se disponibile."""
+        if not thumbnails_enabled():
+            return md_text
+        ids_by_name = get_catalog_index(df_exercises).ids_by_name
+        return exercise_images.thumbnail_markdown(
+            md_text, lambda name: exercise_images.thumbnail_url(ids_by_name.get(name.lower()), "table")
+        )
+
+    def get_pdf_images(md_text: str) -> list:
+        """Figure degli esercizi della scheda per il PDF (senza doppioni, entro il budget di byte)."""
+        if not os.path.isdir(exercise_images.IMAGES_DIR):
+            return []
+        catalog_index = get_catalog_index(df_exercises)
+        plan = plan_from_markdown(md_text, catalog_index.ids_by_name)
+        return exercise_images.pdf_images([(r["id"], r["name"]) for d in plan["days"] for r in d["rows"] if r["id"]])
+
+    @st.cache_data(max_entries=32, show_spinner=False)
+    def get_pdf_bytes(md_text: str) -> Optional[bytes]:
+        """PDF in cache: ricostruito solo quando il Markdown della scheda cambia."""
+        return build_pdf_from_markdown(md_text, get_pdf_images(md_text))
+
+    def set_plan(plan_ir: dict, profile: Optional[dict] = None):
+        """Aggiorna scheda IR e Markdown in sessione (il PDF segue tramite la cache)."""
+        # Dopo sostituzioni e rigenerazioni di un giorno la durata stimata va ricalcolata
+        plan_ir = annotate_plan(plan_ir, get_catalog_index(df_exercises))
+        st.session_state["plan_ir"] = plan_ir
+        st.session_state["plan_md"] = plan_to_markdown(plan_ir)
+        if profile is not None:
+            st.session_state["plan_profile"] = profile
+
+    @st.cache_resource
+    def get_plan_history() -> PlanHistory:
+        """Storico schede condiviso dal processo."""
+        return PlanHistory()
+
+    def record_history(profile: dict, model: str, started: float):
+        """Salva nello storico la scheda appena generata (errori non bloccanti)."""
+        try:
+            get_plan_history().record(
+                st.session_state["user_token"], profile, model,
+                st.session_state["plan_md"], st.session_state.get("plan_ir"),
+                {"generation_ms": round((time.perf_counter() - started) * 1000, 1)}
             )
-            if not is_separator:
-                cleaned_rows.append(r)
-        
-        rows = cleaned_rows
-        if not rows:
-            return
-        
-        # Determine column count from header
-        col_count = len(rows[0]) if rows else 5
-        
-        # Fixed column widths for workout tables (5 columns)
-        # Esercizio: 55mm, Serie: 12mm, Ripetizioni: 18mm, Recupero: 16mm, Note: resto (ampia)
-        if col_count == 5:
-            # Esercizio | Serie | Ripetizioni | Recupero | Note Tecniche
-            col_widths = [55, 12, 18, 16, page_width - 101]
-        elif col_count == 4:
-            col_widths = [50, 20, 25, page_width - 95]
-        else:
-            col_widths = [page_width / col_count] * col_count
-        
-        total_width = sum(col_widths)
-        if total_width > page_width:
-            scale = page_width / total_width
-            col_widths = [w * scale for w in col_widths]
-        
-        base_row_height = 5
-        
-        def calc_row_height(row_cells, widths, font_size=6):
-            """Calcola l'altezza necessaria per una riga basata sul testo più lungo."""
-            max_lines = 1
-            for i, cell_text in enumerate(row_cells[:len(widths)]):
-                clean_text = clean_markdown(cell_text)
-                # Stima caratteri per linea basata sulla larghezza colonna
-                chars_per_line = max(1, int(widths[i] / (font_size * 0.4)))
-                if clean_text:
-                    lines_needed = max(1, (len(clean_text) + chars_per_line - 1) // chars_per_line)
-                    max_lines = max(max_lines, lines_needed)
-            return max(base_row_height, max_lines * base_row_height)
-        
-        # Stima altezza tabella
-        table_height = sum(calc_row_height(r, col_widths) for r in rows) + 10
-        space_left = pdf.h - pdf.b_margin - pdf.get_y()
-        page_height = pdf.h - pdf.t_margin - pdf.b_margin
-        
-        # Se la tabella non entra, vai a nuova pagina
-        if table_height > space_left and space_left < page_height * 0.5:
-            pdf.add_page()
-        
-        # Render header
-        pdf.set_font("Arial", "B", 7)
-        pdf.set_fill_color(220, 220, 220)
-        
-        if rows:
-            header = rows[0]
-            while len(header) < len(col_widths):
-                header.append("")
-            for i, cell_text in enumerate(header[:len(col_widths)]):
-                clean_text = clean_markdown(cell_text)
-                pdf.cell(col_widths[i], base_row_height, clean_text, border=1, ln=0, align="C", fill=True)
-            pdf.ln(base_row_height)
-        
-        # Render data rows con supporto multi-linea
-        pdf.set_font("Arial", "", 6)
-        for r in rows[1:]:
-            while len(r) < len(col_widths):
-                r.append("")
-            
-            first_cell = r[0] if r else ""
-            is_section_row = is_bold_text(first_cell)
-            
-            # Calcola altezza riga necessaria
-            row_h = calc_row_height(r, col_widths)
-            
-            # Check if we need a new page for this row
-            if pdf.get_y() + row_h > pdf.h - pdf.b_margin:
-                pdf.add_page()
-                # Reprint header on new page
-                pdf.set_font("Arial", "B", 7)
-                pdf.set_fill_color(220, 220, 220)
-                header = rows[0]
-                for i, cell_text in enumerate(header[:len(col_widths)]):
-                    clean_text = clean_markdown(cell_text)
-                    pdf.cell(col_widths[i], base_row_height, clean_text, border=1, ln=0, align="C", fill=True)
-                pdf.ln(base_row_height)
-                pdf.set_font("Arial", "", 6)
-            
-            # Salva posizione Y iniziale della riga
-            y_start = pdf.get_y()
-            x_start = pdf.l_margin
-            
-            # Prima passa: disegna le celle con bordi e testo
-            for i, cell_text in enumerate(r[:len(col_widths)]):
-                clean_text = clean_markdown(cell_text)
-                
-                if is_section_row and i == 0:
-                    pdf.set_font("Arial", "B", 6)
-                else:
-                    pdf.set_font("Arial", "", 6)
-                
-                # Posiziona alla colonna corretta
-                x_pos = x_start + sum(col_widths[:i])
-                pdf.set_xy(x_pos, y_start)
-                
-                # Disegna bordo cella
-                pdf.rect(x_pos, y_start, col_widths[i], row_h)
-                
-                # Per l'ultima colonna (Note), usa multi_cell per testo lungo
-                if i == len(col_widths) - 1 and len(clean_text) > 30:
-                    pdf.set_xy(x_pos + 1, y_start + 0.5)
-                    # Multi_cell senza bordo, il bordo è già disegnato
-                    old_l_margin = pdf.l_margin
-                    old_r_margin = pdf.r_margin
-                    pdf.set_left_margin(x_pos + 1)
-                    pdf.set_right_margin(pdf.w - x_pos - col_widths[i] + 1)
-                    pdf.multi_cell(col_widths[i] - 2, base_row_height - 1, clean_text, border=0, align="L")
-                    pdf.set_left_margin(old_l_margin)
-                    pdf.set_right_margin(old_r_margin)
-                else:
-                    # Celle normali: tronca se necessario
-                    chars_per_line = max(1, int(col_widths[i] / 2.5))
-                    display_text = clean_text[:chars_per_line] if len(clean_text) > chars_per_line else clean_text
-                    pdf.set_xy(x_pos + 0.5, y_start + (row_h - base_row_height) / 2 + 0.5)
-                    pdf.cell(col_widths[i] - 1, base_row_height, display_text, border=0, ln=0, align="L")
-            
-            # Muovi alla prossima riga
-            pdf.set_y(y_start + row_h)
-        
-        pdf.ln(3)
-
-    # Process markdown
-    pdf.set_font("Arial", "", 10)
-    lines = md_text.splitlines()
-    buffer_table = []
-    
-    for line in lines:
-        stripped = line.strip()
-        
-        # Detect table lines
-        if stripped.startswith("|"):
-            buffer_table.append(line)
-            continue
-        
-        # Flush table buffer if we were in a table
-        if buffer_table:
-            render_table(buffer_table)
-            buffer_table = []
-        
-        # Handle headers
-        if stripped.startswith("###"):
-            pdf.set_font("Arial", "B", 11)
-            clean_text = clean_markdown(stripped.replace("#", "").strip())
-            pdf.multi_cell(0, 6, txt=clean_text)
-            pdf.set_font("Arial", "", 10)
-        elif stripped.startswith("##"):
-            pdf.set_font("Arial", "B", 12)
-            clean_header = clean_markdown(stripped.replace("#", "").strip())
-            pdf.multi_cell(0, 7, txt=clean_header)
-            pdf.set_font("Arial", "", 10)
-        elif stripped.startswith("#"):
-            pdf.set_font("Arial", "B", 14)
-            clean_header = clean_markdown(stripped.replace("#", "").strip())
-            pdf.multi_cell(0, 8, txt=clean_header)
-            pdf.set_font("Arial", "", 10)
-        elif stripped.startswith("---"):
-            pdf.ln(2)
-            pdf.line(pdf.l_margin, pdf.get_y(), pdf.w - pdf.r_margin, pdf.get_y())
-            pdf.ln(2)
-        elif stripped:
-            # Check if text is bold
-            if is_bold_text(stripped):
-                pdf.set_font("Arial", "B", 10)
-                clean_text = clean_markdown(stripped)
-                pdf.multi_cell(0, 5, txt=clean_text)
-                pdf.set_font("Arial", "", 10)
+        except sqlite3.Error:
+            pass
+
+    @st.cache_resource
+    def get_plan_store() -> PlanStore:
+        """Archivio delle schede condivisibili (content-addressed)."""
+        return PlanStore()
+
+    @st.cache_resource
+    def get_plan_cache() -> PlanCache:
+        """Schede pre-generate per i profili più richiesti (riempita da warm_cache.py)."""
+        return PlanCache()
+
+    def get_cached_plan(profile: dict) -> Optional[dict]:
+        """Scheda in cache (esatta o di un profilo vicino, adattata) per il catalogo corrente."""
+        # Stesso profilo della scheda a schermo: l'utente vuole una variante nuova
+        if st.session_state.get("plan_md") and st.session_state.get("plan_profile") == profile:
+            return None
+        try:
+            return get_plan_cache().lookup(profile, catalog_meta.catalog_hash, get_catalog_index(df_exercises))
+        except sqlite3.Error:
+            return None
+
+    @st.cache_resource
+    def get_export_store() -> ExportStore:
+        """Template Hevy, associazioni col catalogo e routine già caricate."""
+        return ExportStore()
+
+    @st.cache_resource(max_entries=32)
+    def get_hevy_client(api_key: str) -> HevyClient:
+        """Sessione HTTP con pool di connessioni riusata tra i rerun, una per API key."""
+        return HevyClient(api_key)
+
+    @st.cache_data(max_entries=64, show_spinner=False)
+    def get_shared_pdf(plan_key: str, _md_text: str) -> Optional[bytes]:
+        """PDF della scheda condivisa: dall'archivio se presente, altrimenti generato e salvato."""
+        try:
+            pdf_bytes = get_plan_store().get_pdf(plan_key)
+            if pdf_bytes is None:
+                pdf_bytes = get_pdf_bytes(_md_text)
+                if pdf_bytes:
+                    get_plan_store().put_pdf(plan_key, pdf_bytes)
+            return pdf_bytes
+        except sqlite3.Error:
+            return get_pdf_bytes(_md_text)
+
+    # Link condiviso (?plan=<hash>): mostra la scheda salvata senza chiamare il modello
+    shared_key = st.query_params.get("plan")
+    if shared_key:
+        if shared_key != st.session_state.get("plan_hash"):
+            try:
+                shared_plan = get_plan_store().get(shared_key)
+            except sqlite3.Error:
+                shared_plan = None
+            if shared_plan:
+                st.session_state["plan_md"] = shared_plan["plan_md"]
+                st.session_state["plan_ir"] = shared_plan["plan_ir"]
+                st.session_state["plan_profile"] = shared_plan["profile"] or None
+                st.session_state["plan_hash"] = shared_key
             else:
-                clean_text = clean_markdown(stripped)
-                pdf.multi_cell(0, 5, txt=clean_text)
-        else:
-            pdf.ln(2)
-    
-    # Flush any remaining table
-    if buffer_table:
-        render_table(buffer_table)
+                st.warning("🔗 Link della scheda non valido o scaduto.")
+        # Nella barra degli indirizzi resta solo ?u=, il token personale: ?plan= e ?u= mai nello
+        # stesso URL, così copiando l'indirizzo non si condividono preferenze e storico
+        del st.query_params["plan"]
 
-    return pdf.output(dest="S").encode("latin-1")
+    def share_url(plan_key: str) -> str:
+        """Link pubblico della scheda (solo ?plan=, senza il token utente)."""
+        headers = st.context.headers
+        host = headers.get("X-Forwarded-Host") or headers.get("Host")
+        if not host:
+            return f"?plan={plan_key}"
+        scheme = headers.get("X-Forwarded-Proto") or "http"
+        base_path = (st.get_option("server.baseUrlPath") or "").strip("/")
+        return f"{scheme}://{host}/{base_path + '/' if base_path else ''}?plan={plan_key}"
 
-# --- CARICAMENTO DATABASE ---
-@st.cache_data
-def get_available_model():
-    try:
-        models = list(client.models.list())
-        for model in models:
-            actions = getattr(model, "supported_actions", [])
-            if "generateContent" in actions:
-                return model.name.split("/")[-1]
-        # Fallback a un modello generico
-        return "gemini-2.5-flash"
-    except Exception as e:
-        st.warning(f"Impossibile listare i modelli: {e}")
-        return "gemini-2.5-flash"
+    @st.cache_resource
+    def start_metrics_server():
+        """Endpoint /metrics per Prometheus su HEVY_METRICS_PORT (disattivato se non impostata)."""
+        if not metrics.METRICS_PORT:
+            return None
+        try:
+            return metrics.start_server()
+        except OSError:
+            # Porta già occupata (es. un altro processo dell'app): le metriche restano locali
+            return None
 
-@st.cache_data
-def load_data():
-    try:
-        # Usa il percorso assoluto del file
-        csv_path = os.path.join(os.path.dirname(__file__), "exercises_db.csv")
-        return pd.read_csv(csv_path)
-    except Exception as e:
-        st.error(f"Errore nel caricamento del CSV: {e}")
-        return pd.DataFrame()
+    start_metrics_server()
+
+    @st.cache_resource
+    def get_job_manager() -> JobManager:
+        """Esecutore dei job di generazione, unico per processo."""
+        return JobManager()
+
+    profiler.mark("catalogo")
+
+    # --- CARICAMENTO DATABASE ---
+    def get_available_model():
+        """Modello da usare; la cache è in warmup, che conserva solo le risposte riuscite."""
+        model, error = warmup.available_model(GOOGLE_API_KEY)
+        if error:
+            st.warning(f"Impossibile listare i modelli: {error}")
+        return model
+
+    @st.cache_data
+    def load_data():
+        try:
+            # Già letto dal warm-up del processo
+            return warmup.catalog_frame()
+        except Exception as e:
+            st.error(f"Errore nel caricamento del CSV: {e}")
+            return pd.DataFrame()
+
+    df_exercises = load_data()
+
+    @st.cache_resource
+    def get_catalog_index(df: pd.DataFrame) -> CatalogIndex:
+        """Indici del catalogo per il motore locale (costruiti una volta sola)."""
+        return warmup.catalog_index(df)
 
-df_exercises = load_data()
+    @st.cache_resource
+    def get_catalog_metadata(df: pd.DataFrame) -> CatalogMetadata:
+        """Facet, etichette tradotte, conteggi e hash del catalogo (una volta per versione)."""
+        meta = warmup.catalog_metadata(get_catalog_index(df))
+        metrics.set_catalog(meta.catalog_hash, meta.total)
+        return meta
 
-# --- INTERFACCIA UTENTE ---
+    catalog_meta = get_catalog_metadata(df_exercises)
 
-# Indicatore mobile per aprire il menu (solo su mobile) - SOPRA IL TITOLO
-st.markdown("""
+    profiler.mark("intestazione")
+
+    # --- INTERFACCIA UTENTE ---
+
+    # Indicatore mobile per aprire il menu (solo su mobile) - SOPRA IL TITOLO
+    st.markdown("""
 <style>
     .mobile-hint {
         display: none;
@@ -1042,54 +984,127 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Header professionale
-st.markdown('<h1 class="main-header">🏋️ Hevy AI Architect</h1>', unsafe_allow_html=True)
-st.markdown('<p class="sub-header">Genera schede di allenamento personalizzate con l\'intelligenza artificiale</p>', unsafe_allow_html=True)
-
-# Statistiche database
-col_stat1, col_stat2, col_stat3 = st.columns(3)
-with col_stat1:
-    st.metric("💪 Esercizi", f"{len(df_exercises)}+")
-with col_stat2:
-    if not df_exercises.empty and 'muscle_group' in df_exercises.columns:
-        st.metric("🎯 Gruppi Muscolari", len(df_exercises['muscle_group'].unique()))
-    else:
-        st.metric("🎯 Gruppi Muscolari", "N/A")
-with col_stat3:
-    st.metric("🤖 Modello AI", "Gemini Pro")
-
-# Placeholder per lo spinner (apparirà SOPRA le foto)
-spinner_placeholder = st.empty()
-
-# Galleria immagini centrale con dissolvenza
-def get_image_base64(image_path):
-    """Converte un'immagine in base64 per embedding HTML."""
-    try:
-        with open(image_path, "rb") as img_file:
-            return base64.b64encode(img_file.read()).decode()
-    except Exception:
-        return None
+    # Header professionale
+    st.markdown('<h1 class="main-header">🏋️ Hevy AI Architect</h1>', unsafe_allow_html=True)
+    st.markdown('<p class="sub-header">Genera schede di allenamento personalizzate con l\'intelligenza artificiale</p>', unsafe_allow_html=True)
+
+    # Statistiche database
+    col_stat1, col_stat2, col_stat3 = st.columns(3)
+    with col_stat1:
+        st.metric("💪 Esercizi", f"{catalog_meta.total}+")
+    with col_stat2:
+        if catalog_meta.total:
+            st.metric("🎯 Gruppi Muscolari", len(catalog_meta.facet_values["muscle_group"]))
+        else:
+            st.metric("🎯 Gruppi Muscolari", "N/A")
+    with col_stat3:
+        st.metric("🤖 Modello AI", "Gemini Pro")
+
+    LOADING_BAR_HTML = '''
+<div class="loading-container">
+    <div class="loading-text">🧬 L'IA sta analizzando la biomeccanica e costruendo il programma...</div>
+    <div class="loading-bar-wrapper">
+        <div class="loading-bar"></div>
+    </div>
+    <div class="loading-subtext">Ottimizzazione esercizi in corso...</div>
+</div>
+'''
 
-photo_dir = os.path.join(os.path.dirname(__file__), "photo")
-photo30_path = os.path.join(photo_dir, "photo30.jpg")
-photo31_path = os.path.join(photo_dir, "photo31.jpg")
+    LIMIT_BANNER_HTML = '''
+<div style="background: linear-gradient(135deg, rgba(255,50,50,0.2) 0%, rgba(180,30,30,0.15) 100%); 
+            border: 2px solid #FF3333; 
+            border-radius: 12px; 
+            padding: 20px; 
+            text-align: center;
+            margin: 1rem 0;">
+    <span style="font-size: 3rem;">❌</span>
+    <h3 style="color: #FF6B6B; margin: 10px 0;">Limite sessioni raggiunto</h3>
+    <p style="color: #E0E0E0; font-size: 1rem;">Riprova tra qualche ora...</p>
+</div>
+'''
 
-# Prova anche estensioni alternative
-if not os.path.exists(photo30_path):
-    photo30_path = os.path.join(photo_dir, "photo30.png")
-if not os.path.exists(photo31_path):
-    photo31_path = os.path.join(photo_dir, "photo31.png")
+    @st.fragment(run_every=2)
+    def poll_generation_job():
+        """Controlla il job di generazione senza rieseguire l'intera pagina."""
+        job = get_job_manager().get(st.session_state["job_id"], user_token)
+        if job is not None and job["status"] in (JOB_PENDING, JOB_RUNNING):
+            st.markdown(LOADING_BAR_HTML, unsafe_allow_html=True)
+            return
+        
+        st.session_state["job_id"] = None
+        if "job" in st.query_params:
+            del st.query_params["job"]
+        if job is None:
+            pass
+        elif job["status"] == JOB_DONE and job["result"]["plan_md"]:
+            st.session_state["plan_md"] = job["result"]["plan_md"]
+            st.session_state["plan_ir"] = job["result"]["plan_ir"]
+            st.session_state["plan_profile"] = job["profile"]
+            st.session_state["generation_notice"] = ("success", "✅ Scheda generata con successo!")
+        elif job["status"] == JOB_DONE:
+            st.session_state["generation_notice"] = ("error", "❌ La risposta dell'AI è vuota. Riprova.")
+        else:
+            # API non disponibile (rate limit, quota, rete): ripiega sul motore locale
+            plan_ir = build_plan(job["profile"], get_catalog_index(df_exercises))
+            if plan_ir["days"]:
+                set_plan(plan_ir, job["profile"])
+                record_history(job["profile"], "motore-locale (ripiego)", time.perf_counter())
+                st.session_state["generation_notice"] = (
+                    "warning", "⚠️ Servizio AI momentaneamente non disponibile: ecco una scheda generata dal motore locale."
+                )
+            else:
+                st.session_state["generation_notice"] = ("limit", None)
+        st.rerun()
 
-photo30_b64 = get_image_base64(photo30_path)
-photo31_b64 = get_image_base64(photo31_path)
+    # Placeholder per lo spinner (apparirà SOPRA le foto)
+    spinner_placeholder = st.empty()
 
-# Determina il tipo MIME in base all'estensione
-ext30 = "png" if photo30_path.endswith(".png") else "jpeg"
-ext31 = "png" if photo31_path.endswith(".png") else "jpeg"
+    # Sessione riconnessa: riprendi il job indicato nell'URL
+    if not st.session_state.get("job_id") and st.query_params.get("job"):
+        st.session_state["job_id"] = st.query_params["job"]
 
-# Mostra galleria grande solo se NON c'è una scheda generata
-if photo30_b64 and photo31_b64 and not st.session_state.get("plan_md"):
-    st.markdown(f'''
+    if st.session_state.get("job_id"):
+        with spinner_placeholder.container():
+            poll_generation_job()
+    elif st.session_state.get("generation_notice"):
+        notice_kind, notice_text = st.session_state.pop("generation_notice")
+        if notice_kind == "limit":
+            spinner_placeholder.markdown(LIMIT_BANNER_HTML, unsafe_allow_html=True)
+        else:
+            getattr(spinner_placeholder, notice_kind)(notice_text)
+
+    profiler.mark("immagini")
+
+    # Galleria immagini centrale con dissolvenza
+    @st.cache_data(show_spinner=False)
+    def get_image_base64(image_path):
+        """Converte un'immagine in base64 per embedding HTML."""
+        try:
+            with open(image_path, "rb") as img_file:
+                return base64.b64encode(img_file.read()).decode()
+        except Exception:
+            return None
+
+    photo_dir = os.path.join(os.path.dirname(__file__), "photo")
+    photo30_path = os.path.join(photo_dir, "photo30.jpg")
+    photo31_path = os.path.join(photo_dir, "photo31.jpg")
+
+    # Prova anche estensioni alternative
+    if not os.path.exists(photo30_path):
+        photo30_path = os.path.join(photo_dir, "photo30.png")
+    if not os.path.exists(photo31_path):
+        photo31_path = os.path.join(photo_dir, "photo31.png")
+
+    photo30_b64 = get_image_base64(photo30_path)
+    photo31_b64 = get_image_base64(photo31_path)
+
+    # Determina il tipo MIME in base all'estensione
+    ext30 = "png" if photo30_path.endswith(".png") else "jpeg"
+    ext31 = "png" if photo31_path.endswith(".png") else "jpeg"
+
+    # Mostra galleria grande solo se NON c'è una scheda generata
+    if photo30_b64 and photo31_b64 and not st.session_state.get("plan_md"):
+        st.markdown(f'''
     <div class="gallery-container">
         <div class="gallery-image">
             <img src="data:image/{ext30};base64,{photo30_b64}" alt="Fitness Training">
@@ -1100,54 +1115,23 @@ if photo30_b64 and photo31_b64 and not st.session_state.get("plan_md"):
     </div>
     ''', unsafe_allow_html=True)
 
-st.markdown("---")
-
-# Liste opzioni
-GOALS_OPTIONS = ["Ipertrofia (Massa)", "Dimagrimento (Cutting)", "Forza Pura", "Miglioramento Posturale", "Tonificazione"]
-SPLIT_OPTIONS = ["Full Body", "Alto/Basso", "Spinta/Tirata/Gambe", "Split per Gruppo Muscolare"]
-EQUIPMENT_OPTIONS = ["Con attrezzi", "Senza attrezzi"]
-SEX_OPTIONS = ["Maschio", "Femmina"]
-LEVEL_OPTIONS = ["Principiante", "Esperto", "Super Esperto"]
-
-# Traduzione gruppi muscolari inglese -> italiano
-MUSCLE_TRANSLATION = {
-    "Chest": "Petto",
-    "Back": "Schiena",
-    "Middle Back": "Dorsali",
-    "Shoulders": "Spalle",
-    "Biceps": "Bicipiti",
-    "Triceps": "Tricipiti",
-    "Legs": "Gambe",
-    "Quadriceps": "Quadricipiti",
-    "Hamstrings": "Femorali",
-    "Glutes": "Glutei",
-    "Calves": "Polpacci",
-    "Abs": "Addominali",
-    "Abdominals": "Addominali",
-    "Core": "Core",
-    "Forearms": "Avambracci",
-    "Traps": "Trapezio",
-    "Lats": "Dorsali",
-    "Lower Back": "Lombari",
-    "Full Body": "Tutto il Corpo",
-    "Cardio": "Cardio",
-    "Neck": "Collo",
-    "Abductors": "Abduttori",
-    "Adductors": "Adduttori",
-    "Other": "Altro"
-}
-
-def translate_muscle(muscle):
-    """Traduce il nome del gruppo muscolare in italiano."""
-    return MUSCLE_TRANSLATION.get(muscle, muscle)
-
-with st.sidebar:
-    # Logo/Brand
-    st.markdown("### 🏋️ Configura il tuo Allenamento")
-    
-    # Info box in alto
-    with st.expander("ℹ️ Come funziona", expanded=False):
-        st.markdown("""
+    st.markdown("---")
+
+    # Liste opzioni
+    GOALS_OPTIONS = ["Ipertrofia (Massa)", "Dimagrimento (Cutting)", "Forza Pura", "Miglioramento Posturale", "Tonificazione"]
+    SPLIT_OPTIONS = ["Full Body", "Alto/Basso", "Spinta/Tirata/Gambe", "Split per Gruppo Muscolare"]
+    EQUIPMENT_OPTIONS = ["Con attrezzi", "Senza attrezzi"]
+    SEX_OPTIONS = ["Maschio", "Femmina"]
+    LEVEL_OPTIONS = ["Principiante", "Esperto", "Super Esperto"]
+
+    profiler.mark("sidebar")
+    with st.sidebar:
+        # Logo/Brand
+        st.markdown("### 🏋️ Configura il tuo Allenamento")
+        
+        # Info box in alto
+        with st.expander("ℹ️ Come funziona", expanded=False):
+            st.markdown("""
         1. **Configura** i tuoi obiettivi e preferenze
         2. **Genera** la scheda con l'AI
         3. **Scarica** il PDF personalizzato
@@ -1155,76 +1139,94 @@ with st.sidebar:
         L'AI analizza oltre 800 esercizi per creare 
         il programma perfetto per te!
         """)
-    
-    st.markdown("---")
-    
-    st.markdown("## 🎯 Obiettivi")
-    
-    # Filtra goals salvati che sono ancora validi
-    default_goals = [g for g in saved_prefs.get("goals", []) if g in GOALS_OPTIONS]
-    if not default_goals:
-        default_goals = ["Ipertrofia (Massa)"]
-    
-    goals = st.multiselect(
-        "Seleziona uno o più obiettivi",
-        GOALS_OPTIONS,
-        default=default_goals,
-        help="Puoi selezionare più obiettivi contemporaneamente"
-    )
-    if not goals:
-        goals = ["Equilibrato"]
-    
-    days = st.slider("📅 Giorni a settimana", 2, 6, saved_prefs.get("days", 4))
-    
-    split_idx = SPLIT_OPTIONS.index(saved_prefs.get("split_type", "Full Body")) if saved_prefs.get("split_type") in SPLIT_OPTIONS else 0
-    split_type = st.selectbox("📋 Divisione lavoro giornaliero", SPLIT_OPTIONS, index=split_idx)
-    
-    st.markdown("---")
-    st.markdown("## 👤 Profilo Personale")
-    
-    if not df_exercises.empty and 'muscle_group' in df_exercises.columns:
-        muscle_options_raw = list(df_exercises['muscle_group'].unique())
-        # Traduci i nomi dei muscoli in italiano
-        muscle_options_translated = [translate_muscle(m) for m in muscle_options_raw]
-        # Mappa italiano -> inglese per il filtro
-        muscle_map_it_to_en = {translate_muscle(m): m for m in muscle_options_raw}
-        default_focus = [translate_muscle(f) for f in saved_prefs.get("focus_area", []) if f in muscle_options_raw or translate_muscle(f) in muscle_options_translated]
-        focus_area_it = st.multiselect("🎯 Focus Muscolare (Opzionale)", sorted(set(muscle_options_translated)), default=default_focus, help="Lascia vuoto per un allenamento bilanciato")
-        # Riconverti in inglese per il prompt
-        focus_area = [muscle_map_it_to_en.get(f, f) for f in focus_area_it]
-    else:
-        focus_area = []
-        st.warning("Nessun dato disponibile per il filtro muscolare")
-    
-    # Due colonne per sesso e attrezzatura
-    col1, col2 = st.columns(2)
-    with col1:
-        sex_idx = SEX_OPTIONS.index(saved_prefs.get("sex_pref", "Maschio")) if saved_prefs.get("sex_pref") in SEX_OPTIONS else 0
-        sex_pref = st.selectbox("⚧ Sesso", SEX_OPTIONS, index=sex_idx)
-    with col2:
-        equip_idx = EQUIPMENT_OPTIONS.index(saved_prefs.get("equipment_pref", "Con attrezzi")) if saved_prefs.get("equipment_pref") in EQUIPMENT_OPTIONS else 0
-        equipment_pref = st.selectbox("🏠 Attrezzi", EQUIPMENT_OPTIONS, index=equip_idx)
-    
-    age = st.slider("🎂 Età", 16, 80, saved_prefs.get("age", 30))
-    
-    # Mappa vecchi valori ai nuovi per retrocompatibilità
-    old_level_map = {"Beginner": "Principiante", "Intermediate": "Esperto", "Pro": "Super Esperto"}
-    saved_level = saved_prefs.get("training_level", "Principiante")
-    if saved_level in old_level_map:
-        saved_level = old_level_map[saved_level]
-    level_idx = LEVEL_OPTIONS.index(saved_level) if saved_level in LEVEL_OPTIONS else 0
-    training_level = st.selectbox("📊 Livello Esperienza", LEVEL_OPTIONS, index=level_idx)
-    
-    duration = st.slider("⏱️ Durata seduta (min)", 30, 90, saved_prefs.get("duration", 60))
-    
-    st.markdown("---")
-    
-    generate_btn = st.button("🚀 Genera Scheda AI", type="primary", use_container_width=True)
+        
+        st.markdown("---")
+        
+        # Tutti i campi in un form: la pagina si riesegue una sola volta, all'invio
+        with st.form("profile_form", border=False):
+            st.markdown("## 🎯 Obiettivi")
+        
+            # Filtra goals salvati che sono ancora validi
+            default_goals = [g for g in saved_prefs.get("goals", []) if g in GOALS_OPTIONS]
+            # Nessun obiettivo salvato ("Equilibrato") resta una selezione vuota
+            if not default_goals and saved_prefs.get("goals") != ["Equilibrato"]:
+                default_goals = ["Ipertrofia (Massa)"]
+        
+            goals = st.multiselect(
+                "Seleziona uno o più obiettivi",
+                GOALS_OPTIONS,
+                default=default_goals,
+                help="Puoi selezionare più obiettivi contemporaneamente"
+            )
+            if not goals:
+                goals = ["Equilibrato"]
+        
+            days = st.slider("📅 Giorni a settimana", 2, 6, saved_prefs.get("days", 4))
+        
+            split_idx = SPLIT_OPTIONS.index(saved_prefs.get("split_type", "Full Body")) if saved_prefs.get("split_type") in SPLIT_OPTIONS else 0
+            split_type = st.selectbox("📋 Divisione lavoro giornaliero", SPLIT_OPTIONS, index=split_idx)
+        
+            st.markdown("---")
+            st.markdown("## 👤 Profilo Personale")
+        
+            if catalog_meta.total:
+                # Etichette italiane e mappa inversa precalcolate nei metadati del catalogo
+                default_focus = catalog_meta.labels_for_muscles(saved_prefs.get("focus_area", []))
+                focus_area_it = st.multiselect("🎯 Focus Muscolare (Opzionale)", catalog_meta.muscle_options, default=default_focus, help="Lascia vuoto per un allenamento bilanciato")
+                # Riconverti in inglese per il prompt
+                focus_area = catalog_meta.muscles_for_labels(focus_area_it)
+            else:
+                focus_area = []
+                st.warning("Nessun dato disponibile per il filtro muscolare")
+        
+            # Due colonne per sesso e attrezzatura
+            col1, col2 = st.columns(2)
+            with col1:
+                sex_idx = SEX_OPTIONS.index(saved_prefs.get("sex_pref", "Maschio")) if saved_prefs.get("sex_pref") in SEX_OPTIONS else 0
+                sex_pref = st.selectbox("⚧ Sesso", SEX_OPTIONS, index=sex_idx)
+            with col2:
+                equip_idx = EQUIPMENT_OPTIONS.index(saved_prefs.get("equipment_pref", "Con attrezzi")) if saved_prefs.get("equipment_pref") in EQUIPMENT_OPTIONS else 0
+                equipment_pref = st.selectbox("🏠 Attrezzi", EQUIPMENT_OPTIONS, index=equip_idx)
+        
+            age = st.slider("🎂 Età", 16, 80, saved_prefs.get("age", 30))
+        
+            # Mappa vecchi valori ai nuovi per retrocompatibilità
+            old_level_map = {"Beginner": "Principiante", "Intermediate": "Esperto", "Pro": "Super Esperto"}
+            saved_level = saved_prefs.get("training_level", "Principiante")
+            if saved_level in old_level_map:
+                saved_level = old_level_map[saved_level]
+            level_idx = LEVEL_OPTIONS.index(saved_level) if saved_level in LEVEL_OPTIONS else 0
+            training_level = st.selectbox("📊 Livello Esperienza", LEVEL_OPTIONS, index=level_idx)
+        
+            duration = st.slider("⏱️ Durata seduta (min)", 30, 90, saved_prefs.get("duration", 60))
+        
+            weeks = st.slider(
+                "🗓️ Durata programma (settimane)", 1, 12, saved_prefs.get("weeks", 1),
+                help="Le settimane dopo la prima vengono calcolate localmente (progressione e scarico), senza costi aggiuntivi"
+            )
+        
+            engine_idx = ENGINE_OPTIONS.index(saved_prefs.get("engine_mode")) if saved_prefs.get("engine_mode") in ENGINE_OPTIONS else 0
+            engine_mode = st.selectbox(
+                "🧠 Modalità di generazione",
+                ENGINE_OPTIONS,
+                index=engine_idx,
+                help="Il motore locale applica le stesse regole dell'AI in pochi millisecondi, senza consumare quota"
+            )
+        
+            structured_output = st.checkbox(
+                "⚡ Output strutturato (più veloce)",
+                value=saved_prefs.get("structured_output", True),
+                help="L'AI restituisce solo gli ID degli esercizi in JSON; nomi e tabelle vengono ricostruiti localmente"
+            )
+        
+            st.markdown("---")
+        
+            generate_btn = st.form_submit_button("🚀 Genera Scheda AI", type="primary", use_container_width=True)
 
-# Funzione per chiudere la sidebar via JavaScript
-def collapse_sidebar():
-    """Inietta JavaScript per chiudere la sidebar."""
-    js = """
+    # Funzione per chiudere la sidebar via JavaScript
+    def collapse_sidebar():
+        """Inietta JavaScript per chiudere la sidebar."""
+        js = """
     <script>
         // Cerca il pulsante di chiusura sidebar e cliccalo
         var sidebar = window.parent.document.querySelector('[data-testid="stSidebar"]');
@@ -1245,157 +1247,259 @@ def collapse_sidebar():
         }
     </script>
     """
-    components.html(js, height=0)
-
-# --- LOGICA AI ---
-if generate_btn:
-    # Chiudi la sidebar per dare spazio ai risultati
-    collapse_sidebar()
-    
-    # Salva le preferenze correnti
-    current_prefs = {
-        "goals": goals if goals != ["Equilibrato"] else ["Ipertrofia (Massa)"],
-        "days": days,
-        "split_type": split_type,
-        "focus_area": focus_area,
-        "equipment_pref": equipment_pref,
-        "sex_pref": sex_pref,
-        "age": age,
-        "training_level": training_level,
-        "duration": duration
-    }
-    save_preferences(current_prefs)
-    
-    if df_exercises.empty:
-        st.error("Errore: Il file 'exercises_db.csv' non è stato trovato!")
-    else:
-        # Mostra la barra di caricamento custom
-        with spinner_placeholder.container():
-            st.markdown('''
-            <div class="loading-container">
-                <div class="loading-text">🧬 L'IA sta analizzando la biomeccanica e costruendo il programma...</div>
-                <div class="loading-bar-wrapper">
-                    <div class="loading-bar"></div>
-                </div>
-                <div class="loading-subtext">Ottimizzazione esercizi in corso...</div>
-            </div>
-            ''', unsafe_allow_html=True)
+        components.html(js, height=0)
+
+    profiler.mark("generazione")
+
+    # --- LOGICA AI ---
+    if st.session_state.pop("collapse_sidebar", False):
+        collapse_sidebar()
+
+    if generate_btn:
+        # Chiudi la sidebar per dare spazio ai risultati
+        collapse_sidebar()
+        st.session_state["collapse_sidebar"] = True
         
-        # Esegui la generazione
-        # 1. Creiamo il contesto per l'IA (Prompt Engineering Avanzato)
-        # Trasformiamo il dataframe in una stringa di testo per darlo in pasto all'IA
-        exercises_list_str = df_exercises.to_string(index=False)
+        # Salva le preferenze correnti
+        current_prefs = {
+            # "Equilibrato" (nessun obiettivo scelto) arriva tale e quale a prompt e motore locale
+            "goals": goals,
+            "days": days,
+            "split_type": split_type,
+            "focus_area": focus_area,
+            "equipment_pref": equipment_pref,
+            "sex_pref": sex_pref,
+            "age": age,
+            "training_level": training_level,
+            "duration": duration,
+            "weeks": weeks,
+            "structured_output": structured_output,
+            "engine_mode": engine_mode
+        }
+        save_preferences(user_token, current_prefs)
         
-        prompt = f"""
-            Agisci come un Coach Esperto di biomeccanica e fisiologia sportiva.
-            Il tuo compito è creare una scheda di allenamento di {days} giorni a settimana.
-            
-            OBIETTIVI UTENTE: {", ".join(goals)}
-            TIPO DI SPLIT: {split_type}
-            DURATA MEDIA: {duration} minuti
-            FOCUS MUSCOLARE RICHIESTO: {", ".join(focus_area) if focus_area else "Equilibrato"}
-            ATTREZZATURA: {equipment_pref} (Con attrezzi → prediligi bilancieri, manubri, macchine; Senza attrezzi → prediligi corpo libero / elastici / varianti home)
-            SESSO: {sex_pref} (seleziona varianti ed esercizi adeguati a comfort articolare e preferenze tipiche)
-            ETA': {age} (adatta volume e intensità con progressioni adeguate all'età, cura mobilità e gestione carichi)
-            LIVELLO: {training_level} (Principiante: esercizi facili e stabili; Esperto: esercizi intermedi con varianti controllate; Super Esperto: esercizi complessi, carichi più alti, maggior densità)
-            
-            VINCOLO FONDAMENTALE:
-            Devi usare SOLO ed ESCLUSIVAMENTE gli esercizi presenti nel seguente database CSV. 
-            Non inventare esercizi che non sono in questa lista.
-            
-            DATABASE ESERCIZI DISPONIBILI:
-            {exercises_list_str}
-            
-            FORMATO OUTPUT RICHIESTO:
-            Restituisci una risposta strutturata in Markdown.
-            Per ogni Giorno (Giorno 1, Giorno 2...), elenca gli esercizi in una tabella con queste colonne:
-            | Esercizio | Serie | Ripetizioni | Recupero | Note Tecniche |
-            
-            Logica da applicare:
-            - Se l'obiettivo è Dimagrimento: Ripetizioni alte (12-15), recuperi brevi (60s).
-            - Se l'obiettivo è Ipertrofia: Ripetizioni medie (8-12), recuperi medi (90s).
-            - Se l'obiettivo è Forza: Ripetizioni basse (3-5), recuperi lunghi (120s+).
-            - Includi note sulla postura o l'esecuzione corretta.
-
-            Ordine fisiologicamente corretto degli esercizi per ogni giorno:
-            1) Warm-up / attivazione specifica
-            2) Multarticolari pesanti (bilanciere / macchina) su pattern principali del giorno
-            3) Unilaterali / stabilità
-            4) Complementari / isolamento mirato
-            5) Core / finisher metabolico (facoltativo)
-
-            Adatta la difficoltà in base al livello:
-            - Beginner: versioni stabili (macchine / bilanciere guidato), range moderato di carico, tecnica semplice, progressioni lineari.
-            - Intermediate: introduci varianti con maggiore ROM o instabilità controllata, gestione RIR 1-3, carichi moderati-alti.
-            - Pro: esercizi complessi (bilanciere libero, varianti avanzate), superset opzionali, RIR 0-2 su esercizi principali.
-
-            Adatta gli esercizi in base all'attrezzatura:
-            - Con attrezzi: priorità a bilancieri, manubri, macchine; corpo libero solo come complemento.
-            - Senza attrezzi: priorità a corpo libero, elastici, isometrie, varianti plyo controllate; evita macchine/pesi se non disponibili.
-
-            Adatta in base al sesso:
-            - Maschio: non serve modificare i carichi target, ma cura la progressione su pattern principali (spinta/tiro/gambe) senza trascurare mobilità.
-            - Femmina: includi focus su catena posteriore e glutei se coerente con gli obiettivi, prediligi varianti che riducano stress articolare su spalle/lombare.
-
-            Restituisci output conciso, solo Markdown.
-        """
+        # Se cambiano solo giorni e/o durata, adatta la scheda esistente senza rigenerarla
+        previous_prefs = st.session_state.get("plan_profile")
+        changed_prefs = {k for k, v in current_prefs.items() if previous_prefs and previous_prefs.get(k) != v}
+        generation_started = time.perf_counter()
         
-        try:
-            # 2. Chiamata all'IA - Usa il modello disponibile
+        if df_exercises.empty:
+            st.error("Errore: Il file 'exercises_db.csv' non è stato trovato!")
+        elif st.session_state.get("plan_ir") and changed_prefs and changed_prefs <= {"days", "duration", "weeks"}:
+            set_plan(patch_plan(st.session_state["plan_ir"], current_prefs, get_catalog_index(df_exercises)), current_prefs)
+            st.success("✅ Scheda adattata a giorni e durata senza rigenerarla!")
+        elif engine_mode == ENGINE_LOCAL:
+            # Motore locale: nessuna chiamata all'AI, risultato immediato
+            plan_md, plan_ir = generate_plan(None, None, current_prefs, df_exercises, get_catalog_index(df_exercises))
+            set_plan(plan_ir, current_prefs)
+            record_history(current_prefs, "motore-locale", generation_started)
+            st.success("✅ Scheda generata con il motore locale!")
+        elif cached_plan := get_cached_plan(current_prefs):
+            # Profilo popolare già pre-generato: nessuna chiamata all'AI
+            st.session_state["plan_md"] = cached_plan["plan_md"]
+            st.session_state["plan_ir"] = cached_plan["plan_ir"]
+            st.session_state["plan_profile"] = current_prefs
+            if cached_plan["match"] == "exact":
+                record_history(current_prefs, f"{cached_plan['model']} (cache)", generation_started)
+                st.success("⚡ Scheda pronta all'istante!")
+            else:
+                record_history(current_prefs, f"{cached_plan['model']} (cache, profilo simile)", generation_started)
+                st.success("⚡ Scheda pronta all'istante, da un profilo molto simile al tuo!")
+        else:
+            # La chiamata all'IA gira in background: un rerun o una riconnessione non la interrompono
             model_to_use = get_available_model()
-            response = client.models.generate_content(
-                model=model_to_use,
-                contents=prompt
-            )
+            job_index = get_catalog_index(df_exercises)
+            job_history = get_plan_history()
+            job_prefs = dict(current_prefs)
             
-            # Pulisci la barra di caricamento
-            spinner_placeholder.empty()
+            def run_generation() -> dict:
+                started = time.perf_counter()
+                result_text, plan_ir = generate_plan(client, model_to_use, job_prefs, df_exercises, job_index)
+                return {
+                    "plan_md": result_text,
+                    "plan_ir": plan_ir,
+                    "model": model_to_use,
+                    "generation_ms": round((time.perf_counter() - started) * 1000, 1)
+                }
             
-            # 3. Estrai il testo dalla risposta (gestisce diversi formati API)
-            result_text = None
-            if hasattr(response, 'text') and response.text:
-                result_text = response.text
-            elif hasattr(response, 'candidates') and response.candidates:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'content') and candidate.content:
-                    if hasattr(candidate.content, 'parts') and candidate.content.parts:
-                        result_text = candidate.content.parts[0].text
+            def on_generated(result: dict, token=user_token):
+                # Lo storico si aggiorna anche se la sessione nel frattempo si è chiusa
+                if result["plan_md"]:
+                    job_history.record(
+                        token, job_prefs, result["model"], result["plan_md"], result["plan_ir"],
+                        {"generation_ms": result["generation_ms"]}
+                    )
             
-            if result_text:
-                st.success("✅ Scheda generata con successo!")
-                
-                # salva per esportazione
-                st.session_state["plan_md"] = result_text
+            job_id = get_job_manager().submit(user_token, current_prefs, run_generation, on_generated)
+            st.session_state["job_id"] = job_id
+            st.query_params["job"] = job_id
+            st.rerun()
+
+    @st.fragment
+    def render_plan_result(program: list):
+        """Scheda e modifiche parziali: i widget di selezione rieseguono solo questo blocco."""
+        st.markdown('<div class="result-card">', unsafe_allow_html=True)
+        if len(program) > 1:
+            week_tabs = st.tabs([week_title(1)] + [week_title(w["week"], w["deload"]) for w in program[1:]])
+            with week_tabs[0]:
+                st.markdown(display_markdown(st.session_state["plan_md"]))
+            for tab, week_plan in zip(week_tabs[1:], program[1:]):
+                with tab:
+                    st.markdown(display_markdown(plan_to_markdown(week_plan)))
+        else:
+            st.markdown(display_markdown(st.session_state["plan_md"]))
+        st.markdown('</div>', unsafe_allow_html=True)
+        
+        # --- MODIFICHE PARZIALI ---
+        with st.expander("✏️ Modifica scheda (sostituisci un esercizio o rigenera un giorno)"):
+            catalog_index = get_catalog_index(df_exercises)
+            edit_plan = st.session_state.get("plan_ir") or plan_from_markdown(st.session_state["plan_md"], catalog_index.ids_by_name)
+            if not edit_plan["days"]:
+                st.info("Nessuna tabella riconosciuta nella scheda: rigenera per poterla modificare.")
             else:
-                st.error("❌ La risposta dell'AI è vuota. Riprova.")
-            
-        except Exception as e:
-            # Messaggio user-friendly per errori API (rate limit, quota, ecc.) - SOPRA le foto
-            with spinner_placeholder.container():
-                st.markdown('''
-                <div style="background: linear-gradient(135deg, rgba(255,50,50,0.2) 0%, rgba(180,30,30,0.15) 100%); 
-                            border: 2px solid #FF3333; 
-                            border-radius: 12px; 
-                            padding: 20px; 
-                            text-align: center;
-                            margin: 1rem 0;">
-                    <span style="font-size: 3rem;">❌</span>
-                    <h3 style="color: #FF6B6B; margin: 10px 0;">Limite sessioni raggiunto</h3>
-                    <p style="color: #E0E0E0; font-size: 1rem;">Riprova tra qualche ora...</p>
-                </div>
-                ''', unsafe_allow_html=True)
-
-# --- ESPORTAZIONE PDF ---
-if st.session_state.get("plan_md"):
-    # Mostra la scheda generata con ID per lo scroll
-    st.markdown("---")
-    st.markdown('<h2 id="scheda-risultato">📋 La Tua Scheda di Allenamento</h2>', unsafe_allow_html=True)
-    st.markdown('<div class="result-card">', unsafe_allow_html=True)
-    st.markdown(st.session_state["plan_md"])
-    st.markdown('</div>', unsafe_allow_html=True)
-    
-    # JavaScript per scroll automatico verso la scheda (usa components.html per affidabilità)
-    scroll_js = '''
+                day_titles = [d["title"] for d in edit_plan["days"]]
+                edit_day = st.selectbox("Giorno", range(len(day_titles)), format_func=lambda i: day_titles[i], key="edit_day")
+                day_rows = edit_plan["days"][edit_day]["rows"]
+                col_swap, col_day = st.columns(2)
+                with col_swap:
+                    edit_row = st.selectbox(
+                        "Esercizio", range(len(day_rows)),
+                        format_func=lambda i: day_rows[i].get("name") or day_rows[i].get("id", ""),
+                        key=f"edit_row_{edit_day}"
+                    )
+                    alternatives = swap_candidates(edit_plan, edit_day, edit_row, catalog_index) if day_rows else []
+                    if alternatives:
+                        new_id = st.selectbox(
+                            "Sostituisci con", [a["id"] for a in alternatives],
+                            format_func=lambda i: catalog_index.names_by_id[i],
+                            key=f"edit_alt_{edit_day}_{edit_row}"
+                        )
+                        if st.button("🔄 Sostituisci esercizio"):
+                            set_plan(swap_exercise(edit_plan, edit_day, edit_row, new_id, catalog_index))
+                            st.rerun()
+                    else:
+                        st.caption("Nessuna alternativa disponibile nel catalogo per questo esercizio.")
+                with col_day:
+                    st.caption("Rigenera solo il giorno selezionato: l'AI riceve quel giorno e un riassunto del resto della settimana.")
+                    if st.button("♻️ Rigenera questo giorno"):
+                        edit_profile = st.session_state.get("plan_profile") or saved_prefs
+                        new_plan = None
+                        if edit_profile.get("engine_mode") != ENGINE_LOCAL:
+                            try:
+                                with st.spinner("Rigenerazione del giorno in corso..."):
+                                    new_plan = regenerate_day(
+                                        client, get_available_model(), edit_profile, edit_plan, edit_day, df_exercises, catalog_index
+                                    )
+                            except GENERATION_ERRORS as e:
+                                st.session_state["generation_notice"] = (
+                                    "warning", f"⚠️ Rigenerazione con l'AI non riuscita ({e}): giorno rimescolato dal motore locale."
+                                )
+                        if new_plan is None:
+                            new_plan = reshuffle_day(edit_plan, edit_day, catalog_index)
+                        set_plan(new_plan)
+                        st.rerun()
+
+    @st.fragment
+    def render_pdf_export(export_md: str, share_key: Optional[str]):
+        """Download del PDF e link condivisibile, isolati dal resto della pagina."""
+        col_pdf1, col_pdf2, col_pdf3 = st.columns([1, 2, 1])
+        with col_pdf2:
+            pdf_bytes = get_shared_pdf(share_key, export_md) if share_key else get_pdf_bytes(export_md)
+            if pdf_bytes:
+                st.download_button(
+                    "📥 Scarica Scheda PDF",
+                    data=pdf_bytes,
+                    file_name="scheda_allenamento.pdf",
+                    mime="application/pdf",
+                    use_container_width=True
+                )
+            if share_key:
+                st.caption("🔗 Link condivisibile (si apre senza rigenerare la scheda):")
+                st.code(share_url(share_key), language=None)
+
+    @st.fragment
+    def render_hevy_export(plan: dict):
+        """Una routine Hevy per ogni giorno della scheda (settimana 1)."""
+        with st.expander("🏋️ Esporta su Hevy"):
+            st.caption("Crea una routine per ogni giorno nel tuo account Hevy (serve Hevy Pro per la API key: "
+                       "Impostazioni → Developer). Con un programma di più settimane si esporta la settimana 1.")
+            shared_key = get_shared_hevy_api_key()
+            with st.form("hevy_export"):
+                api_key = st.text_input("API key Hevy", type="password")
+                use_shared = st.checkbox("Usa l'account Hevy configurato sul server") if shared_key else False
+                submitted = st.form_submit_button("Crea routine su Hevy", use_container_width=True)
+            if not submitted:
+                return
+            api_key = api_key.strip() or (shared_key if use_shared else "")
+            if not api_key:
+                st.warning("Inserisci la API key di Hevy.")
+                return
+            progress = st.progress(0.0, text="Associazione degli esercizi ai template Hevy...")
+            try:
+                summary = export_plan(
+                    plan, get_catalog_index(df_exercises), catalog_meta.catalog_hash, get_hevy_client(api_key),
+                    get_export_store(),
+                    progress=lambda done, total: progress.progress(done / total, text=f"Routine {done}/{total}"),
+                )
+            except Exception as e:
+                progress.empty()
+                st.error(f"❌ Esportazione non riuscita: {e}")
+                return
+            progress.empty()
+            labels = {"created": "✅ creata", "existing": "↩️ già presente", "empty": "⚠️ vuota", "error": "❌ errore"}
+            st.dataframe(
+                pd.DataFrame([
+                    {"Routine": r["title"], "Esito": labels[r["status"]], "Esercizi": r["exercises"],
+                     "Dettagli": r.get("error", "")}
+                    for r in summary["routines"]
+                ]),
+                hide_index=True, use_container_width=True,
+            )
+            if summary["errors"]:
+                st.error(f"{summary['errors']} routine non caricate: riprova, quelle già create non verranno duplicate.")
+            else:
+                st.success(f"Routine sincronizzate in {summary['seconds']:.1f}s: aprile da Hevy → Allenamento.")
+            if summary["skipped"]:
+                st.caption("Senza corrispondenza in Hevy (aggiungili a mano): " + ", ".join(summary["skipped"]))
+
+    profiler.mark("scheda e pdf")
+
+    # --- ESPORTAZIONE PDF ---
+    if st.session_state.get("plan_md"):
+        # Mostra la scheda generata con ID per lo scroll
+        st.markdown("---")
+        st.markdown('<h2 id="scheda-risultato">📋 La Tua Scheda di Allenamento</h2>', unsafe_allow_html=True)
+        
+        # Settimane successive alla prima: derivate localmente dalla settimana 1
+        plan_profile = st.session_state.get("plan_profile") or saved_prefs
+        program_weeks = int(plan_profile.get("weeks", 1))
+        program = []
+        if program_weeks > 1:
+            base_plan = st.session_state.get("plan_ir") or plan_from_markdown(
+                st.session_state["plan_md"], get_catalog_index(df_exercises).ids_by_name
+            )
+            if base_plan["days"]:
+                program = build_program(base_plan, plan_profile, program_weeks, get_catalog_index(df_exercises))
+        export_md = program_markdown(st.session_state["plan_md"], program)
+        
+        # Salva la scheda sotto il suo hash per il link condivisibile mostrato sotto la scheda
+        share_payload = {
+            "plan_md": st.session_state["plan_md"],
+            "plan_ir": st.session_state.get("plan_ir"),
+            "profile": st.session_state.get("plan_profile") or {}
+        }
+        share_key = plan_hash(share_payload)
+        if share_key != st.session_state.get("plan_hash"):
+            try:
+                share_key = get_plan_store().put(**share_payload)
+            except sqlite3.Error:
+                share_key = None
+            st.session_state["plan_hash"] = share_key
+        
+        render_plan_result(program)
+        
+        # JavaScript per scroll automatico verso la scheda (usa components.html per affidabilità)
+        scroll_js = '''
     <script>
         // Scroll automatico verso la scheda generata
         setTimeout(function() {
@@ -1414,25 +1518,20 @@ if st.session_state.get("plan_md"):
         }, 500);
     </script>
     '''
-    components.html(scroll_js, height=0)
-    
-    # Pulsante download PDF
-    st.markdown("---")
-    col_pdf1, col_pdf2, col_pdf3 = st.columns([1, 2, 1])
-    with col_pdf2:
-        pdf_bytes = build_pdf_from_markdown(st.session_state["plan_md"])
-        if pdf_bytes:
-            st.download_button(
-                "📥 Scarica Scheda PDF",
-                data=pdf_bytes,
-                file_name="scheda_allenamento.pdf",
-                mime="application/pdf",
-                use_container_width=True
-            )
-    
-    # Galleria immagini spostata a piè pagina con animazione
-    if photo30_b64 and photo31_b64:
-        st.markdown(f'''
+        components.html(scroll_js, height=0)
+        
+        # Pulsante download PDF
+        st.markdown("---")
+        render_pdf_export(export_md, share_key)
+        export_plan_ir = st.session_state.get("plan_ir") or plan_from_markdown(
+            st.session_state["plan_md"], get_catalog_index(df_exercises).ids_by_name
+        )
+        if export_plan_ir["days"]:
+            render_hevy_export(export_plan_ir)
+        
+        # Galleria immagini spostata a piè pagina con animazione
+        if photo30_b64 and photo31_b64:
+            st.markdown(f'''
         <div class="gallery-footer">
             <div class="gallery-image">
                 <img src="data:image/{ext30};base64,{photo30_b64}" alt="Fitness Training">
@@ -1443,15 +1542,291 @@ if st.session_state.get("plan_md"):
         </div>
         ''', unsafe_allow_html=True)
 
-# --- VISUALIZZAZIONE DATABASE (Opzionale) ---
-with st.expander("📚 Vedi Database Esercizi"):
-    st.dataframe(df_exercises, use_container_width=True)
+    profiler.mark("storico")
+
+    # --- STORICO SCHEDE ---
+    def set_page(key: str, page: int):
+        """Callback dei pulsanti di paginazione (eseguita prima del rerun del fragment)."""
+        st.session_state[key] = page
+
+    @st.fragment
+    def render_history_panel():
+        """Ricerca e paginazione dello storico senza rieseguire la pagina."""
+        history_query = st.text_input("Cerca negli esercizi e nelle note", key="history_query", placeholder="es. squat, panca, scapole...")
+        if st.session_state.get("history_last_query") != history_query:
+            st.session_state["history_page"] = 0
+            st.session_state["history_last_query"] = history_query
+        history_page = st.session_state.get("history_page", 0)
+        HISTORY_PAGE_SIZE = 5
+        try:
+            history_rows, history_total = get_plan_history().search(user_token, history_query, history_page, HISTORY_PAGE_SIZE)
+        except sqlite3.Error as e:
+            history_rows, history_total = [], 0
+            st.warning(f"Storico non disponibile: {e}")
+        if not history_rows:
+            st.caption("Nessuna scheda trovata.")
+        for entry in history_rows:
+            entry_profile = entry["profile"]
+            col_info, col_restore = st.columns([4, 1])
+            with col_info:
+                st.markdown(
+                    f"**{datetime.fromtimestamp(entry['created_at']).strftime('%d/%m/%Y %H:%M')}** · "
+                    f"{', '.join(entry_profile.get('goals', []))} · {entry_profile.get('days')} giorni · "
+                    f"{entry_profile.get('split_type')} · {entry_profile.get('duration')} min  \n"
+                    f"<small>{entry['model'] or ''} · {entry['timings'].get('generation_ms', 0):.0f} ms</small>",
+                    unsafe_allow_html=True
+                )
+            with col_restore:
+                if st.button("↩️ Ripristina", key=f"restore_{entry['id']}"):
+                    restored = get_plan_history().get(user_token, entry["id"])
+                    if restored:
+                        st.session_state["plan_md"] = restored["plan_md"]
+                        st.session_state["plan_ir"] = restored["plan_ir"]
+                        st.session_state["plan_profile"] = restored["profile"]
+                        st.rerun()
+        history_pages = max(1, -(-history_total // HISTORY_PAGE_SIZE))
+        if history_total > HISTORY_PAGE_SIZE:
+            col_prev, col_page, col_next = st.columns([1, 2, 1])
+            with col_prev:
+                st.button("◀", disabled=history_page == 0, key="history_prev",
+                          on_click=set_page, args=("history_page", history_page - 1))
+            with col_page:
+                st.caption(f"Pagina {history_page + 1} di {history_pages} ({history_total} schede)")
+            with col_next:
+                st.button("▶", disabled=history_page + 1 >= history_pages, key="history_next",
+                          on_click=set_page, args=("history_page", history_page + 1))
+
+    with st.expander("🕘 Storico schede"):
+        render_history_panel()
 
-# --- FOOTER ---
-st.markdown("---")
-st.markdown("""
+    profiler.mark("coach")
+
+    # --- GENERAZIONE IN BLOCCO (COACH) ---
+    @st.fragment(run_every=2)
+    def poll_bulk_job():
+        """Avanzamento della generazione in blocco, letto dal checkpoint su disco."""
+        bulk = st.session_state["bulk_job"]
+        job = get_job_manager().get(bulk["job_id"], user_token)
+        completed = len(Checkpoint(bulk["out_dir"]).done)
+        if job is not None and job["status"] in (JOB_PENDING, JOB_RUNNING):
+            st.progress(completed / bulk["clients"], text=f"⏳ {completed}/{bulk['clients']} clienti completati")
+            return
+        bulk["finished"] = True
+        bulk["summary"] = job["result"] if job and job["status"] == JOB_DONE else None
+        bulk["error"] = job["error"] if job else "Generazione non trovata"
+        st.rerun()
+
+    def render_bulk_panel():
+        """Caricamento del roster clienti e generazione in background di tutte le schede."""
+        bulk = st.session_state.get("bulk_job")
+        if bulk and not bulk.get("finished"):
+            poll_bulk_job()
+        elif bulk:
+            summary = bulk["summary"]
+            if summary:
+                st.success(
+                    f"✅ {summary['done']}/{summary['total']} schede pronte in {summary['seconds']:.0f}s "
+                    f"(ripieghi sul motore locale: {summary.get('local-fallback', 0)}, errori: {summary.get('error', 0)})"
+                )
+                for client_id, error in summary.get("failures", {}).items():
+                    st.caption(f"❌ {client_id} — {error}")
+            else:
+                st.error(f"❌ Generazione interrotta: {bulk['error']}. Ricarica lo stesso roster per riprendere.")
+            if len(Checkpoint(bulk["out_dir"]).done):
+                st.download_button(
+                    "📦 Scarica schede (zip)", data=zip_results(bulk["out_dir"]),
+                    file_name=f"schede_{bulk['name']}.zip", mime="application/zip", key="bulk_download"
+                )
+        
+        with st.form("bulk_form"):
+            roster_file = st.file_uploader(
+                "Roster clienti (CSV o JSONL)", type=["csv", "jsonl"],
+                help="Una riga per cliente con i campi della sidebar (days, goals, split_type, ...) e `client` per il nome. "
+                     "Nel CSV gli obiettivi multipli si separano con ';'."
+            )
+            col_concurrency, col_rpm = st.columns(2)
+            with col_concurrency:
+                bulk_concurrency = st.number_input("Richieste contemporanee", min_value=1, max_value=8, value=4)
+            with col_rpm:
+                bulk_rpm = st.number_input("Richieste al minuto", min_value=1, max_value=120, value=30)
+            bulk_submitted = st.form_submit_button("🚀 GENERA TUTTE LE SCHEDE")
+        if not bulk_submitted or roster_file is None:
+            return
+        if bulk and not bulk.get("finished"):
+            st.warning("⏳ Una generazione in blocco è già in corso.")
+            return
+        
+        roster_fmt = "csv" if roster_file.name.lower().endswith(".csv") else "jsonl"
+        try:
+            entries, invalid = read_roster(io.StringIO(roster_file.getvalue().decode("utf-8-sig")), roster_fmt)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            st.error(f"Roster non valido: {e}")
+            return
+        if not entries:
+            st.warning("Il roster non contiene clienti validi.")
+            for client_id, error in invalid:
+                st.caption(f"❌ {client_id} — {error}")
+            return
+        
+        # Stessa cartella per lo stesso roster: ricaricandolo si riprende dai clienti mancanti
+        out_dir = os.path.join(DATA_DIR, "bulk", user_token, plan_hash({"roster": entries}))
+        model_to_use = get_available_model()
+        job_index = get_catalog_index(df_exercises)
+        
+        def run_bulk() -> dict:
+            return run_roster(
+                entries, out_dir, client, model_to_use, df_exercises, job_index,
+                concurrency=int(bulk_concurrency), rpm=bulk_rpm, invalid=invalid
+            )
+        
+        clients = len(entries) + len(invalid)
+        job_id = get_job_manager().submit(user_token, {"bulk": roster_file.name, "clients": clients}, run_bulk)
+        st.session_state["bulk_job"] = {
+            "job_id": job_id, "out_dir": out_dir, "clients": clients,
+            "name": os.path.splitext(roster_file.name)[0],
+        }
+        st.rerun()
+
+    with st.expander("👥 Generazione in blocco (coach)"):
+        render_bulk_panel()
+
+    profiler.mark("database esercizi")
+
+    # --- VISUALIZZAZIONE DATABASE (Opzionale) ---
+    EXPLORER_PAGE_SIZE = 25
+
+    @st.fragment
+    def render_exercise_explorer():
+        """Esploratore del catalogo: ricerca e filtri sugli indici, serializza solo la pagina visibile."""
+        catalog_index = get_catalog_index(df_exercises)
+        explorer_query = st.text_input("Cerca esercizio", key="explorer_query", placeholder="es. squat, curl, press...")
+        col_muscle, col_equipment, col_type = st.columns(3)
+        with col_muscle:
+            explorer_muscles = st.multiselect(
+                "Muscolo", sorted(catalog_meta.facet_values["muscle_group"], key=catalog_meta.muscle_labels.get),
+                format_func=lambda m: f"{catalog_meta.muscle_labels[m]} ({catalog_meta.facet_counts['muscle_group'][m]})",
+                key="explorer_muscles"
+            )
+        with col_equipment:
+            explorer_equipment = st.multiselect(
+                "Attrezzo", catalog_meta.facet_values["equipment"],
+                format_func=lambda e: f"{e} ({catalog_meta.facet_counts['equipment'][e]})", key="explorer_equipment"
+            )
+        with col_type:
+            explorer_types = st.multiselect(
+                "Tipo", catalog_meta.facet_values["type"],
+                format_func=lambda t: f"{t} ({catalog_meta.facet_counts['type'][t]})", key="explorer_types"
+            )
+        
+        # Nuovi filtri: si riparte dalla prima pagina
+        explorer_filters = (explorer_query, tuple(explorer_muscles), tuple(explorer_equipment), tuple(explorer_types))
+        if st.session_state.get("explorer_last_filters") != explorer_filters:
+            st.session_state["explorer_page"] = 0
+            st.session_state["explorer_last_filters"] = explorer_filters
+        explorer_page = st.session_state.get("explorer_page", 0)
+        
+        page_rows, explorer_total = catalog_index.search(
+            explorer_query, page=explorer_page, page_size=EXPLORER_PAGE_SIZE,
+            muscle_group=explorer_muscles, equipment=explorer_equipment, type=explorer_types
+        )
+        if not page_rows:
+            st.info("Nessun esercizio corrisponde ai filtri.")
+            return
+        column_config = None
+        if thumbnails_enabled():
+            # Solo gli URL della pagina visibile: le immagini le scarica il browser
+            page_rows = [dict(thumbnail=exercise_images.thumbnail_url(r["id"]), **r) for r in page_rows]
+            column_config = {"thumbnail": st.column_config.ImageColumn("", width="small")}
+        st.dataframe(pd.DataFrame(page_rows), use_container_width=True, hide_index=True, column_config=column_config)
+        
+        explorer_pages = max(1, -(-explorer_total // EXPLORER_PAGE_SIZE))
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            st.button("◀", disabled=explorer_page == 0, key="explorer_prev",
+                      on_click=set_page, args=("explorer_page", explorer_page - 1))
+        with col_page:
+            st.caption(f"Pagina {explorer_page + 1} di {explorer_pages} ({explorer_total} esercizi)")
+        with col_next:
+            st.button("▶", disabled=explorer_page + 1 >= explorer_pages, key="explorer_next",
+                      on_click=set_page, args=("explorer_page", explorer_page + 1))
+
+    with st.expander("📚 Vedi Database Esercizi"):
+        render_exercise_explorer()
+
+    profiler.mark("admin e footer")
+
+    # --- PANNELLO ADMIN (?admin=<HEVY_ADMIN_TOKEN>) ---
+    ADMIN_TOKEN = os.environ.get("HEVY_ADMIN_TOKEN", "")
+    ADMIN_WINDOWS = {"Ultime 24 ore": 86400, "Ultimi 7 giorni": 7 * 86400, "Sempre": None}
+
+    def render_admin_panel():
+        """Efficacia della cache delle schede: hit rate e errore dei riusi da profili vicini."""
+        window = st.radio("Periodo", list(ADMIN_WINDOWS), horizontal=True, key="admin_window")
+        seconds = ADMIN_WINDOWS[window]
+        try:
+            stats = get_plan_cache().lookup_stats(time.time() - seconds if seconds else 0)
+            cache_stats = get_plan_cache().stats(catalog_meta.catalog_hash)
+        except sqlite3.Error as e:
+            st.warning(f"Statistiche non disponibili: {e}")
+            return
+        col_rate, col_exact, col_near, col_entries = st.columns(4)
+        col_rate.metric("Hit rate", f"{stats['hit_rate']:.0%}", help=f"{stats['lookups']} richieste AI")
+        col_exact.metric("Esatti", stats["exact"])
+        col_near.metric("Profili vicini", stats["near"])
+        col_entries.metric("Schede in cache", cache_stats["entries"])
+        errors = stats["errors"]
+        if not stats["near"]:
+            st.caption("Nessun riuso da profili vicini nel periodo.")
+            return
+        st.markdown("**Errore dei riusi da profili vicini** (massimo / medio)")
+        st.table(pd.DataFrame([
+            {"Misura": "Età (anni)", "Massimo": errors["max_age"], "Medio": round(errors["avg_age"], 1),
+             "Limite": f"ampiezza della fascia ({', '.join(map(str, AGE_BANDS))})"},
+            {"Misura": "Durata prima dell'adattamento (min)", "Massimo": errors["max_duration"],
+             "Medio": round(errors["avg_duration"], 1), "Limite": "15 (fasce di 15 minuti)"},
+            {"Misura": "Scarto dalla durata richiesta dopo l'adattamento (%)",
+             "Massimo": None if errors["max_fit"] is None else round(errors["max_fit"] * 100, 1),
+             "Medio": None if errors["avg_fit"] is None else round(errors["avg_fit"] * 100, 1),
+             "Limite": f"{DURATION_TOLERANCE:.0%} se adattata (HEVY_NEAR_MATCH=adapt)"},
+        ]))
+
+    if ADMIN_TOKEN and st.query_params.get("admin") == ADMIN_TOKEN:
+        with st.expander("🛠️ Admin · cache delle schede", expanded=True):
+            render_admin_panel()
+
+    # --- FOOTER ---
+    st.markdown("---")
+    st.markdown("""
 <div class="footer">
     <p>🏋️ <strong>Hevy AI Architect</strong> • Powered by Google Gemini AI</p>
     <p>Creato con ❤️ da Stefano Pisani</p>
 </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
+
+    # --- PROFILAZIONE (solo se richiesta) ---
+    def render_profile_panel(result: profiling.RerunProfiler):
+        """Tempi e memoria per sezione del rerun, funzioni più costose e file da scaricare."""
+        st.caption(f"Rerun completo: {result.total_ms:.0f} ms (tempi gonfiati dal profiler, confrontali tra loro)")
+        st.dataframe(pd.DataFrame(result.sections), use_container_width=True, hide_index=True)
+        col_functions, col_memory = st.columns(2)
+        with col_functions:
+            st.markdown("**Funzioni (tempo cumulativo)**")
+            st.dataframe(pd.DataFrame(result.top_functions()), use_container_width=True, hide_index=True)
+        with col_memory:
+            st.markdown("**Allocazioni (crescita per riga)**")
+            st.dataframe(pd.DataFrame(result.top_allocations()), use_container_width=True, hide_index=True)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        col_pstats, col_speedscope = st.columns(2)
+        with col_pstats:
+            st.download_button("⬇️ pstats (cProfile)", data=result.pstats_bytes(),
+                               file_name=f"rerun_{stamp}.pstats", mime="application/octet-stream")
+        with col_speedscope:
+            st.download_button("⬇️ speedscope", data=result.speedscope_bytes(f"rerun {stamp}"),
+                               file_name=f"rerun_{stamp}.speedscope.json", mime="application/json")
+finally:
+    # Anche quando il rerun finisce prima (st.rerun, st.stop o un'eccezione)
+    profiled = profiler.stop()
+
+if profiled:
+    with st.expander("🐞 Profilo del rerun"):
+        render_profile_panel(profiler)
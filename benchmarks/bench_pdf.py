@@ -0,0 +1,65 @@
+"""Benchmark dell'esportazione PDF su schede lunghe.
+
+Uso: python benchmarks/bench_pdf.py [--repeat N]
+
+Genera con il motore locale programmi da 1 a 12 settimane (6 giorni, 90 minuti,
+note lunghe come quelle dell'AI) e misura tempo di costruzione, pagine e peso del PDF.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+
+from catalog import CatalogIndex  # noqa: E402
+from pdf_export import render_markdown  # noqa: E402
+from periodization import build_program, program_markdown  # noqa: E402
+from plan_engine import build_plan  # noqa: E402
+from plan_ir import plan_to_markdown  # noqa: E402
+
+PROFILE = {
+    "goals": ["Ipertrofia (Massa)"], "days": 6, "split_type": "Spinta/Tirata/Gambe", "focus_area": [],
+    "equipment_pref": "Con attrezzi", "sex_pref": "Maschio", "age": 30,
+    "training_level": "Super Esperto", "duration": 90,
+}
+LONG_NOTE = "Scapole addotte e depresse, core attivo, discesa controllata in 3 secondi, nessun rimbalzo"
+
+
+def long_program(index: CatalogIndex, weeks: int) -> str:
+    plan = build_plan(dict(PROFILE, weeks=weeks), index)
+    for day in plan["days"]:
+        for row in day["rows"]:
+            row["note"] = LONG_NOTE
+    plan_md = plan_to_markdown(plan)
+    return program_markdown(plan_md, build_program(plan, PROFILE, weeks, index) if weeks > 1 else [])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    csv_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "exercises_db.csv")
+    index = CatalogIndex.from_dataframe(pd.read_csv(csv_path))
+    start = time.perf_counter()
+    render_markdown(long_program(index, 1)).output(dest="S")
+    print(f"Primo export (metriche e sottoinsiemi dei font non in cache): {(time.perf_counter() - start) * 1000:.1f} ms")
+    print(f"{'settimane':>9} {'righe md':>9} {'ms (mediana)':>13} {'pagine':>7} {'KB':>7}")
+    for weeks in (1, 4, 8, 12):
+        md_text = long_program(index, weeks)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            pdf = render_markdown(md_text)
+            data = pdf.output(dest="S")
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"{weeks:>9} {len(md_text.splitlines()):>9} {statistics.median(timings):>13.1f} "
+              f"{pdf.page_no():>7} {len(data) / 1024:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
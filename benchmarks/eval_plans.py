@@ -0,0 +1,244 @@
+"""Valutazione offline della qualità delle schede su un insieme fisso di profili.
+
+Uso:
+    python benchmarks/eval_plans.py                          # riproduce le fixture, nessuna rete
+    python benchmarks/eval_plans.py --record                 # registra da Gemini (GEMINI_API_KEY)
+    python benchmarks/eval_plans.py --record --stub          # registra dal client finto locale
+    python benchmarks/eval_plans.py --json dopo.json --baseline prima.json
+    python benchmarks/eval_plans.py --check                  # controllo senza rete né fixture
+
+Per ogni profilo e modalità la richiesta passa da genai_replay.ReplayClient e la
+scheda viene valutata: id del catalogo validi nella risposta grezza, ripetizioni e
+recuperi conformi alle regole dell'obiettivo, numero di giorni, tabelle Markdown
+ben formate, token e latenza registrata. Con --baseline il comando fallisce se una
+metrica di qualità peggiora: per misurare una modifica al prompt si registra prima
+e dopo (le impronte cambiano con il prompt) e si confrontano i due JSON.
+
+--check registra dal client finto in una cartella temporanea e confronta con
+benchmarks/baseline_stub.json (versionato): non misura il modello ma intercetta
+le regressioni di prompt, parser e regole senza chiave. Dopo una modifica voluta
+si aggiorna con `--record --stub --fixtures <tmp> --json benchmarks/baseline_stub.json`.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+
+from catalog import CatalogIndex  # noqa: E402
+from generation import ENGINE_AI, ENGINE_DRAFT, ENGINE_HYBRID, prepare_request  # noqa: E402
+from genai_replay import AUTO, RECORD, REPLAY, FixtureMissing, ReplayClient  # noqa: E402
+from plan_engine import goal_rules  # noqa: E402
+from plan_ir import PLAN_COLUMNS, plan_from_json, plan_from_markdown  # noqa: E402
+from prefs_store import default_preferences  # noqa: E402
+from session_time import parse_seconds  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+STUB_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_stub.json")
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+# Profili fissi: obiettivi, split, attrezzi, livelli ed età diversi
+PROFILES = {
+    "ipertrofia_ppl": {"goals": ["Ipertrofia (Massa)"], "days": 6, "split_type": "Spinta/Tirata/Gambe",
+                       "training_level": "Esperto", "duration": 75},
+    "forza_alto_basso": {"goals": ["Forza Pura"], "days": 4, "split_type": "Alto/Basso",
+                         "training_level": "Super Esperto", "duration": 90},
+    "dimagrimento_casa": {"goals": ["Dimagrimento (Cutting)"], "days": 3, "split_type": "Full Body",
+                          "equipment_pref": "Senza attrezzi", "sex_pref": "Femmina", "duration": 45},
+    "tonificazione_split": {"goals": ["Tonificazione", "Ipertrofia (Massa)"], "days": 5,
+                            "split_type": "Split per Gruppo Muscolare", "duration": 60},
+    "postura_over55": {"goals": ["Miglioramento Posturale"], "days": 2, "split_type": "Full Body",
+                       "age": 62, "duration": 40},
+    "principiante_full_body": {"goals": ["Ipertrofia (Massa)"], "days": 3, "split_type": "Full Body",
+                               "focus_area": ["Glutes"], "sex_pref": "Femmina", "age": 24},
+}
+MODES = {"ai": ENGINE_AI, "bozza": ENGINE_DRAFT, "ibrida": ENGINE_HYBRID, "markdown": ENGINE_AI}
+
+QUALITY_METRICS = ("catalog", "reps", "rest", "days", "tables")
+# Scostamento del recupero ammesso rispetto alla regola dell'obiettivo
+REST_TOLERANCE = 30
+REGRESSION_TOLERANCE = 0.01
+
+
+def _range(text) -> tuple:
+    """'8-12' -> (8, 12); None per valori a tempo ('30-45s') o non numerici."""
+    if str(text).strip().endswith("s"):
+        return None
+    numbers = [int(n) for n in re.findall(r"\d+", str(text))]
+    return (numbers[0], numbers[-1]) if numbers else None
+
+
+def catalog_rate(raw_text: str, mode: str, index: CatalogIndex, profile: dict) -> float:
+    """Quota di esercizi della risposta grezza che esistono nel catalogo."""
+    if mode == "ibrida":
+        ids = [str(n.get("id", "")).strip() for n in json.loads(raw_text).get("notes", [])]
+    elif mode == "markdown":
+        rows = [r for d in plan_from_markdown(raw_text, index.ids_by_name)["days"] for r in d["rows"]]
+        ids = [r["id"] for r in rows]
+    else:
+        ids = [r["id"] for d in plan_from_json(raw_text)["days"] for r in d["rows"]]
+    return sum(1 for i in ids if i in index.by_id) / len(ids) if ids else 0.0
+
+
+def rule_rates(plan: dict, profile: dict, index: CatalogIndex) -> tuple:
+    """Quota di righe con ripetizioni e recuperi conformi all'obiettivo (warm-up e core esclusi)."""
+    main_rule, accessory_rule = goal_rules(profile.get("goals", []))
+    reps_ok = reps_total = rest_ok = rest_total = 0
+    for day in plan["days"]:
+        for row in day["rows"]:
+            role = (index.by_id.get(row.get("id")) or {}).get("role", "compound")
+            if role in ("warmup", "core"):
+                continue
+            rule = main_rule if role == "compound" else accessory_rule
+            reps, expected = _range(row.get("reps")), _range(rule["reps"])
+            if reps:
+                reps_total += 1
+                reps_ok += reps[0] <= expected[1] and reps[1] >= expected[0]
+            rest = parse_seconds(row.get("rest"))
+            if rest is not None:
+                rest_total += 1
+                rest_ok += abs(rest - parse_seconds(rule["rest"])) <= REST_TOLERANCE
+    return (reps_ok / reps_total if reps_total else 0.0, rest_ok / rest_total if rest_total else 0.0)
+
+
+def table_rate(plan_md: str) -> float:
+    """Quota di tabelle con intestazione standard, separatore e righe da 5 celle."""
+    tables, current = [], None
+    for line in plan_md.splitlines() + [""]:
+        if line.strip().startswith("|"):
+            current = (current or []) + [[c.strip() for c in line.strip().strip("|").split("|")]]
+        elif current:
+            tables.append(current)
+            current = None
+    good = 0
+    for table in tables:
+        header_ok = [c.replace("*", "") for c in table[0]] == PLAN_COLUMNS
+        separator_ok = len(table) > 1 and all(set(c) <= set("-: ") and c for c in table[1])
+        rows_ok = len(table) > 2 and all(len(row) == len(PLAN_COLUMNS) for row in table[2:])
+        good += header_ok and separator_ok and rows_ok
+    return good / len(tables) if tables else 0.0
+
+
+def evaluate_case(client, model: str, name: str, mode: str, df, index: CatalogIndex) -> dict:
+    profile = dict(default_preferences(), **PROFILES[name], engine_mode=MODES[mode],
+                   structured_output=mode != "markdown")
+    contents, config, parse = prepare_request(profile, df, index)
+    result = {"case": f"{name}/{mode}"}
+    try:
+        response = client.models.generate_content(model=model, contents=contents, config=config)
+    except FixtureMissing as e:
+        return dict(result, error=f"fixture mancante {e}")
+    usage = response.usage_metadata
+    result.update(
+        prompt_tokens=usage.prompt_token_count or 0, response_tokens=usage.candidates_token_count or 0,
+        latency_ms=response.latency_ms or 0,
+    )
+    try:
+        result["catalog"] = catalog_rate(response.text or "", mode, index, profile)
+        plan_md, plan_ir = parse(response.text)
+    except (ValueError, AttributeError) as e:
+        return dict(result, error=f"risposta non valida: {e}", **{m: 0.0 for m in QUALITY_METRICS})
+    plan_md = plan_md or ""
+    plan = plan_ir or plan_from_markdown(plan_md, index.ids_by_name)
+    result["reps"], result["rest"] = rule_rates(plan, profile, index)
+    result["days"] = float(len(plan["days"]) == profile["days"])
+    result["tables"] = table_rate(plan_md)
+    return result
+
+
+def summarize(results: list) -> dict:
+    valid = [r for r in results if "catalog" in r]
+    summary = {m: statistics.mean(r[m] for r in valid) if valid else 0.0 for m in QUALITY_METRICS}
+    for metric in ("prompt_tokens", "response_tokens", "latency_ms"):
+        summary[metric] = sum(r.get(metric, 0) for r in results)
+    summary["errors"] = sum(1 for r in results if "error" in r)
+    return summary
+
+
+def compare(summary: dict, baseline: dict) -> list:
+    """Metriche di qualità peggiorate (e casi falliti in più) rispetto al riferimento."""
+    regressions = [
+        f"{m}: {baseline[m]:.3f} -> {summary[m]:.3f}"
+        for m in QUALITY_METRICS if summary[m] < baseline.get(m, 0) - REGRESSION_TOLERANCE
+    ]
+    if summary["errors"] > baseline.get("errors", 0):
+        regressions.append(f"errors: {baseline.get('errors', 0)} -> {summary['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--record", action="store_true", help="registra nuove fixture (sovrascrive)")
+    parser.add_argument("--auto", action="store_true", help="registra solo le fixture mancanti")
+    parser.add_argument("--stub", action="store_true", help="registra dal client finto locale")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--modes", default=",".join(MODES), help=f"modalità separate da virgola ({', '.join(MODES)})")
+    parser.add_argument("--json", help="salva risultati e riepilogo in questo file")
+    parser.add_argument("--baseline", help="riepilogo JSON di riferimento: errore se la qualità peggiora")
+    parser.add_argument("--check", action="store_true",
+                        help="registra dallo stub in una cartella temporanea e confronta con baseline_stub.json")
+    args = parser.parse_args()
+    if args.check:
+        args.record = args.stub = True
+        fixtures = tempfile.TemporaryDirectory(prefix="eval-fixtures-")  # rimossa all'uscita
+        args.fixtures = fixtures.name
+        args.baseline = args.baseline or STUB_BASELINE
+
+    csv_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "exercises_db.csv")
+    df = pd.read_csv(csv_path)
+    index = CatalogIndex.from_dataframe(df)
+
+    live = None
+    if args.record or args.auto:
+        if args.stub:
+            from genai_stub import StubClient
+            live = StubClient(index)
+        else:
+            import google.genai as genai
+            live = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
+    mode = RECORD if args.record else AUTO if args.auto else REPLAY
+    client = ReplayClient(args.fixtures, live, mode)
+
+    results = [
+        evaluate_case(client, args.model, name, mode_name, df, index)
+        for name in PROFILES for mode_name in args.modes.split(",")
+    ]
+    print(f"{'caso':<34} {'catalogo':>8} {'rip.':>5} {'recup.':>6} {'giorni':>6} {'tabelle':>7} "
+          f"{'tok in':>7} {'tok out':>7} {'ms':>7}")
+    for r in results:
+        if "catalog" not in r:
+            print(f"{r['case']:<34} ❌ {r['error']}")
+            continue
+        print(f"{r['case']:<34} {r['catalog']:>8.0%} {r['reps']:>5.0%} {r['rest']:>6.0%} {r['days']:>6.0%} "
+              f"{r['tables']:>7.0%} {r['prompt_tokens']:>7} {r['response_tokens']:>7} {r['latency_ms']:>7.0f}"
+              + (f"  ⚠️ {r['error']}" if "error" in r else ""))
+    summary = summarize(results)
+    print("media: " + ", ".join(f"{m} {summary[m]:.1%}" for m in QUALITY_METRICS)
+          + f" | token {summary['prompt_tokens']} + {summary['response_tokens']}"
+          f" | latenza registrata {summary['latency_ms'] / 1000:.1f}s"
+          f" | riprodotte {client.stats['replayed']}, registrate {client.stats['recorded']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "results": results}, f, ensure_ascii=False, indent=1)
+    if summary["errors"] and mode == REPLAY:
+        print("Fixture mancanti o risposte non valide: rilancia con --record o --auto.")
+        sys.exit(2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(summary, json.load(f)["summary"])
+        for line in regressions:
+            print(f"📉 {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+"""Generazione in blocco delle schede per il roster di un coach.
+
+Uso:
+    python bulk_generation.py roster.csv -o clienti/ --concurrency 4 --rpm 30
+    python bulk_generation.py roster.jsonl -o clienti/ --batch     # batch job del provider
+    python bulk_generation.py roster.csv -o clienti/ --stub        # senza rete (genai_stub)
+
+Il roster (CSV o JSONL) ha gli stessi campi delle preferenze della sidebar
+(prefs_store.DEFAULT_PREFERENCES) più `client` (o `name`/`id`) per il nome dei
+file; i campi mancanti prendono i valori predefiniti. Nel CSV le liste (goals,
+focus_area) sono separate da ";". Le righe non valide (es. `days` non numerico)
+non fermano il roster: sono riportate come errori del singolo cliente.
+
+Per ogni cliente vengono scritti <client>.md e <client>.pdf. L'avanzamento è
+salvato in progress.jsonl nella cartella di output: rilanciando lo stesso comando
+si riprende dai clienti mancanti (e da un batch job ancora in corso).
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, Optional
+
+import metrics
+from catalog import CatalogIndex
+from generation import ENGINE_LOCAL, extract_response_text, generate_plan, prepare_request
+from pdf_export import build_pdf_from_markdown
+from periodization import build_program, program_markdown
+from plan_engine import build_plan
+from plan_ir import plan_to_markdown
+from prefs_store import DEFAULT_PREFERENCES, default_preferences
+from render_pdfs import safe_filename
+
+CHECKPOINT_FILE = "progress.jsonl"
+CLIENT_FIELDS = ("client", "name", "id")
+LIST_FIELDS = ("goals", "focus_area")
+INT_FIELDS = ("days", "age", "duration", "weeks")
+BOOL_FIELDS = ("structured_output",)
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+MAX_RETRIES = 3
+BATCH_POLL_SECONDS = 10
+BATCH_DONE_STATES = {
+    "JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED",
+    "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED",
+}
+
+
+def _profile(row: dict) -> dict:
+    """Profilo completo da una riga del roster (valori predefiniti per i campi mancanti).
+
+    ValueError con il nome del campo se un valore non è valido.
+    """
+    profile = default_preferences()
+    for field, value in row.items():
+        if field not in DEFAULT_PREFERENCES or value in (None, ""):
+            continue
+        if field in LIST_FIELDS and isinstance(value, str):
+            value = [v.strip() for v in value.split(";") if v.strip()]
+        elif field in INT_FIELDS:
+            try:
+                value = int(str(value).strip())
+            except ValueError:
+                raise ValueError(f"{field} non è un numero intero: {value!r}") from None
+            if value < 1:
+                raise ValueError(f"{field} deve essere almeno 1: {value}")
+        elif field in BOOL_FIELDS and isinstance(value, str):
+            value = value.strip().lower() in ("1", "true", "si", "sì", "yes")
+        profile[field] = value
+    return profile
+
+
+def _jsonl_rows(lines: Iterable[str]):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"JSON non valido: {e}")
+            continue
+        yield row if isinstance(row, dict) else ValueError("la riga non è un oggetto JSON")
+
+
+def read_roster(lines: Iterable[str], fmt: str) -> tuple:
+    """(validi, non validi) del roster; `fmt` è "csv" o "jsonl".
+
+    I validi sono coppie (cliente, profilo), i non validi (cliente, errore). I nomi
+    dei clienti ripetuti ricevono un suffisso numerico.
+    """
+    rows = csv.DictReader(lines) if fmt == "csv" else _jsonl_rows(lines)
+    entries, invalid, used = [], [], set()
+    for number, row in enumerate(rows, 1):
+        name = f"cliente_{number}"
+        if isinstance(row, dict):
+            name = next((str(row[f]) for f in CLIENT_FIELDS if row.get(f)), name)
+        client_id = candidate = safe_filename(name)
+        n = 1
+        while candidate in used:
+            n += 1
+            candidate = f"{client_id}_{n}"
+        used.add(candidate)
+        try:
+            if isinstance(row, Exception):
+                raise row
+            entries.append((candidate, _profile(row)))
+        except ValueError as e:
+            invalid.append((candidate, f"riga {number}: {e}"))
+    return entries, invalid
+
+
+def load_roster(path: str) -> tuple:
+    fmt = "csv" if path.lower().endswith(".csv") else "jsonl"
+    with open(path, encoding="utf-8", newline="") as f:
+        return read_roster(f, fmt)
+
+
+class RateLimiter:
+    """Limite di richieste al minuto condiviso dai thread: le chiamate sono distanziate in modo uniforme."""
+
+    def __init__(self, per_minute: float = 0):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self.waiting = 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+        metrics.track_limiter(self)
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+            self.waiting += 1
+        try:
+            time.sleep(max(0.0, slot - now))
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+
+class Checkpoint:
+    """Avanzamento in JSONL (append-only): clienti completati e batch job inviati."""
+
+    def __init__(self, out_dir: str):
+        self.path = os.path.join(out_dir, CHECKPOINT_FILE)
+        self.done = {}
+        self.batch = None
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # riga troncata da un'interruzione
+                    if "batch" in entry:
+                        self.batch = entry
+                    elif entry.get("status") == "done":
+                        self.done[entry["client"]] = entry
+
+    def record(self, entry: dict):
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(dict(entry, at=time.time()), ensure_ascii=False) + "\n")
+            if entry.get("status") == "done":
+                self.done[entry["client"]] = entry
+            elif "batch" in entry:
+                self.batch = entry
+
+
+def write_client_files(out_dir: str, client_id: str, profile: dict, plan_md: str,
+                       plan_ir: Optional[dict], index: CatalogIndex) -> list:
+    """Scrive <cliente>.md e <cliente>.pdf (programma completo se multi-settimana)."""
+    weeks = int(profile.get("weeks", 1))
+    program = build_program(plan_ir, profile, weeks, index) if plan_ir and weeks > 1 else []
+    export_md = program_markdown(plan_md, program)
+    md_name, pdf_name = f"{client_id}.md", f"{client_id}.pdf"
+    with open(os.path.join(out_dir, md_name), "w", encoding="utf-8") as f:
+        f.write(export_md)
+    with open(os.path.join(out_dir, pdf_name), "wb") as f:
+        f.write(build_pdf_from_markdown(export_md))
+    return [md_name, pdf_name]
+
+
+def generate_with_retry(client, model: str, profile: dict, df, index: CatalogIndex,
+                        limiter: RateLimiter, retries: int = MAX_RETRIES, fallback: bool = True) -> tuple:
+    """(plan_md, plan_ir, fonte): ritenta con backoff esponenziale, poi ripiega sul motore locale."""
+    if profile.get("engine_mode") == ENGINE_LOCAL:
+        plan_md, plan_ir = generate_plan(None, None, profile, df, index)
+        return plan_md, plan_ir, "local"
+    error = None
+    for attempt in range(retries):
+        limiter.acquire()
+        try:
+            plan_md, plan_ir = generate_plan(client, model, profile, df, index)
+            if plan_md:
+                return plan_md, plan_ir, "ai"
+            error = ValueError("Risposta vuota")
+        except Exception as e:
+            error = e
+        if attempt + 1 < retries:
+            time.sleep(min(30, 2 ** attempt))
+    if not fallback:
+        raise error
+    plan_ir = build_plan(profile, index)
+    return plan_to_markdown(plan_ir), plan_ir, "local-fallback"
+
+
+def _run_batch(todo: list, client, model: str, df, index: CatalogIndex, checkpoint: Checkpoint,
+               finish: Callable, poll_seconds: float, fallback: bool):
+    """Invia le richieste AI in un unico batch job del provider e ne elabora le risposte."""
+    parsers, requests = {}, []
+    for client_id, profile in todo:
+        try:
+            contents, config, parse = prepare_request(profile, df, index)
+        except Exception as e:
+            finish(client_id, profile, None, None, "error", error=f"{type(e).__name__}: {e}")
+            continue
+        parsers[client_id] = (profile, parse)
+        requests.append({"contents": contents, "config": config, "metadata": {"client": client_id}})
+    if not requests:
+        return
+
+    clients = list(parsers)
+    pending = checkpoint.batch
+    if pending and pending.get("clients") == clients:
+        job_name = pending["batch"]  # ripresa di un batch job già inviato
+    else:
+        job_name = client.batches.create(
+            model=model, src=requests, config={"display_name": f"roster-{len(requests)}"}
+        ).name
+        checkpoint.record({"batch": job_name, "clients": clients})
+
+    job = client.batches.get(name=job_name)
+    while str(getattr(job.state, "name", job.state)) not in BATCH_DONE_STATES:
+        time.sleep(poll_seconds)
+        job = client.batches.get(name=job_name)
+
+    responses = (job.dest.inlined_responses if job.dest else None) or []
+    for item in responses:
+        metrics.record_tokens(model, item.response)
+    for i, client_id in enumerate(clients):
+        profile, parse = parsers[client_id]
+        item = responses[i] if i < len(responses) else None
+        plan_md = plan_ir = None
+        if item is not None and not item.error:
+            try:
+                plan_md, plan_ir = parse(extract_response_text(item.response))
+            except Exception:
+                plan_md = None
+        if plan_md:
+            finish(client_id, profile, plan_md, plan_ir, "ai-batch")
+        elif fallback:
+            plan_ir = build_plan(profile, index)
+            finish(client_id, profile, plan_to_markdown(plan_ir), plan_ir, "local-fallback")
+        else:
+            finish(client_id, profile, None, None, "error", error=str(getattr(item, "error", None) or "Risposta vuota"))
+
+
+def run_roster(entries: list, out_dir: str, client, model: str, df, index: CatalogIndex,
+               concurrency: int = 4, rpm: float = 30, use_batch: bool = False, fallback: bool = True,
+               progress: Optional[Callable] = None, poll_seconds: float = BATCH_POLL_SECONDS,
+               invalid: Iterable = ()) -> dict:
+    """Genera le schede dei clienti non ancora completati e restituisce il riepilogo.
+
+    `invalid` sono le righe scartate da `read_roster`, riportate come errori. Un
+    cliente che fallisce (generazione o scrittura dei file) non ferma gli altri:
+    il riepilogo ne elenca l'errore in `failures`. `progress(completati, totale,
+    cliente, esito)` viene chiamata dopo ogni cliente.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint = Checkpoint(out_dir)
+    invalid = list(invalid)
+    todo = [(client_id, profile) for client_id, profile in entries if client_id not in checkpoint.done]
+    total, started = len(entries) + len(invalid), time.perf_counter()
+    counts = {"skipped": len(entries) - len(todo)}
+    failures = {}
+    lock = threading.Lock()
+
+    def finish(client_id, profile, plan_md, plan_ir, source, error=None):
+        entry = {"client": client_id, "source": source}
+        if plan_md:
+            try:
+                files = write_client_files(out_dir, client_id, profile, plan_md, plan_ir, index)
+                entry.update(status="done", files=files)
+            except Exception as e:
+                source = "error"
+                entry.update(source=source, status="error", error=f"{type(e).__name__}: {e}")
+        else:
+            entry.update(status="error", error=error)
+        try:
+            checkpoint.record(entry)
+        except OSError as e:
+            entry.update(status="error", error=f"checkpoint non salvato: {e}")
+        with lock:
+            counts[source] = counts.get(source, 0) + 1
+            if entry["status"] == "error":
+                failures[client_id] = entry["error"]
+            completed = len(checkpoint.done)
+        if progress:
+            try:
+                progress(completed, total, client_id, source)
+            except Exception as e:
+                print(f"Avanzamento non aggiornato per {client_id}: {e}", file=sys.stderr)
+
+    for client_id, error in invalid:
+        finish(client_id, None, None, None, "error", error=error)
+
+    def run_one(client_id, profile):
+        try:
+            plan_md, plan_ir, source = generate_with_retry(
+                client, model, profile, df, index, limiter, fallback=fallback
+            )
+            finish(client_id, profile, plan_md, plan_ir, source)
+        except Exception as e:
+            finish(client_id, profile, None, None, "error", error=f"{type(e).__name__}: {e}")
+
+    limiter = RateLimiter(rpm)
+    if use_batch:
+        local = [(c, p) for c, p in todo if p.get("engine_mode") == ENGINE_LOCAL]
+        remote = [(c, p) for c, p in todo if p.get("engine_mode") != ENGINE_LOCAL]
+        for client_id, profile in local:
+            run_one(client_id, profile)
+        if remote:
+            _run_batch(remote, client, model, df, index, checkpoint, finish, poll_seconds, fallback)
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="hevy-bulk") as pool:
+            for future in as_completed([pool.submit(run_one, c, p) for c, p in todo]):
+                future.result()
+
+    return dict(counts, total=total, done=len(checkpoint.done), failures=failures,
+                seconds=time.perf_counter() - started)
+
+
+def zip_results(out_dir: str) -> bytes:
+    """Archivio zip con le schede (.md e .pdf) generate in `out_dir`."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for entry in Checkpoint(out_dir).done.values():
+            for name in entry.get("files", []):
+                archive.write(os.path.join(out_dir, name), name)
+    return buffer.getvalue()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Genera le schede per un roster di clienti (CSV o JSONL).")
+    parser.add_argument("roster", help="file .csv o .jsonl con un cliente per riga")
+    parser.add_argument("-o", "--output", default="clienti", help="cartella di destinazione (default: clienti)")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="richieste contemporanee (default: 4)")
+    parser.add_argument("--rpm", type=float, default=30, help="richieste al minuto, 0 = nessun limite (default: 30)")
+    parser.add_argument("--model", default=os.environ.get("GEMINI_MODEL", DEFAULT_MODEL))
+    parser.add_argument("--batch", action="store_true", help="usa i batch job del provider invece delle chiamate dirette")
+    parser.add_argument("--no-fallback", action="store_true", help="non ripiegare sul motore locale se l'AI fallisce")
+    parser.add_argument("--stub", action="store_true", help="usa il client finto locale (nessuna chiamata di rete)")
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+
+    df = pd.read_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), "exercises_db.csv"))
+    index = CatalogIndex.from_dataframe(df)
+    if args.stub:
+        from genai_stub import StubClient
+        client = StubClient(index)
+    else:
+        import google.genai as genai
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            print("❌ Imposta GEMINI_API_KEY (oppure usa --stub)")
+            return 2
+        client = genai.Client(api_key=api_key)
+
+    entries, invalid = load_roster(args.roster)
+
+    def progress(completed, total, client_id, source):
+        print(f"[{completed}/{total}] {client_id}: {source}", file=sys.stderr)
+
+    summary = run_roster(
+        entries, args.output, client, args.model, df, index,
+        concurrency=args.concurrency, rpm=args.rpm, use_batch=args.batch,
+        fallback=not args.no_fallback, progress=progress, poll_seconds=0.5 if args.stub else BATCH_POLL_SECONDS,
+        invalid=invalid,
+    )
+    for client_id, error in summary["failures"].items():
+        print(f"❌ {client_id}: {error}", file=sys.stderr)
+    print(f"🎉 {summary['done']}/{summary['total']} clienti completati in {summary['seconds']:.1f}s "
+          f"(già fatti: {summary['skipped']}, ripieghi locali: {summary.get('local-fallback', 0)}, "
+          f"errori: {summary.get('error', 0)})")
+    return 0 if summary["done"] == summary["total"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""Indici in memoria sul catalogo esercizi (exercises_db.csv)."""
+import bisect
+import hashlib
+import json
+import re
+from collections import defaultdict
+from typing import Optional
+
+# Attrezzi considerati per ciascuna preferenza della sidebar
+GYM_EQUIPMENT = {"Barbell", "Dumbbell", "Machine", "Cable", "E-Z Curl Bar", "Kettlebells"}
+HOME_EQUIPMENT = {"Bodyweight", "Bands", "Exercise Ball", "Medicine Ball"}
+
+# Parole chiave per classificare il ruolo dell'esercizio nella seduta
+# Cardio a bassa intensità: usato come riscaldamento, non come esercizio principale
+CARDIO_KEYWORDS = ("bicycling", "elliptical", "jogging", "treadmill", "stairmaster", "stationary", "rope jumping")
+WARMUP_KEYWORDS = ("stretch", "dynamic", "mobility", "circles", "swings", "smr") + CARDIO_KEYWORDS
+UNILATERAL_KEYWORDS = (
+    "single", "one arm", "one-arm", "one leg", "one-leg", "alternating", "alternate",
+    "lunge", "split squat", "step-up", "step up", "unilateral", "bulgarian",
+)
+CORE_MUSCLES = {"Abdominals", "Lower Back"}
+
+# Ordine fisiologico dei ruoli all'interno di un giorno
+ROLE_ORDER = {"warmup": 0, "compound": 1, "unilateral": 2, "isolation": 3, "core": 4}
+
+# Colonne restituite dall'esploratore del catalogo
+EXPLORER_COLUMNS = ("id", "name", "muscle_group", "equipment", "type")
+FACETS = ("muscle_group", "equipment", "type")
+
+# Traduzione gruppi muscolari inglese -> italiano
+MUSCLE_TRANSLATION = {
+    "Chest": "Petto",
+    "Back": "Schiena",
+    "Middle Back": "Dorsali",
+    "Shoulders": "Spalle",
+    "Biceps": "Bicipiti",
+    "Triceps": "Tricipiti",
+    "Legs": "Gambe",
+    "Quadriceps": "Quadricipiti",
+    "Hamstrings": "Femorali",
+    "Glutes": "Glutei",
+    "Calves": "Polpacci",
+    "Abs": "Addominali",
+    "Abdominals": "Addominali",
+    "Core": "Core",
+    "Forearms": "Avambracci",
+    "Traps": "Trapezio",
+    "Lats": "Dorsali",
+    "Lower Back": "Lombari",
+    "Full Body": "Tutto il Corpo",
+    "Cardio": "Cardio",
+    "Neck": "Collo",
+    "Abductors": "Abduttori",
+    "Adductors": "Adduttori",
+    "Other": "Altro",
+}
+
+
+def translate_muscle(muscle):
+    """Traduce il nome del gruppo muscolare in italiano."""
+    return MUSCLE_TRANSLATION.get(muscle, muscle)
+
+
+def _words(text: str) -> list:
+    return re.findall(r"\w+", str(text).lower())
+
+
+def _trigrams(word: str) -> set:
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def exercise_role(record: dict) -> str:
+    """Classifica un esercizio: warmup, compound, unilateral, isolation o core."""
+    name = str(record.get("name", "")).lower()
+    if record.get("equipment") == "Foam Roll" or any(k in name for k in WARMUP_KEYWORDS):
+        return "warmup"
+    if record.get("muscle_group") in CORE_MUSCLES:
+        return "core"
+    if any(k in name for k in UNILATERAL_KEYWORDS):
+        return "unilateral"
+    if record.get("type") == "Isolation":
+        return "isolation"
+    return "compound"
+
+
+class CatalogIndex:
+    """Indici precalcolati per muscolo, attrezzo, tipo e ruolo."""
+
+    def __init__(self, records: list):
+        self.records = []
+        self.by_id = {}
+        self.by_muscle = defaultdict(list)
+        self.by_equipment = defaultdict(list)
+        self.by_type = defaultdict(list)
+        self.by_role = defaultdict(list)
+        self.names_by_id = {}
+        self.ids_by_name = {}
+        # Indice per sostituzioni: stesso muscolo, stesso attrezzo, stessa meccanica
+        self.by_signature = defaultdict(list)
+        # Indici di ricerca per l'esploratore (posizioni in self.records)
+        self.facet_positions = {facet: defaultdict(set) for facet in FACETS}
+        self.trigram_positions = defaultdict(set)
+        word_entries = []
+        for pos, rec in enumerate(records):
+            rec = dict(rec, role=exercise_role(rec))
+            self.records.append(rec)
+            for facet in FACETS:
+                self.facet_positions[facet][rec[facet]].add(pos)
+            for word in _words(rec["name"]):
+                word_entries.append((word, pos))
+                for gram in _trigrams(word):
+                    self.trigram_positions[gram].add(pos)
+            self.by_id[rec["id"]] = rec
+            self.names_by_id[rec["id"]] = rec["name"]
+            self.ids_by_name[str(rec["name"]).lower()] = rec["id"]
+            self.by_signature[(rec["muscle_group"], rec["equipment"], rec["type"])].append(rec)
+            self.by_muscle[rec["muscle_group"]].append(rec)
+            self.by_equipment[rec["equipment"]].append(rec)
+            self.by_type[rec["type"]].append(rec)
+            self.by_role[rec["role"]].append(rec)
+        # Parole dei nomi ordinate: ricerca per prefisso con bisect
+        word_entries.sort()
+        self.words = [w for w, _ in word_entries]
+        self.word_positions = [p for _, p in word_entries]
+
+    @classmethod
+    def from_dataframe(cls, df) -> "CatalogIndex":
+        """Costruisce l'indice da un DataFrame con le colonne del CSV."""
+        if df is None or df.empty:
+            return cls([])
+        return cls(df.to_dict("records"))
+
+    def alternatives(self, ex_id: str, exclude=(), limit: int = 8) -> list:
+        """Alternative per un esercizio: prima stessa firma, poi stesso muscolo e meccanica."""
+        rec = self.by_id.get(ex_id)
+        if rec is None:
+            return []
+        skip = set(exclude) | {ex_id}
+        tiers = (
+            self.by_signature[(rec["muscle_group"], rec["equipment"], rec["type"])],
+            [r for r in self.by_muscle[rec["muscle_group"]] if r["type"] == rec["type"]],
+            self.by_muscle[rec["muscle_group"]],
+        )
+        result = []
+        for tier in tiers:
+            for cand in tier:
+                # Un warm-up si sostituisce solo con un altro warm-up, e viceversa
+                if cand["id"] in skip or (cand["role"] == "warmup") != (rec["role"] == "warmup"):
+                    continue
+                skip.add(cand["id"])
+                result.append(cand)
+                if len(result) >= limit:
+                    return result
+        return result
+
+    def _match_word(self, word: str) -> set:
+        """Posizioni dei nomi con una parola che inizia con `word` o che la contiene."""
+        start = bisect.bisect_left(self.words, word)
+        end = bisect.bisect_left(self.words, word + "\uffff", start)
+        found = set(self.word_positions[start:end])
+        grams = _trigrams(word)
+        if grams:
+            # Sottostringa: intersezione delle liste di trigrammi, poi verifica sul nome
+            candidates = set.intersection(*(self.trigram_positions.get(g, set()) for g in grams))
+            found |= {p for p in candidates - found if word in self.records[p]["name"].lower()}
+        return found
+
+    def filter_positions(self, **facets) -> Optional[set]:
+        """Posizioni che rispettano tutti i facet indicati (None se nessun filtro è attivo)."""
+        selected = None
+        for facet, values in facets.items():
+            if not values:
+                continue
+            allowed = set().union(*(self.facet_positions[facet].get(v, set()) for v in values))
+            selected = allowed if selected is None else selected & allowed
+        return selected
+
+    def search(self, query: str = "", page: int = 0, page_size: int = 25, **facets) -> tuple:
+        """Restituisce (esercizi della pagina, totale) filtrando per nome e per facet.
+
+        `facets` accetta muscle_group, equipment e type come elenchi di valori ammessi;
+        vengono serializzate solo le righe della pagina richiesta.
+        """
+        selected = None
+        for word in _words(query):
+            matched = self._match_word(word)
+            selected = matched if selected is None else selected & matched
+        allowed = self.filter_positions(**facets)
+        if allowed is not None:
+            selected = allowed if selected is None else selected & allowed
+        if selected is None:
+            total = len(self.records)
+            positions = range(page * page_size, min(total, (page + 1) * page_size))
+        else:
+            total = len(selected)
+            positions = sorted(selected)[page * page_size:(page + 1) * page_size]
+        rows = [{col: self.records[p][col] for col in EXPLORER_COLUMNS} for p in positions]
+        return rows, total
+
+    def __len__(self):
+        return len(self.records)
+
+
+class CatalogMetadata:
+    """Metadati derivati dal catalogo, calcolati una volta per versione.
+
+    Valori e conteggi per facet, etichette italiane dei muscoli con la mappa
+    inversa e l'hash del catalogo; condivisi da intestazione, sidebar,
+    esploratore e selezione dei candidati.
+    """
+
+    def __init__(self, index: CatalogIndex):
+        self.total = len(index)
+        self.catalog_hash = hashlib.blake2b(
+            json.dumps([{col: r[col] for col in EXPLORER_COLUMNS} for r in index.records],
+                       sort_keys=True, default=str).encode("utf-8"),
+            digest_size=8,
+        ).hexdigest()
+        self.facet_counts = {
+            facet: {value: len(positions) for value, positions in index.facet_positions[facet].items()}
+            for facet in FACETS
+        }
+        self.facet_values = {facet: sorted(counts) for facet, counts in self.facet_counts.items()}
+        self.muscle_labels = {m: translate_muscle(m) for m in self.facet_values["muscle_group"]}
+        # Più gruppi possono avere la stessa etichetta (es. Lats e Middle Back -> Dorsali)
+        self.muscles_by_label = defaultdict(list)
+        for muscle, label in self.muscle_labels.items():
+            self.muscles_by_label[label].append(muscle)
+        self.muscle_options = sorted(self.muscles_by_label)
+
+    def muscles_for_labels(self, labels) -> list:
+        """Gruppi muscolari (in inglese, come nel CSV) per le etichette scelte nella sidebar."""
+        return [m for label in labels for m in self.muscles_by_label.get(label, [label])]
+
+    def labels_for_muscles(self, muscles) -> list:
+        """Etichette già presenti tra le opzioni per i muscoli salvati (inglesi o già tradotti)."""
+        labels = {self.muscle_labels.get(m, m) for m in muscles}
+        return [label for label in self.muscle_options if label in labels]
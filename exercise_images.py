@@ -0,0 +1,237 @@
+"""Immagini degli esercizi: mirror locale di free-exercise-db e miniature in cache.
+
+Il mirror scarica in parallelo le immagini del database in DATA_DIR/images/<id>/
+e registra dimensione e SHA-256 di ogni file in un manifest append-only
+(manifest.jsonl): rilanciando si riprende dai file mancanti, e un download
+interrotto continua dal file .part con una richiesta Range.
+
+Le miniature sono create una sola volta per immagine e variante. Quelle per l'app
+sono WebP in static/thumbs (servite da Streamlit con `enableStaticServing`) e il
+browser le carica per URL: non passano mai dal payload del rerun. Quelle per il
+PDF sono JPEG, perché FPDF 1.7 non legge il WebP, e ne entrano solo fino al
+budget PDF_IMAGE_BUDGET.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Optional
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from storage import DATA_DIR
+
+try:
+    from PIL import Image, features
+except ImportError:  # senza Pillow niente miniature (il mirror funziona comunque)
+    Image = features = None
+
+IMAGE_BASE_URL = "https://raw.githubusercontent.com/yuhonas/free-exercise-db/main/exercises/"
+IMAGES_DIR = os.path.join(DATA_DIR, "images")
+MANIFEST_FILE = "manifest.jsonl"
+DOWNLOAD_CONCURRENCY = 8
+DOWNLOAD_RETRIES = 3
+CHUNK_SIZE = 64 * 1024
+
+# Cartella servita da Streamlit come /app/static (vedi .streamlit/config.toml)
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+THUMBS_DIR = os.path.join(STATIC_DIR, "thumbs")
+THUMBS_URL = "app/static/thumbs"
+# Variante -> (lato massimo in px, formato, qualità)
+VARIANTS = {
+    "table": (48, "WEBP", 70),
+    "explorer": (96, "WEBP", 75),
+    "pdf": (160, "JPEG", 70),
+}
+# Byte di immagini incorporabili in un PDF; oltre, gli esercizi restano senza figura
+PDF_IMAGE_BUDGET = int(os.environ.get("HEVY_PDF_IMAGE_BUDGET", str(256 * 1024)))
+
+
+class Manifest:
+    """Registro append-only dei file scaricati (l'ultima riga per percorso vince)."""
+
+    def __init__(self, root: str = IMAGES_DIR):
+        self.root = root
+        self.path = os.path.join(root, MANIFEST_FILE)
+        self.entries = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # riga troncata da un'interruzione
+                    self.entries[entry["path"]] = entry
+
+    def record(self, rel_path: str, size: int, sha256: str, url: str):
+        entry = {"path": rel_path, "bytes": size, "sha256": sha256, "url": url, "at": time.time()}
+        with self._lock:
+            self.entries[rel_path] = entry
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def is_valid(self, rel_path: str, verify: bool = False) -> bool:
+        """True se il file esiste con la dimensione (e, con `verify`, l'hash) registrati."""
+        entry = self.entries.get(rel_path)
+        full_path = os.path.join(self.root, rel_path)
+        if entry is None or not os.path.exists(full_path) or os.path.getsize(full_path) != entry["bytes"]:
+            return False
+        return not verify or _sha256(full_path) == entry["sha256"]
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _download(session, url: str, dest: str) -> int:
+    """Scarica `url` in `dest` riprendendo dal .part; restituisce i byte del file."""
+    part = dest + ".part"
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with session.get(url, headers=headers, stream=True, timeout=30) as response:
+        if response.status_code == 416:
+            # Il .part era già completo
+            os.replace(part, dest)
+            return offset
+        response.raise_for_status()
+        # Server che ignora Range: si riparte da zero
+        mode = "ab" if offset and response.status_code == 206 else "wb"
+        with open(part, mode) as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+    os.replace(part, dest)
+    return os.path.getsize(dest)
+
+
+def mirror_images(images: dict, root: str = IMAGES_DIR, base_url: str = IMAGE_BASE_URL,
+                  concurrency: int = DOWNLOAD_CONCURRENCY, verify: bool = False,
+                  progress: Optional[Callable] = None) -> dict:
+    """Scarica le immagini `{id: ["<id>/0.jpg", ...]}` mancanti dal manifest.
+
+    `progress(completati, totale)` viene chiamata dal thread chiamante.
+    """
+    manifest = Manifest(root)
+    paths = [p for paths in images.values() for p in paths]
+    missing = [p for p in paths if not manifest.is_valid(p, verify)]
+    summary = {"total": len(paths), "skipped": len(paths) - len(missing), "downloaded": 0, "bytes": 0, "failed": []}
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    def fetch(rel_path: str) -> int:
+        dest = os.path.join(root, rel_path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        url = base_url + quote(rel_path)
+        for attempt in range(DOWNLOAD_RETRIES):
+            try:
+                size = _download(session, url, dest)
+                break
+            except requests.RequestException as e:
+                status = e.response.status_code if e.response is not None else None
+                # 404 e simili non cambiano riprovando
+                if attempt == DOWNLOAD_RETRIES - 1 or (status and status < 500 and status != 429):
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+        manifest.record(rel_path, size, _sha256(dest), url)
+        return size
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        futures = {pool.submit(fetch, p): p for p in missing}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                summary["bytes"] += future.result()
+                summary["downloaded"] += 1
+            except Exception as e:
+                summary["failed"].append(f"{futures[future]}: {e}")
+            if progress:
+                progress(done, len(futures))
+    session.close()
+    return summary
+
+
+def source_image(exercise_id: str, root: str = IMAGES_DIR) -> Optional[str]:
+    """Prima immagine dell'esercizio nel mirror, se presente."""
+    path = os.path.join(root, exercise_id, "0.jpg")
+    return path if exercise_id and os.path.exists(path) else None
+
+
+def _variant(variant: str) -> tuple:
+    size, fmt, quality = VARIANTS[variant]
+    if fmt == "WEBP" and not features.check("webp"):
+        fmt = "JPEG"
+    return size, fmt, quality, "webp" if fmt == "WEBP" else "jpg"
+
+
+def thumbnail_path(exercise_id: str, variant: str = "explorer") -> Optional[str]:
+    """Miniatura dell'esercizio, creata alla prima richiesta; None senza immagine o Pillow."""
+    if Image is None or not exercise_id:
+        return None
+    size, fmt, quality, ext = _variant(variant)
+    path = os.path.join(THUMBS_DIR, variant, f"{exercise_id}.{ext}")
+    if os.path.exists(path):
+        return path
+    source = source_image(exercise_id)
+    if source is None:
+        return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        with Image.open(source) as image:
+            image = image.convert("RGB")
+            image.thumbnail((size, size))
+            image.save(tmp_path, fmt, quality=quality, optimize=True)
+        os.replace(tmp_path, path)
+    except OSError:
+        return None
+    return path
+
+
+def thumbnail_url(exercise_id: str, variant: str = "explorer") -> Optional[str]:
+    """URL relativo della miniatura per il browser (caricata solo quando visibile)."""
+    path = thumbnail_path(exercise_id, variant)
+    return f"{THUMBS_URL}/{variant}/{quote(os.path.basename(path))}" if path else None
+
+
+def pdf_images(exercises: list, budget: int = PDF_IMAGE_BUDGET) -> list:
+    """(nome, percorso JPEG) per gli esercizi `[(id, nome)]`, senza doppioni e nel budget di byte."""
+    images, seen, used = [], set(), 0
+    for exercise_id, name in exercises:
+        if exercise_id in seen:
+            continue
+        seen.add(exercise_id)
+        path = thumbnail_path(exercise_id, "pdf")
+        if path is None:
+            continue
+        size = os.path.getsize(path)
+        if used + size > budget:
+            break
+        used += size
+        images.append((name, path))
+    return images
+
+
+def thumbnail_markdown(md_text: str, url_for_name: Callable) -> str:
+    """Markdown della scheda con la miniatura davanti al nome dell'esercizio (solo per lo schermo)."""
+    lines = []
+    for line in md_text.splitlines():
+        stripped = line.strip()
+        # Intestazioni e separatori non corrispondono a nessun esercizio: restano invariati
+        if stripped.startswith("|"):
+            cells = stripped.strip("|").split("|")
+            url = url_for_name(cells[0].replace("**", "").strip())
+            if url:
+                cells[0] = f" ![]({url}) {cells[0].strip()} "
+                line = "|" + "|".join(cells) + "|"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,133 @@
+"""Registrazione e riproduzione delle chiamate `generate_content` come fixture JSON.
+
+Avvolge un client google-genai (o genai_stub.StubClient): ogni richiesta è
+identificata dall'impronta di modello, prompt e configurazione. In registrazione
+la risposta reale viene salvata in `<cartella>/<impronta>.json` con testo, token e
+latenza; in riproduzione viene restituita dal file, senza rete e in modo
+deterministico. Una richiesta senza fixture in riproduzione solleva FixtureMissing.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+from generation import extract_response_text
+
+RECORD, REPLAY, AUTO = "record", "replay", "auto"
+
+
+class FixtureMissing(KeyError):
+    """Nessuna fixture per la richiesta (il prompt o la configurazione sono cambiati)."""
+
+
+def _config_payload(config) -> Optional[dict]:
+    if config is None:
+        return None
+    if hasattr(config, "model_dump"):
+        return config.model_dump(mode="json", exclude_none=True)
+    return config
+
+
+def fingerprint(model: str, contents, config=None) -> str:
+    """Impronta stabile della richiesta (modello, prompt, configurazione)."""
+    canonical = json.dumps(
+        {"model": model, "contents": contents, "config": _config_payload(config)},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str,
+    )
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=12).hexdigest()
+
+
+def _response(fixture: dict) -> SimpleNamespace:
+    usage = fixture.get("usage") or {}
+    return SimpleNamespace(
+        text=fixture.get("text"), candidates=None,
+        usage_metadata=SimpleNamespace(
+            prompt_token_count=usage.get("prompt_tokens"),
+            candidates_token_count=usage.get("response_tokens"),
+        ),
+        latency_ms=fixture.get("latency_ms"),
+        fingerprint=fixture.get("fingerprint"),
+    )
+
+
+class _Models:
+    def __init__(self, recorder: "ReplayClient"):
+        self._recorder = recorder
+
+    def generate_content(self, model: str, contents, config=None):
+        return self._recorder.generate_content(model, contents, config)
+
+
+class ReplayClient:
+    """Client con la stessa interfaccia `models.generate_content`, basato sulle fixture.
+
+    `mode`: "replay" (solo fixture), "record" (chiama sempre `client` e sovrascrive)
+    oppure "auto" (fixture se presente, altrimenti registra). Con `simulate_latency`
+    la riproduzione attende la latenza registrata.
+    """
+
+    def __init__(self, fixtures_dir: str, client=None, mode: str = REPLAY, simulate_latency: bool = False):
+        if mode != REPLAY and client is None:
+            raise ValueError("Per registrare serve un client reale")
+        self.fixtures_dir = fixtures_dir
+        self.client = client
+        self.mode = mode
+        self.simulate_latency = simulate_latency
+        self.models = _Models(self)
+        self.stats = {"replayed": 0, "recorded": 0}
+        self._lock = threading.Lock()
+        os.makedirs(fixtures_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.fixtures_dir, f"{key}.json")
+
+    def load(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def generate_content(self, model: str, contents, config=None):
+        key = fingerprint(model, contents, config)
+        fixture = self.load(key) if self.mode != RECORD else None
+        if fixture is None and self.mode == REPLAY:
+            raise FixtureMissing(key)
+        if fixture is None:
+            fixture = self._record(key, model, contents, config)
+        else:
+            with self._lock:
+                self.stats["replayed"] += 1
+            if self.simulate_latency and fixture.get("latency_ms"):
+                time.sleep(fixture["latency_ms"] / 1000)
+        return _response(fixture)
+
+    def _record(self, key: str, model: str, contents, config) -> dict:
+        started = time.perf_counter()
+        response = self.client.models.generate_content(model=model, contents=contents, config=config)
+        latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        usage = getattr(response, "usage_metadata", None)
+        fixture = {
+            "fingerprint": key,
+            "model": model,
+            "recorded_at": time.time(),
+            "latency_ms": latency_ms,
+            "prompt_chars": len(str(contents)),
+            "prompt_head": str(contents)[:200],
+            "text": extract_response_text(response),
+            "usage": {
+                "prompt_tokens": getattr(usage, "prompt_token_count", None),
+                "response_tokens": getattr(usage, "candidates_token_count", None),
+            },
+        }
+        # Scrittura atomica: una fixture troncata non deve rompere le riproduzioni
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(fixture, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            self.stats["recorded"] += 1
+        return fixture
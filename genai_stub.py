@@ -0,0 +1,136 @@
+"""Client finto compatibile con google-genai, per provare la generazione senza rete.
+
+Risponde a `models.generate_content` e ai batch job (`batches.create` / `batches.get`)
+con schede costruite dal motore locale, nel formato richiesto dallo schema della
+richiesta. Latenza ed errori simulati (es. 429) sono configurabili per verificare
+concorrenza, rate limit e retry.
+"""
+import itertools
+import json
+import re
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+from catalog import CatalogIndex
+from plan_engine import build_plan
+from plan_ir import DAY_RESPONSE_SCHEMA, NOTES_RESPONSE_SCHEMA, plan_to_markdown
+from prefs_store import default_preferences
+
+# Campi del profilo ricavati dal testo del prompt completo (generation.build_prompt)
+PROMPT_FIELDS = {
+    "split_type": r"TIPO DI SPLIT: (.+)",
+    "duration": r"DURATA MEDIA: (\d+)",
+    "equipment_pref": r"ATTREZZATURA: (Con attrezzi|Senza attrezzi)",
+    "training_level": r"LIVELLO: (Principiante|Super Esperto|Esperto)",
+    "days": r"scheda di allenamento di (\d+) giorni",
+}
+
+
+class StubError(RuntimeError):
+    """Errore simulato dell'API (stesso testo di un 429 reale)."""
+
+
+def _profile_from_prompt(prompt: str) -> dict:
+    profile = default_preferences()
+    for field, pattern in PROMPT_FIELDS.items():
+        match = re.search(pattern, prompt)
+        if match:
+            value = match.group(1).strip()
+            profile[field] = int(value) if value.isdigit() else value
+    goals = re.search(r"OBIETTIVI UTENTE: (.+)", prompt)
+    if goals:
+        profile["goals"] = [g.strip() for g in goals.group(1).split(",")]
+    return profile
+
+
+class _Models:
+    def __init__(self, stub: "StubClient"):
+        self._stub = stub
+
+    def generate_content(self, model: str, contents, config=None):
+        self._stub._tick()
+        return self._stub.response(str(contents), config)
+
+
+class _Batches:
+    def __init__(self, stub: "StubClient"):
+        self._stub = stub
+        self._jobs = {}
+
+    def create(self, model: str, src, config=None):
+        requests = src if isinstance(src, list) else src.inlined_requests
+        name = f"batches/stub-{uuid.uuid4().hex[:12]}"
+        responses = []
+        for req in requests:
+            contents = req["contents"] if isinstance(req, dict) else req.contents
+            req_config = req.get("config") if isinstance(req, dict) else req.config
+            responses.append(SimpleNamespace(response=self._stub.response(str(contents), req_config), error=None))
+        self._jobs[name] = {"polls": 0, "responses": responses}
+        return SimpleNamespace(name=name, state="JOB_STATE_PENDING", dest=None)
+
+    def get(self, name: str):
+        job = self._jobs[name]
+        job["polls"] += 1
+        if job["polls"] < self._stub.batch_polls:
+            return SimpleNamespace(name=name, state="JOB_STATE_RUNNING", dest=None)
+        return SimpleNamespace(
+            name=name, state="JOB_STATE_SUCCEEDED",
+            dest=SimpleNamespace(inlined_responses=job["responses"]),
+        )
+
+
+class StubClient:
+    """Sostituto di `genai.Client` con risposte locali.
+
+    `latency` sono i secondi di attesa per chiamata, `fail_every` fa fallire una
+    chiamata ogni N con un 429 simulato, `batch_polls` è il numero di `get` prima che
+    un batch job risulti completato.
+    """
+
+    def __init__(self, index: CatalogIndex, latency: float = 0.0, fail_every: int = 0, batch_polls: int = 2):
+        self.index = index
+        self.latency = latency
+        self.fail_every = fail_every
+        self.batch_polls = batch_polls
+        self.models = _Models(self)
+        self.batches = _Batches(self)
+        self._calls = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _tick(self):
+        with self._lock:
+            call = next(self._calls)
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_every and call % self.fail_every == 0:
+            raise StubError("429 RESOURCE_EXHAUSTED (simulato)")
+
+    def response(self, prompt: str, config=None) -> SimpleNamespace:
+        """Risposta nel formato di google-genai, con un conteggio token approssimato (4 caratteri)."""
+        text = self.answer(prompt, config)
+        usage = SimpleNamespace(prompt_token_count=len(prompt) // 4, candidates_token_count=len(text) // 4)
+        return SimpleNamespace(text=text, candidates=None, usage_metadata=usage)
+
+    def answer(self, prompt: str, config=None) -> str:
+        """Testo di risposta coerente con lo schema richiesto."""
+        schema = getattr(config, "response_schema", None)
+        if schema == NOTES_RESPONSE_SCHEMA:
+            ids = re.findall(r"^(\S+) \| ", prompt, flags=re.MULTILINE)
+            return json.dumps({"notes": [
+                {"id": ex_id, "note": "Esecuzione controllata", "progression": "+1 ripetizione a settimana"}
+                for ex_id in ids
+            ]})
+        plan = build_plan(_profile_from_prompt(prompt), self.index)
+        days = [
+            {"title": day["title"], "rows": [
+                {k: row[k] for k in ("id", "sets", "reps", "rest", "note")} for row in day["rows"]
+            ]}
+            for day in plan["days"]
+        ]
+        if schema == DAY_RESPONSE_SCHEMA:
+            return json.dumps(days[0])
+        if schema is None:
+            return plan_to_markdown(plan)
+        return json.dumps({"days": days})
@@ -0,0 +1,287 @@
+"""Costruzione dei prompt e chiamata al modello per le varie modalità di generazione."""
+import threading
+import time
+from typing import Optional
+
+import httpx
+from google.genai import errors as genai_errors
+from google.genai import types
+
+import metrics
+from catalog import CatalogIndex
+from plan_engine import allowed_equipment, build_plan, fit_plan
+from plan_ir import (
+    DAY_RESPONSE_SCHEMA,
+    NOTES_RESPONSE_SCHEMA,
+    PLAN_RESPONSE_SCHEMA,
+    day_from_json,
+    expand_plan,
+    merge_notes,
+    plan_from_json,
+    plan_to_markdown,
+)
+
+ENGINE_AI = "AI completa"
+ENGINE_DRAFT = "Bozza locale + rifinitura AI"
+ENGINE_HYBRID = "Ibrida: esercizi locali + note AI"
+ENGINE_LOCAL = "Solo motore locale (istantaneo)"
+ENGINE_OPTIONS = [ENGINE_AI, ENGINE_DRAFT, ENGINE_HYBRID, ENGINE_LOCAL]
+# Errori dopo cui si ripiega sul motore locale: API (quota, rate limit, 5xx), rete
+# (httpx è il trasporto di google-genai) e risposta vuota o non valida
+GENERATION_ERRORS = (genai_errors.APIError, httpx.HTTPError, ValueError)
+
+# Catalogo serializzato per il prompt: (DataFrame, structured) -> testo
+_catalog_texts = {}
+_catalog_lock = threading.Lock()
+
+
+def catalog_text(df, structured: bool) -> str:
+    """Catalogo come testo per il prompt, riusato finché il DataFrame non cambia.
+
+    In modalità strutturata il nome è ridondante con l'id: lo omettiamo.
+    """
+    with _catalog_lock:
+        cached = _catalog_texts.get(structured)
+    if cached is not None and (cached[0] is df or cached[0].equals(df)):
+        return cached[1]
+    if structured:
+        text = df.drop(columns=["name"], errors="ignore").to_csv(index=False)
+    else:
+        text = df.to_string(index=False)
+    with _catalog_lock:
+        _catalog_texts[structured] = (df, text)
+    return text
+
+
+def build_prompt(profile: dict, df, structured: bool, draft: Optional[dict] = None) -> str:
+    """Prompt completo con l'intero catalogo (modalità AI e bozza + rifinitura)."""
+    goals = profile.get("goals") or ["Equilibrato"]
+    focus_area = profile.get("focus_area") or []
+
+    # Trasformiamo il dataframe in una stringa di testo per darlo in pasto all'IA
+    exercises_list_str = catalog_text(df, structured)
+
+    # Bozza locale: l'IA deve solo rifinire (meno ragionamento, risposta più rapida)
+    draft_section = ""
+    if draft:
+        draft_rows = "\n".join(
+            f"{day['title']}: " + "; ".join(f"{r['id']} {r['sets']}x{r['reps']} rec {r['rest']}" for r in day["rows"])
+            for day in draft["days"]
+        )
+        draft_section = f"""
+            BOZZA DI PARTENZA (generata con le regole qui sotto):
+            {draft_rows}
+            Rifinisci la bozza: mantieni gli esercizi adatti, sostituisci solo quelli poco coerenti
+            con il profilo e aggiungi le note tecniche.
+            """
+
+    if structured:
+        output_format = """
+            FORMATO OUTPUT RICHIESTO:
+            Restituisci SOLO JSON conforme allo schema fornito.
+            Per ogni Giorno un oggetto con "title" (es. "Giorno 1 - Spinta") e "rows".
+            Ogni riga: "id" (copiato ESATTAMENTE dalla colonna id del database), "sets" (intero),
+            "reps" (es. "8-12"), "rest" (es. "90s"), "note" (massimo 8 parole).
+            """
+    else:
+        output_format = """
+            FORMATO OUTPUT RICHIESTO:
+            Restituisci una risposta strutturata in Markdown.
+            Per ogni Giorno (Giorno 1, Giorno 2...), elenca gli esercizi in una tabella con queste colonne:
+            | Esercizio | Serie | Ripetizioni | Recupero | Note Tecniche |
+            """
+
+    return f"""
+            Agisci come un Coach Esperto di biomeccanica e fisiologia sportiva.
+            Il tuo compito è creare una scheda di allenamento di {profile.get("days")} giorni a settimana.
+
+            OBIETTIVI UTENTE: {", ".join(goals)}
+            TIPO DI SPLIT: {profile.get("split_type")}
+            DURATA MEDIA: {profile.get("duration")} minuti
+            FOCUS MUSCOLARE RICHIESTO: {", ".join(focus_area) if focus_area else "Equilibrato"}
+            ATTREZZATURA: {profile.get("equipment_pref")} (Con attrezzi → prediligi bilancieri, manubri, macchine; Senza attrezzi → prediligi corpo libero / elastici / varianti home)
+            SESSO: {profile.get("sex_pref")} (seleziona varianti ed esercizi adeguati a comfort articolare e preferenze tipiche)
+            ETA': {profile.get("age")} (adatta volume e intensità con progressioni adeguate all'età, cura mobilità e gestione carichi)
+            LIVELLO: {profile.get("training_level")} (Principiante: esercizi facili e stabili; Esperto: esercizi intermedi con varianti controllate; Super Esperto: esercizi complessi, carichi più alti, maggior densità)
+
+            VINCOLO FONDAMENTALE:
+            Devi usare SOLO ed ESCLUSIVAMENTE gli esercizi presenti nel seguente database CSV.
+            Non inventare esercizi che non sono in questa lista.
+
+            DATABASE ESERCIZI DISPONIBILI:
+            {exercises_list_str}
+            {draft_section}
+            {output_format}
+            Logica da applicare:
+            - Se l'obiettivo è Dimagrimento: Ripetizioni alte (12-15), recuperi brevi (60s).
+            - Se l'obiettivo è Ipertrofia: Ripetizioni medie (8-12), recuperi medi (90s).
+            - Se l'obiettivo è Forza: Ripetizioni basse (3-5), recuperi lunghi (120s+).
+            - Includi note sulla postura o l'esecuzione corretta.
+
+            Ordine fisiologicamente corretto degli esercizi per ogni giorno:
+            1) Warm-up / attivazione specifica
+            2) Multarticolari pesanti (bilanciere / macchina) su pattern principali del giorno
+            3) Unilaterali / stabilità
+            4) Complementari / isolamento mirato
+            5) Core / finisher metabolico (facoltativo)
+
+            Adatta la difficoltà in base al livello:
+            - Beginner: versioni stabili (macchine / bilanciere guidato), range moderato di carico, tecnica semplice, progressioni lineari.
+            - Intermediate: introduci varianti con maggiore ROM o instabilità controllata, gestione RIR 1-3, carichi moderati-alti.
+            - Pro: esercizi complessi (bilanciere libero, varianti avanzate), superset opzionali, RIR 0-2 su esercizi principali.
+
+            Adatta gli esercizi in base all'attrezzatura:
+            - Con attrezzi: priorità a bilancieri, manubri, macchine; corpo libero solo come complemento.
+            - Senza attrezzi: priorità a corpo libero, elastici, isometrie, varianti plyo controllate; evita macchine/pesi se non disponibili.
+
+            Adatta in base al sesso:
+            - Maschio: non serve modificare i carichi target, ma cura la progressione su pattern principali (spinta/tiro/gambe) senza trascurare mobilità.
+            - Femmina: includi focus su catena posteriore e glutei se coerente con gli obiettivi, prediligi varianti che riducano stress articolare su spalle/lombare.
+
+            Restituisci output conciso, {"solo JSON" if structured else "solo Markdown"}.
+        """
+
+
+def build_hybrid_prompt(profile: dict, plan: dict) -> str:
+    """Prompt ridotto: solo gli esercizi già scelti, l'AI scrive note e progressioni."""
+    seen = set()
+    rows = []
+    for day in plan.get("days", []):
+        for r in day["rows"]:
+            if r["id"] in seen:
+                continue
+            seen.add(r["id"])
+            rows.append(f"{r['id']} | {r['name']} | {r['sets']}x{r['reps']} | rec {r['rest']}")
+    rows_str = "\n".join(rows)
+    return f"""Agisci come un Coach Esperto di biomeccanica.
+Profilo: {", ".join(profile.get("goals") or ["Equilibrato"])}; livello {profile.get("training_level")}; {profile.get("sex_pref")}, {profile.get("age")} anni; {profile.get("equipment_pref")}.
+Esercizi già programmati (id | nome | serie x ripetizioni | recupero):
+{rows_str}
+Per OGNI id restituisci in JSON: "note" (tecnica/postura, massimo 10 parole, in italiano)
+e "progression" (come progredire settimana dopo settimana, massimo 8 parole).
+"""
+
+
+def build_day_prompt(profile: dict, plan: dict, day_idx: int, df, index: CatalogIndex) -> str:
+    """Prompt per rigenerare un solo giorno: riassunto del resto della settimana e catalogo filtrato."""
+    day = plan["days"][day_idx]
+    muscles = {index.by_id[r["id"]]["muscle_group"] for r in day["rows"] if r.get("id") in index.by_id}
+    muscles.add("Abdominals")
+    equipment = allowed_equipment(profile.get("equipment_pref"))
+    # Stesse posizioni del DataFrame: l'indice è costruito dai suoi record in ordine
+    positions = index.filter_positions(muscle_group=muscles, equipment=equipment) or set()
+    candidates = df.iloc[sorted(positions)]
+    others = "\n".join(
+        f"{d['title']}: " + ", ".join(r.get("name") or r.get("id", "") for r in d["rows"])
+        for i, d in enumerate(plan["days"]) if i != day_idx
+    )
+    return f"""Agisci come un Coach Esperto di biomeccanica.
+Profilo: {", ".join(profile.get("goals") or ["Equilibrato"])}; livello {profile.get("training_level")}; {profile.get("sex_pref")}, {profile.get("age")} anni; {profile.get("equipment_pref")}; {profile.get("duration")} minuti.
+Rigenera SOLO "{day['title']}" con esercizi diversi da quelli attuali, senza ripetere il resto della settimana:
+{others}
+Ordine: warm-up, multiarticolari, unilaterali, isolamento, core.
+Usa SOLO questi esercizi (colonna id):
+{candidates.drop(columns=["name"], errors="ignore").to_csv(index=False)}
+Restituisci SOLO JSON: "title" e "rows" con "id", "sets", "reps", "rest", "note" (massimo 8 parole).
+"""
+
+
+def regenerate_day(client, model: str, profile: dict, plan: dict, day_idx: int, df, index: CatalogIndex) -> dict:
+    """Rigenera un singolo giorno con una chiamata ridotta e lo reinserisce nella scheda."""
+    response = generate_content(
+        client, model, build_day_prompt(profile, plan, day_idx, df, index), _json_config(DAY_RESPONSE_SCHEMA)
+    )
+    result_text = extract_response_text(response)
+    if not result_text:
+        raise ValueError("Risposta vuota")
+    expanded = expand_plan({"days": [day_from_json(result_text, day_idx + 1)]}, index.names_by_id)["days"]
+    if not expanded:
+        raise ValueError("Nessun esercizio valido nella risposta")
+    day = expanded[0]
+    days = list(plan["days"])
+    days[day_idx] = day
+    return dict(plan, days=days)
+
+
+def generate_content(client, model: str, contents, config=None):
+    """`client.models.generate_content` con latenza, esito e token registrati nelle metriche."""
+    started = time.perf_counter()
+    try:
+        response = client.models.generate_content(model=model, contents=contents, config=config)
+    except Exception:
+        metrics.record_generation(model, "error", time.perf_counter() - started)
+        raise
+    outcome = "ok" if extract_response_text(response) else "empty"
+    metrics.record_generation(model, outcome, time.perf_counter() - started, response)
+    return response
+
+
+def extract_response_text(response) -> Optional[str]:
+    """Estrae il testo dalla risposta (gestisce diversi formati API)."""
+    if hasattr(response, 'text') and response.text:
+        return response.text
+    if hasattr(response, 'candidates') and response.candidates:
+        candidate = response.candidates[0]
+        if hasattr(candidate, 'content') and candidate.content:
+            if hasattr(candidate.content, 'parts') and candidate.content.parts:
+                return candidate.content.parts[0].text
+    return None
+
+
+def _json_config(schema: dict) -> types.GenerateContentConfig:
+    return types.GenerateContentConfig(response_mime_type="application/json", response_schema=schema)
+
+
+def prepare_request(profile: dict, df, index: CatalogIndex) -> tuple:
+    """Richiesta al modello per `profile`: (contents, config, parse).
+
+    `parse(result_text)` restituisce (plan_md, plan_ir) come generate_plan; separare
+    la richiesta dalla chiamata permette di inviarla anche tramite i batch job.
+    Non va usata con il motore locale, che non chiama il modello.
+    """
+    mode = profile.get("engine_mode", ENGINE_AI)
+    if mode == ENGINE_HYBRID:
+        # Selezione, serie, ripetizioni e recuperi locali: l'AI riceve solo poche decine di righe
+        plan_ir = build_plan(profile, index)
+
+        def parse_notes(result_text):
+            if not result_text:
+                return None, None
+            notes_plan = dict(merge_notes(plan_ir, result_text), source="hybrid")
+            return plan_to_markdown(notes_plan), notes_plan
+
+        return build_hybrid_prompt(profile, plan_ir), _json_config(NOTES_RESPONSE_SCHEMA), parse_notes
+
+    structured = profile.get("structured_output", True)
+    draft = build_plan(profile, index) if mode == ENGINE_DRAFT else None
+
+    def parse_plan(result_text):
+        if not result_text or not structured:
+            return result_text, None
+        # Espandi gli id in nomi e ricostruisci il Markdown localmente
+        plan_ir = expand_plan(plan_from_json(result_text), index.names_by_id)
+        if not plan_ir["days"]:
+            # Nessun id valido: è un errore (ripiego sul motore locale), non una risposta vuota
+            raise ValueError("Nessun esercizio valido nella risposta")
+        # Il modello sbaglia spesso la durata: la scheda si adatta localmente, senza altre chiamate
+        plan_ir = fit_plan(plan_ir, profile, index, draft)
+        return plan_to_markdown(plan_ir), plan_ir
+
+    config = _json_config(PLAN_RESPONSE_SCHEMA) if structured else None
+    return build_prompt(profile, df, structured, draft), config, parse_plan
+
+
+def generate_plan(client, model: str, profile: dict, df, index: CatalogIndex) -> tuple:
+    """Genera la scheda secondo `profile["engine_mode"]`.
+
+    Restituisce (plan_md, plan_ir); plan_md è None se la risposta dell'AI è vuota.
+    plan_ir è None solo per l'output Markdown libero. Gli errori dell'API vengono propagati, e una
+    risposta JSON malformata o senza esercizi validi solleva ValueError.
+    """
+    if profile.get("engine_mode", ENGINE_AI) == ENGINE_LOCAL:
+        plan_ir = build_plan(profile, index)
+        return plan_to_markdown(plan_ir), plan_ir
+
+    contents, config, parse = prepare_request(profile, df, index)
+    response = generate_content(client, model, contents, config)
+    return parse(extract_response_text(response))
@@ -0,0 +1,425 @@
+"""Esportazione della scheda come routine Hevy (API pubblica v1, richiede Hevy Pro).
+
+Gli esercizi del catalogo sono associati ai template di esercizio di Hevy con un
+indice precalcolato (parole del nome, attrezzo, muscolo), salvato in SQLite per
+versione del catalogo e dei template: si ricalcola solo quando uno dei due cambia.
+Ogni `Giorno` diventa una routine; i caricamenti usano una sessione HTTP con pool
+di connessioni, concorrenza limitata, una chiave di idempotenza per routine e retry
+sui 429 (rispettando Retry-After). Una routine già caricata con lo stesso contenuto
+non viene ricreata.
+
+Uso:
+    python hevy_export.py scheda.json --api-key <chiave>
+    python hevy_export.py --stub            # scheda locale di 6 giorni su hevy_stub.py
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from catalog import CatalogIndex
+from session_time import parse_seconds, timed_range
+from storage import connect, db_path
+
+API_URL = os.environ.get("HEVY_API_URL", "https://api.hevyapp.com")
+TIMEOUT = 15
+MAX_CONCURRENCY = 4
+MAX_RETRIES = 4
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRY_DELAY = 30
+TEMPLATES_PAGE_SIZE = 100
+# I template predefiniti cambiano di rado: si riscaricano una volta al giorno
+TEMPLATES_TTL = 24 * 3600
+# Punteggio minimo perché un esercizio sia associato a un template
+MIN_SCORE = 0.6
+
+# Attrezzi e muscoli del catalogo -> categorie di Hevy
+EQUIPMENT_MAP = {
+    "Barbell": "barbell", "E-Z Curl Bar": "barbell", "Dumbbell": "dumbbell", "Kettlebells": "kettlebell",
+    "Machine": "machine", "Cable": "machine", "Bands": "resistance_band", "Bodyweight": "none",
+}
+MUSCLE_MAP = {"Middle Back": "upper_back"}
+STOPWORDS = {"with", "the", "on", "to", "a", "and", "of", "s"}
+# Tipi di template con le ripetizioni (gli altri sono a tempo o distanza)
+REPS_TYPES = {"weight_reps", "reps_only", "bodyweight_reps", "bodyweight_assisted_reps", "weighted_bodyweight"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hevy_templates (
+    account TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    templates TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hevy_mappings (
+    catalog_version TEXT NOT NULL,
+    templates_version TEXT NOT NULL,
+    mapping TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (catalog_version, templates_version)
+);
+CREATE TABLE IF NOT EXISTS hevy_uploads (
+    idempotency_key TEXT PRIMARY KEY,
+    account TEXT NOT NULL,
+    routine_id TEXT,
+    title TEXT,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class HevyError(RuntimeError):
+    """Risposta di errore dell'API Hevy."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Hevy {status}: {message}")
+        self.status = status
+
+
+def _digest(payload) -> str:
+    data = payload if isinstance(payload, str) else json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=12).hexdigest()
+
+
+def _tokens(text: str) -> frozenset:
+    words = re.findall(r"[a-z0-9]+", str(text).lower())
+    # Plurali ridotti al singolare ("curls" = "curl"), come nei titoli di Hevy
+    return frozenset(w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w
+                     for w in words if w not in STOPWORDS)
+
+
+def _retry_delay(response: Optional[requests.Response], attempt: int) -> float:
+    header = response.headers.get("Retry-After") if response is not None else None
+    if header:
+        try:
+            return min(MAX_RETRY_DELAY, max(0.0, float(header)))
+        except ValueError:
+            pass
+    return min(MAX_RETRY_DELAY, 0.5 * 2 ** attempt)
+
+
+class HevyClient:
+    """Sessione HTTP verso l'API Hevy con pool di connessioni e retry."""
+
+    def __init__(self, api_key: str, base_url: str = API_URL, concurrency: int = MAX_CONCURRENCY,
+                 timeout: float = TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        # Identifica l'account senza salvarne la chiave
+        self.account = _digest(f"{self.base_url}|{api_key}")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"api-key": api_key, "Accept": "application/json"})
+
+    def request(self, method: str, path: str, retries: int = MAX_RETRIES, **kwargs) -> dict:
+        for attempt in range(retries + 1):
+            try:
+                response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                # Le POST sono protette dalla chiave di idempotenza: si può ripetere
+                if attempt == retries:
+                    raise
+                time.sleep(_retry_delay(None, attempt))
+                continue
+            if response.status_code in RETRY_STATUSES and attempt < retries:
+                time.sleep(_retry_delay(response, attempt))
+                continue
+            if response.status_code >= 400:
+                raise HevyError(response.status_code, response.text[:200])
+            return response.json() if response.content else {}
+
+    def exercise_templates(self) -> list:
+        """Tutti i template di esercizio dell'account (predefiniti e personalizzati)."""
+        def page(number: int) -> dict:
+            return self.request("GET", "/v1/exercise_templates",
+                                params={"page": number, "pageSize": TEMPLATES_PAGE_SIZE})
+
+        first = page(1)
+        templates = list(first.get("exercise_templates", []))
+        pages = range(2, int(first.get("page_count", 1)) + 1)
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            for result in pool.map(page, pages):
+                templates += result.get("exercise_templates", [])
+        return templates
+
+    def create_routine(self, routine: dict, idempotency_key: str) -> dict:
+        result = self.request("POST", "/v1/routines", json={"routine": routine},
+                              headers={"Idempotency-Key": idempotency_key})
+        created = result.get("routine")
+        # L'API restituisce la routine creata dentro una lista
+        return (created[0] if isinstance(created, list) else created) or {}
+
+    def close(self):
+        self.session.close()
+
+
+class TemplateMatcher:
+    """Indice inverso parola -> template per associare gli esercizi del catalogo."""
+
+    def __init__(self, templates: list):
+        self.templates = templates
+        self.tokens = [_tokens(t.get("title", "")) for t in templates]
+        self.by_token = defaultdict(list)
+        for pos, tokens in enumerate(self.tokens):
+            for token in tokens:
+                self.by_token[token].append(pos)
+
+    def match(self, record: dict) -> Optional[tuple]:
+        """(template, punteggio) più simile all'esercizio, o None sotto MIN_SCORE."""
+        tokens = _tokens(record["name"])
+        equipment = EQUIPMENT_MAP.get(record.get("equipment"), "other")
+        muscle = MUSCLE_MAP.get(record.get("muscle_group"), str(record.get("muscle_group", "")).lower().replace(" ", "_"))
+        candidates = {pos for token in tokens for pos in self.by_token.get(token, ())}
+        best, best_score = None, MIN_SCORE
+        for pos in candidates:
+            shared = len(tokens & self.tokens[pos])
+            score = 2 * shared / (len(tokens) + len(self.tokens[pos]))
+            template = self.templates[pos]
+            if template.get("equipment") == equipment:
+                score += 0.15
+            elif template.get("equipment") and equipment != "other":
+                score -= 0.2
+            if template.get("primary_muscle_group") == muscle:
+                score += 0.1
+            if score >= best_score:
+                best, best_score = template, score
+        return (best, round(best_score, 3)) if best else None
+
+
+def build_mapping(index: CatalogIndex, templates: list) -> dict:
+    """id del catalogo -> {template_id, title, type, score} per gli esercizi associabili."""
+    matcher = TemplateMatcher(templates)
+    mapping = {}
+    for record in index.records:
+        found = matcher.match(record)
+        if found:
+            template, score = found
+            mapping[record["id"]] = {
+                "template_id": template["id"], "title": template.get("title"),
+                "type": template.get("type", "weight_reps"), "score": score,
+            }
+    return mapping
+
+
+def _reps_range(text) -> Optional[tuple]:
+    numbers = [int(n) for n in re.findall(r"\d+", str(text))]
+    return (numbers[0], numbers[-1]) if numbers else None
+
+
+def routine_sets(row: dict, template_type: str) -> list:
+    """Serie della routine dalla riga della scheda (ripetizioni o durata).
+
+    Le durate sono in secondi interi, all'estremo superiore: '30-45s' -> 45,
+    '1 min' e '1:00' -> 60, '1m30s' -> 90.
+    """
+    warmup = str(row.get("rest", "")).strip() in ("-", "")
+    reps = _reps_range(row.get("reps"))
+    # Durata: estremo superiore dell'intervallo ('30-45s' -> 45, '1 min' e '1:00' -> 60)
+    timed = timed_range(row.get("reps"))
+    entry = {"type": "warmup" if warmup else "normal", "weight_kg": None}
+    if timed or template_type not in REPS_TYPES:
+        # Template a tempo con ripetizioni nella scheda: durata lasciata all'utente
+        entry.update(reps=None, duration_seconds=round(timed[1]) if timed else None)
+    elif reps and reps[0] != reps[1]:
+        entry.update(reps=None, rep_range={"start": reps[0], "end": reps[1]})
+    else:
+        entry.update(reps=reps[0] if reps else None)
+    return [dict(entry) for _ in range(max(1, int(row.get("sets") or 1)))]
+
+
+def routine_payload(day: dict, mapping: dict, folder_id: Optional[int] = None) -> tuple:
+    """(routine per l'API, nomi degli esercizi senza template) per un giorno della scheda."""
+    exercises, skipped = [], []
+    for row in day["rows"]:
+        match = mapping.get(row.get("id"))
+        if match is None:
+            skipped.append(row.get("name") or row.get("id"))
+            continue
+        rest = parse_seconds(row.get("rest"))
+        exercises.append({
+            "exercise_template_id": match["template_id"],
+            "superset_id": None,
+            "rest_seconds": None if rest is None else round(rest),
+            "notes": row.get("note") or None,
+            "sets": routine_sets(row, match["type"]),
+        })
+    notes = "Creata da Hevy AI Architect."
+    if skipped:
+        notes += " Non trovati in Hevy: " + ", ".join(skipped)
+    routine = {"title": day["title"], "folder_id": folder_id, "notes": notes, "exercises": exercises}
+    return routine, skipped
+
+
+class ExportStore:
+    """Template scaricati, associazioni precalcolate e routine già caricate (SQLite)."""
+
+    _mappings = {}
+    _lock = threading.Lock()
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or db_path("hevy_export.db")
+        connect(self.path).executescript(SCHEMA)
+
+    def templates(self, client: HevyClient, max_age: float = TEMPLATES_TTL) -> tuple:
+        """(template, versione) dell'account, riscaricati se più vecchi di `max_age`."""
+        conn = connect(self.path)
+        row = conn.execute(
+            "SELECT version, templates, fetched_at FROM hevy_templates WHERE account = ?", (client.account,)
+        ).fetchone()
+        if row and time.time() - row["fetched_at"] < max_age:
+            return json.loads(row["templates"]), row["version"]
+        templates = client.exercise_templates()
+        version = _digest(sorted(
+            [t.get("id"), t.get("title"), t.get("type"), t.get("equipment"), t.get("primary_muscle_group")]
+            for t in templates
+        ))
+        conn.execute(
+            "INSERT OR REPLACE INTO hevy_templates (account, version, templates, fetched_at) VALUES (?, ?, ?, ?)",
+            (client.account, version, json.dumps(templates, ensure_ascii=False), time.time()),
+        )
+        return templates, version
+
+    def mapping(self, index: CatalogIndex, catalog_version: str, templates: list, templates_version: str) -> dict:
+        """Associazione catalogo -> template, calcolata una volta per coppia di versioni."""
+        key = (catalog_version, templates_version)
+        with self._lock:
+            cached = self._mappings.get(key)
+            if cached is not None:
+                return cached
+            conn = connect(self.path)
+            row = conn.execute(
+                "SELECT mapping FROM hevy_mappings WHERE catalog_version = ? AND templates_version = ?", key
+            ).fetchone()
+            if row:
+                mapping = json.loads(row["mapping"])
+            else:
+                mapping = build_mapping(index, templates)
+                conn.execute(
+                    "INSERT OR REPLACE INTO hevy_mappings (catalog_version, templates_version, mapping, created_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (catalog_version, templates_version, json.dumps(mapping), time.time()),
+                )
+            self._mappings[key] = mapping
+            return mapping
+
+    def uploaded(self, key: str) -> Optional[str]:
+        row = connect(self.path).execute(
+            "SELECT routine_id FROM hevy_uploads WHERE idempotency_key = ?", (key,)
+        ).fetchone()
+        return row["routine_id"] if row else None
+
+    def record_upload(self, key: str, account: str, routine_id: Optional[str], title: str):
+        connect(self.path).execute(
+            "INSERT OR REPLACE INTO hevy_uploads (idempotency_key, account, routine_id, title, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, account, routine_id, title, time.time()),
+        )
+
+
+def export_plan(plan: dict, index: CatalogIndex, catalog_version: str, client: HevyClient,
+                store: Optional[ExportStore] = None, progress: Optional[Callable] = None) -> dict:
+    """Crea una routine per giorno della scheda; restituisce l'esito per routine e il tempo.
+
+    `progress(completate, totale)` viene chiamata dopo ogni routine.
+    """
+    started = time.perf_counter()
+    store = store or ExportStore()
+    templates, templates_version = store.templates(client)
+    mapping = store.mapping(index, catalog_version, templates, templates_version)
+    routines = [routine_payload(day, mapping) for day in plan["days"]]
+
+    def upload(item: tuple) -> dict:
+        routine, skipped = item
+        key = _digest([client.account, routine])
+        result = {"title": routine["title"], "exercises": len(routine["exercises"]), "skipped": skipped}
+        try:
+            existing = store.uploaded(key)
+            if existing is not None:
+                result.update(status="existing", routine_id=existing)
+            elif not routine["exercises"]:
+                result.update(status="empty")
+            else:
+                created = client.create_routine(routine, key)
+                store.record_upload(key, client.account, created.get("id"), routine["title"])
+                result.update(status="created", routine_id=created.get("id"))
+        except (HevyError, requests.RequestException) as e:
+            result.update(status="error", error=str(e))
+        return result
+
+    # Il progresso è notificato dal thread chiamante (in Streamlit i worker non hanno contesto)
+    with ThreadPoolExecutor(client.concurrency) as pool:
+        futures = [pool.submit(upload, item) for item in routines]
+        for done, _ in enumerate(as_completed(futures), 1):
+            if progress:
+                progress(done, len(futures))
+    results = [f.result() for f in futures]
+    return {
+        "routines": results,
+        "mapped": sum(r["exercises"] for r in results),
+        "skipped": sorted({name for r in results for name in r["skipped"]}),
+        "errors": sum(1 for r in results if r["status"] == "error"),
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def main():
+    import pandas as pd
+
+    from catalog import CatalogMetadata
+    from plan_engine import build_plan
+    from prefs_store import default_preferences
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("plan", nargs="?", help="scheda in JSON (IR); senza file una scheda locale di 6 giorni")
+    parser.add_argument("--api-key", default=os.environ.get("HEVY_API_KEY"))
+    parser.add_argument("--base-url", default=API_URL)
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument("--stub", action="store_true", help="avvia hevy_stub.py in locale e carica lì")
+    parser.add_argument("--latency", type=float, default=0.15, help="latenza simulata dello stub (secondi)")
+    args = parser.parse_args()
+
+    df = pd.read_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), "exercises_db.csv"))
+    index = CatalogIndex.from_dataframe(df)
+    if args.plan:
+        with open(args.plan, encoding="utf-8") as f:
+            plan = json.load(f)
+    else:
+        plan = build_plan(dict(default_preferences(), days=6, split_type="Spinta/Tirata/Gambe"), index)
+
+    server = None
+    if args.stub:
+        from hevy_stub import HevyStub, stub_templates
+        server = HevyStub(stub_templates(index), latency=args.latency, rate_limit_every=5)
+        args.base_url, args.api_key = server.start(), server.api_key
+    if not args.api_key:
+        sys.exit("Serve una API key Hevy (--api-key o HEVY_API_KEY)")
+
+    client = HevyClient(args.api_key, args.base_url, args.concurrency)
+    summary = export_plan(plan, index, CatalogMetadata(index).catalog_hash, client,
+                          progress=lambda done, total: print(f"  {done}/{total} routine"))
+    for r in summary["routines"]:
+        print(f"{r['status']:<8} {r['title']} ({r['exercises']} esercizi) {r.get('error', '')}")
+    if summary["skipped"]:
+        print("Senza template Hevy: " + ", ".join(summary["skipped"]))
+    print(f"Completato in {summary['seconds']}s")
+    client.close()
+    if server:
+        server.stop()
+    if summary["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
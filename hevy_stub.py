@@ -0,0 +1,199 @@
+"""Server locale che imita l'API Hevy v1, per provare l'esportazione senza account Pro.
+
+Espone `GET /v1/exercise_templates` (paginato) e `POST /v1/routines` con la stessa
+forma delle risposte reali, controlla l'header `api-key` e rispetta l'header
+`Idempotency-Key` (la stessa chiave restituisce la stessa routine); le serie a
+tempo devono avere una durata intera positiva. Latenza e 429
+periodici (con Retry-After) sono configurabili per verificare pool e retry:
+
+    python hevy_stub.py --port 8765
+    HEVY_API_URL=http://127.0.0.1:8765 HEVY_API_KEY=stub streamlit run app.py
+"""
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from catalog import CatalogIndex
+
+# Attrezzo del catalogo -> (etichetta nel titolo, categoria Hevy, tipo di template)
+STUB_EQUIPMENT = {
+    "Barbell": ("Barbell", "barbell", "weight_reps"),
+    "E-Z Curl Bar": ("EZ Bar", "barbell", "weight_reps"),
+    "Dumbbell": ("Dumbbell", "dumbbell", "weight_reps"),
+    "Kettlebells": ("Kettlebell", "kettlebell", "weight_reps"),
+    "Machine": ("Machine", "machine", "weight_reps"),
+    "Cable": ("Cable", "machine", "weight_reps"),
+    "Bands": ("Band", "resistance_band", "reps_only"),
+    "Bodyweight": ("", "none", "bodyweight_reps"),
+}
+
+
+def stub_templates(index: CatalogIndex) -> list:
+    """Template in stile Hevy ("Bench Press (Barbell)") ricavati dal catalogo."""
+    templates = []
+    for pos, rec in enumerate(index.records):
+        label, equipment, kind = STUB_EQUIPMENT.get(rec["equipment"], ("", "other", "reps_only"))
+        name = " ".join(w for w in str(rec["name"]).split() if w.lower() != str(rec["equipment"]).lower())
+        templates.append({
+            "id": f"{pos:08X}",
+            "title": f"{name} ({label})" if label else name,
+            "type": "duration" if rec["role"] == "warmup" else kind,
+            "primary_muscle_group": str(rec["muscle_group"]).lower().replace(" ", "_"),
+            "secondary_muscle_groups": [],
+            "equipment": equipment,
+            "is_custom": False,
+        })
+    return templates
+
+
+class HevyStub:
+    """Server HTTP in un thread daemon; `routines` contiene le routine create.
+
+    `latency` sono i secondi di attesa per richiesta, `rate_limit_every` risponde 429
+    a una richiesta ogni N.
+    """
+
+    def __init__(self, templates: list, api_key: str = "stub", latency: float = 0.0, rate_limit_every: int = 0):
+        self.templates = templates
+        self.api_key = api_key
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.routines = []
+        self.requests = 0
+        self.rate_limited = 0
+        self._by_key = {}
+        self._calls = itertools.count(1)
+        self._lock = threading.Lock()
+        self.server = None
+
+    def start(self, port: int = 0, host: str = "127.0.0.1") -> str:
+        """Avvia il server e restituisce l'URL base."""
+        stub = self
+
+        class Handler(_Handler):
+            pass
+
+        Handler.stub = stub
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name="hevy-stub", daemon=True).start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def admit(self) -> bool:
+        """Conta la richiesta; False se va respinta con un 429 simulato."""
+        with self._lock:
+            self.requests += 1
+            call = next(self._calls)
+            limited = bool(self.rate_limit_every) and call % self.rate_limit_every == 0
+            self.rate_limited += limited
+        if self.latency:
+            time.sleep(self.latency)
+        return not limited
+
+    def create_routine(self, routine: dict, key: str) -> dict:
+        with self._lock:
+            if key and key in self._by_key:
+                return self._by_key[key]
+            created = dict(routine, id=str(uuid.uuid4()), created_at=time.strftime("%Y-%m-%dT%H:%M:%SZ"))
+            self.routines.append(created)
+            if key:
+                self._by_key[key] = created
+            return created
+
+
+class _Handler(BaseHTTPRequestHandler):
+    stub: HevyStub = None
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _check(self) -> bool:
+        if self.headers.get("api-key") != self.stub.api_key:
+            self._send(401, {"error": "Invalid api-key"})
+            return False
+        if not self.stub.admit():
+            self._send(429, {"error": "Too many requests"}, {"Retry-After": "0"})
+            return False
+        return True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/v1/exercise_templates":
+            self._send(404, {"error": "Not found"})
+            return
+        if not self._check():
+            return
+        query = parse_qs(url.query)
+        page = int(query.get("page", ["1"])[0])
+        size = min(100, int(query.get("pageSize", ["5"])[0]))
+        templates = self.stub.templates
+        self._send(200, {
+            "page": page,
+            "page_count": max(1, -(-len(templates) // size)),
+            "exercise_templates": templates[(page - 1) * size:page * size],
+        })
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.path != "/v1/routines":
+            self._send(404, {"error": "Not found"})
+            return
+        if not self._check():
+            return
+        routine = payload.get("routine") or {}
+        if not routine.get("title") or not routine.get("exercises"):
+            self._send(400, {"error": "title and exercises are required"})
+            return
+        durations = [s.get("duration_seconds") for e in routine["exercises"] for s in e.get("sets", [])]
+        if any(d is not None and (not isinstance(d, int) or d < 1) for d in durations):
+            # Come l'API reale: una durata di 0 s (es. "1:00" letto come numero) è rifiutata
+            self._send(400, {"error": "duration_seconds must be a positive integer"})
+            return
+        created = self.stub.create_routine(routine, self.headers.get("Idempotency-Key", ""))
+        self._send(201, {"routine": [created]})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--api-key", default="stub")
+    parser.add_argument("--latency", type=float, default=0.15)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    args = parser.parse_args()
+
+    df = pd.read_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), "exercises_db.csv"))
+    stub = HevyStub(stub_templates(CatalogIndex.from_dataframe(df)), args.api_key, args.latency,
+                    args.rate_limit_every)
+    print(f"Stub Hevy su {stub.start(args.port)} (api-key: {args.api_key})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,14 @@
+import argparse
 import requests
 import pandas as pd
 import json
 
+from exercise_images import DOWNLOAD_CONCURRENCY, VARIANTS, mirror_images, thumbnail_path
+
 # URL del database Open Source
 DB_URL = "https://raw.githubusercontent.com/yuhonas/free-exercise-db/main/dist/exercises.json"
 
-def download_and_convert():
+def download_and_convert(images=True, concurrency=DOWNLOAD_CONCURRENCY, verify=False):
     print("⏳ Scaricamento del database esercizi da GitHub...")
     
     try:
@@ -17,6 +20,7 @@ def download_and_convert():
         print("🧹 Inizio pulizia dati...")
         
         clean_exercises = []
+        exercise_images = {}
         
         for item in data:
             # 1. Gestione sicura dei MUSCOLI (se manca, mettiamo 'Full Body')
@@ -49,6 +53,7 @@ def download_and_convert():
                 exercise["equipment"] = "Bodyweight"
             
             clean_exercises.append(exercise)
+            exercise_images[exercise["id"]] = item.get("images") or []
             
         # Creazione DataFrame
         df = pd.DataFrame(clean_exercises)
@@ -59,10 +64,38 @@ def download_and_convert():
         
         print(f"\n🎉 SUCCESSO! Database creato: {output_file}")
         print(f"📊 Totale esercizi pronti: {len(df)}")
+
+        if images:
+            mirror_exercise_images(exercise_images, concurrency, verify)
         print("➡️  Ora puoi lanciare: streamlit run app.py")
         
     except Exception as e:
         print(f"❌ Errore critico: {e}")
 
+def mirror_exercise_images(exercise_images, concurrency, verify):
+    """Mirror delle immagini (ripreso dai file mancanti) e miniature di tutte le varianti."""
+    print(f"🖼️  Mirror delle immagini ({sum(len(v) for v in exercise_images.values())} file)...")
+
+    def progress(done, total):
+        if done % 100 == 0 or done == total:
+            print(f"   {done}/{total}")
+
+    summary = mirror_images(exercise_images, concurrency=concurrency, verify=verify, progress=progress)
+    print(f"✅ Scaricate {summary['downloaded']} immagini ({summary['bytes'] / 1e6:.1f} MB), "
+          f"{summary['skipped']} già presenti.")
+    for failure in summary["failed"][:10]:
+        print(f"⚠️  {failure}")
+    if summary["failed"]:
+        print(f"⚠️  {len(summary['failed'])} download non riusciti: rilancia per riprenderli.")
+    thumbnails = sum(
+        1 for exercise_id in exercise_images for variant in VARIANTS if thumbnail_path(exercise_id, variant)
+    )
+    print(f"✅ Miniature pronte: {thumbnails}")
+
 if __name__ == "__main__":
-    download_and_convert()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Scarica il database esercizi e le immagini")
+    parser.add_argument("--no-images", action="store_true", help="solo il CSV, senza immagini")
+    parser.add_argument("--concurrency", type=int, default=DOWNLOAD_CONCURRENCY)
+    parser.add_argument("--verify", action="store_true", help="ricontrolla lo SHA-256 dei file già scaricati")
+    args = parser.parse_args()
+    download_and_convert(not args.no_images, args.concurrency, args.verify)
\ No newline at end of file
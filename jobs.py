@@ -0,0 +1,151 @@
+"""Generazioni in background che sopravvivono a rerun e riconnessioni.
+
+La chiamata al modello gira in un thread pool del processo; stato e risultato
+sono salvati in SQLite, così una sessione che si riconnette (stesso token e
+`?job=<id>` nell'URL) ritrova il risultato invece di perderlo.
+
+Ogni processo aggiorna periodicamente `heartbeat_at` dei propri job aperti: solo i
+job senza heartbeat recente (processo terminato) vengono chiusi come interrotti,
+quindi più processi sullo stesso DATA_DIR, o un JobManager ricreato, non
+toccano i job ancora vivi.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import metrics
+from storage import connect, db_path
+
+MAX_WORKERS = int(os.environ.get("HEVY_JOB_WORKERS", "4"))
+# Ogni quanti secondi un processo conferma di avere ancora in carico i suoi job,
+# e dopo quanti secondi senza conferma un job aperto si considera perso
+HEARTBEAT_INTERVAL = 15
+STALE_AFTER = 4 * HEARTBEAT_INTERVAL
+# Identifica il processo proprietario dei job (uno per processo, non per JobManager)
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    profile TEXT NOT NULL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_token_created ON jobs (token, created_at DESC);
+"""
+# Colonne aggiunte dopo la prima versione della tabella
+COLUMNS = {"owner": "TEXT", "heartbeat_at": "REAL"}
+
+PENDING, RUNNING, DONE, ERROR = "pending", "running", "done", "error"
+
+
+class JobManager:
+    """Esegue le generazioni in un ThreadPoolExecutor e ne persiste lo stato."""
+
+    def __init__(self, path: Optional[str] = None, max_workers: int = MAX_WORKERS):
+        self.path = path or db_path("jobs.db")
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hevy-job")
+        self._active = 0
+        self._lock = threading.Lock()
+        metrics.track_job_manager(self)
+        conn = connect(self.path)
+        conn.executescript(SCHEMA)
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self.reap_stale()
+        threading.Thread(target=self._heartbeat, name="hevy-job-heartbeat", daemon=True).start()
+
+    def reap_stale(self) -> int:
+        """Chiude come interrotti i job aperti il cui processo non dà più segni di vita."""
+        now = time.time()
+        return connect(self.path).execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+            "WHERE status IN (?, ?) AND COALESCE(heartbeat_at, created_at) < ?",
+            (ERROR, "Generazione interrotta dal riavvio del server", now, PENDING, RUNNING, now - STALE_AFTER),
+        ).rowcount
+
+    def _heartbeat(self):
+        # I thread daemon terminano con il processo: da lì in poi i suoi job diventano stantii.
+        # Qui, e non in get(), si chiudono anche i job degli altri processi fermi
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                connect(self.path).execute(
+                    "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN (?, ?)",
+                    (time.time(), OWNER, PENDING, RUNNING),
+                )
+                self.reap_stale()
+            except Exception:
+                log.exception("Heartbeat dei job non riuscito")
+
+    @property
+    def queue_depth(self) -> int:
+        """Job inviati e non ancora terminati (in coda o in esecuzione)."""
+        return self._active
+
+    def submit(self, token: str, profile: dict, fn: Callable[[], dict],
+               on_success: Optional[Callable[[dict], None]] = None) -> str:
+        """Accoda `fn` (che restituisce un dict serializzabile) e restituisce l'id del job."""
+        job_id = uuid.uuid4().hex[:16]
+        connect(self.path).execute(
+            "INSERT INTO jobs (id, token, status, created_at, profile, owner, heartbeat_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, token, PENDING, time.time(), json.dumps(profile, ensure_ascii=False), OWNER, time.time()),
+        )
+        with self._lock:
+            self._active += 1
+        self.executor.submit(self._run, job_id, fn, on_success)
+        return job_id
+
+    def _run(self, job_id: str, fn: Callable[[], dict], on_success):
+        conn = connect(self.path)
+        conn.execute("UPDATE jobs SET status = ?, started_at = ? WHERE id = ?", (RUNNING, time.time(), job_id))
+        try:
+            result = fn()
+        except Exception as e:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (ERROR, str(e) or type(e).__name__, time.time(), job_id),
+            )
+        else:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished_at = ? WHERE id = ?",
+                (DONE, json.dumps(result, ensure_ascii=False), time.time(), job_id),
+            )
+            if on_success:
+                try:
+                    on_success(result)
+                except Exception:
+                    # Il risultato è già salvato: l'errore (es. storico) non deve far fallire il job
+                    log.exception("Callback del job %s non riuscita", job_id)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def get(self, job_id: str, token: str) -> Optional[dict]:
+        """Stato del job, solo se appartiene al token indicato."""
+        row = connect(self.path).execute(
+            "SELECT * FROM jobs WHERE id = ? AND token = ?", (job_id, token)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(
+            row,
+            profile=json.loads(row["profile"]),
+            result=json.loads(row["result"]) if row["result"] else None,
+        )
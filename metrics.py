@@ -0,0 +1,262 @@
+"""Metriche Prometheus (formato testo) per generazione, cache e PDF, senza dipendenze.
+
+Contatori e istogrammi si aggiornano con un lock e una ricerca binaria sui bucket;
+i valori istantanei (code, sessioni, catalogo) sono funzioni valutate solo al
+momento dello scrape. `start_server(port)` espone /metrics (e le route aggiunte con
+`add_route`, es. /ready) in un thread a parte, una sola volta per processo:
+
+    HEVY_METRICS_PORT=9464 streamlit run app.py
+    curl -s localhost:9464/metrics
+"""
+import bisect
+import os
+import threading
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+METRICS_PORT = int(os.environ.get("HEVY_METRICS_PORT", "0") or 0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+PDF_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+PDF_BYTES_BUCKETS = (8 * 1024, 16 * 1024, 32 * 1024, 64 * 1024, 128 * 1024, 256 * 1024, 512 * 1024, 1024 * 1024)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self._lock = threading.Lock()
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self) -> list:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value: float, *labels):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # conteggi per bucket (non cumulativi, l'ultimo è +Inf), somma
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][slot] += 1
+            series[1] += value
+
+    def collect(self) -> list:
+        with self._lock:
+            snapshot = {k: (list(counts), total) for k, (counts, total) in self._series.items()}
+        lines = []
+        for key, (counts, total) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Valore letto al momento dello scrape da `fn` (numero o dict etichette -> numero)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), fn: Optional[Callable] = None):
+        super().__init__(name, help_text, labels)
+        self.fn = fn
+
+    def collect(self) -> list:
+        try:
+            value = self.fn() if self.fn else None
+        except Exception:
+            return []
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in sorted(value.items())]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            samples = metric.collect()
+            if samples:
+                lines += metric.header() + samples
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+GENERATE_SECONDS = REGISTRY.register(Histogram(
+    "hevy_generate_content_seconds", "Durata delle chiamate generate_content.", ("model", "outcome"),
+))
+GENERATE_TOKENS = REGISTRY.register(Counter(
+    "hevy_generate_content_tokens_total", "Token di prompt e risposta consumati.", ("model", "kind"),
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "hevy_plan_cache_lookups_total", "Ricerche nella cache delle schede per esito.", ("result",),
+))
+PDF_SECONDS = REGISTRY.register(Histogram(
+    "hevy_pdf_build_seconds", "Tempo di costruzione dei PDF.", buckets=PDF_SECONDS_BUCKETS,
+))
+PDF_BYTES = REGISTRY.register(Histogram(
+    "hevy_pdf_bytes", "Dimensione dei PDF generati.", buckets=PDF_BYTES_BUCKETS,
+))
+
+# Sorgenti dei valori istantanei, registrate da chi le possiede
+_limiters = weakref.WeakSet()
+_job_managers = weakref.WeakSet()
+_catalog = {}
+
+
+def track_limiter(limiter):
+    _limiters.add(limiter)
+
+
+def track_job_manager(manager):
+    _job_managers.add(manager)
+
+
+def set_catalog(version: str, exercises: int):
+    _catalog.clear()
+    _catalog.update(version=version, exercises=exercises)
+
+
+def _active_sessions() -> Optional[int]:
+    from streamlit import runtime
+
+    if not runtime.exists():
+        return None
+    manager = getattr(runtime.get_instance(), "_session_mgr", None)
+    return manager.num_active_sessions() if manager else None
+
+
+REGISTRY.register(Gauge(
+    "hevy_limiter_queue_depth", "Richieste in attesa di un turno.", ("queue",),
+    fn=lambda: {
+        ("rate_limiter",): sum(limiter.waiting for limiter in list(_limiters)),
+        ("jobs",): sum(manager.queue_depth for manager in list(_job_managers)),
+    },
+))
+REGISTRY.register(Gauge("hevy_active_sessions", "Sessioni Streamlit attive.", fn=_active_sessions))
+REGISTRY.register(Gauge(
+    "hevy_catalog_info", "Versione del catalogo esercizi caricato (valore: numero di esercizi).", ("version",),
+    fn=lambda: {(_catalog["version"],): _catalog["exercises"]} if _catalog else None,
+))
+
+
+def record_generation(model: str, outcome: str, seconds: float, response=None):
+    """Registra una chiamata generate_content (token da `usage_metadata`, se presenti)."""
+    GENERATE_SECONDS.observe(seconds, model, outcome)
+    record_tokens(model, response)
+
+
+def record_tokens(model: str, response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        GENERATE_TOKENS.inc(model, "prompt", amount=getattr(usage, "prompt_token_count", None) or 0)
+        GENERATE_TOKENS.inc(model, "response", amount=getattr(usage, "candidates_token_count", None) or 0)
+
+
+def record_pdf(seconds: float, size: int):
+    PDF_SECONDS.observe(seconds)
+    PDF_BYTES.observe(size)
+
+
+# Percorso -> funzione senza argomenti che restituisce (status, content type, corpo)
+_routes = {}
+_server = None
+_server_lock = threading.Lock()
+
+
+def add_route(path: str, handler: Callable):
+    """Espone `path` sul server delle metriche accanto a /metrics."""
+    _routes[path] = handler
+
+
+def _metrics_route() -> tuple:
+    return 200, CONTENT_TYPE, REGISTRY.render().encode("utf-8")
+
+
+add_route("/metrics", _metrics_route)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        handler = _routes.get(self.path.split("?")[0])
+        if handler is None:
+            self.send_error(404)
+            return
+        status, content_type, body = handler()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port: int = METRICS_PORT, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Avvia il server in un thread daemon e lo restituisce; le chiamate successive riusano il primo."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _Handler)
+            threading.Thread(target=_server.serve_forever, name="hevy-metrics", daemon=True).start()
+        return _server
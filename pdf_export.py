@@ -0,0 +1,487 @@
+"""Esportazione della scheda in PDF (Markdown -> PDF) con layout delle tabelle misurato.
+
+Le larghezze del testo sono calcolate con le metriche del font di FPDF, con una
+cache per font; ogni cella viene spezzata in righe una sola volta e le stesse
+righe servono sia per l'altezza della riga sia per il disegno, così i salti
+pagina sono esatti.
+
+Il testo è scritto con il font Unicode incluso in fonts/ (DejaVu Sans), di cui
+viene incorporato solo il sottoinsieme di glifi usati; i caratteri senza glifo
+sono traslitterati in un solo passaggio con str.translate.
+
+Le figure degli esercizi (miniature JPEG già ridotte, senza doppioni) sono raccolte
+in una pagina finale a griglia, così non cambiano l'impaginazione delle tabelle.
+"""
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from itertools import accumulate
+from typing import Optional
+
+import metrics
+from storage import DATA_DIR
+
+try:
+    import fpdf
+    from fpdf import FPDF
+    from fpdf.ttfonts import TTFontFile
+except ImportError:  # gestito da build_pdf_from_markdown
+    fpdf = FPDF = TTFontFile = None
+
+# Font Unicode inclusi nel progetto (stile FPDF -> file)
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
+UNICODE_FAMILY = "DejaVu"
+UNICODE_FONTS = {"": "DejaVuSans.ttf", "B": "DejaVuSans-Bold.ttf"}
+# Metriche dei font serializzate da FPDF (fuori dalla cartella del progetto)
+FONT_CACHE_DIR = os.path.join(DATA_DIR, "font_cache")
+
+# Glifi sempre inclusi nel sottoinsieme: quasi tutte le schede condividono la stessa chiave di cache
+BASE_GLYPHS = frozenset(range(32, 127)) | frozenset(map(ord, "àèéìòùÀÈÉÌÒÙ–—‘’“”…•×°"))
+SUBSET_CACHE_SIZE = 16
+
+# Sostituzioni per i caratteri senza glifo nel font (emoji, simboli fuori da latin-1)
+TRANSLITERATIONS = {
+    '✅': '[OK]', '❌': '[X]', '⚠': '[!]', '→': '->', '←': '<-', '↔': '<->', '•': '-',
+    '–': '-', '—': '-', '“': '"', '”': '"', '‘': "'", '’': "'",
+    '…': '...', '°': 'deg', '×': 'x', '÷': '/', '≤': '<=',
+    '≥': '>=', '≠': '!=', '±': '+/-', '€': 'EUR', '£': 'GBP',
+    '¥': 'YEN', '©': '(c)', '®': '(R)', '™': '(TM)',
+}
+# Selettori di variante e joiner delle emoji: sempre rimossi
+IGNORED_CHARS = frozenset("\ufe0e\ufe0f\u200d")
+
+# Corpo e interlinea delle tabelle (mm)
+TABLE_FONT_SIZE = 6
+HEADER_FONT_SIZE = 7
+LINE_HEIGHT = 3
+CELL_PADDING = 1
+MIN_ROW_HEIGHT = 5
+
+# Griglia delle figure degli esercizi (mm)
+GALLERY_IMAGE_SIZE = 30
+GALLERY_GAP = 6
+GALLERY_CAPTION_LINES = 2
+
+# Larghezze delle stringhe e righe già spezzate per (famiglia, stile, corpo):
+# il vocabolario delle schede è ridotto e le settimane ripetono le stesse celle
+_WIDTH_CACHE = {}
+_WRAP_CACHE = {}
+_CACHE_MAX = 50000
+
+
+class GlyphTable(dict):
+    """Tabella per str.translate: un carattere resta se il font ha il glifo, altrimenti è traslitterato.
+
+    Le voci sono calcolate alla prima occorrenza di ogni carattere e poi riusate.
+    """
+
+    def __init__(self, has_glyph):
+        super().__init__()
+        self.has_glyph = has_glyph
+
+    def __missing__(self, code):
+        char = chr(code)
+        if char in IGNORED_CHARS:
+            value = ""
+        elif char in "\t\n" or self.has_glyph(code):
+            value = char
+        else:
+            value = TRANSLITERATIONS.get(char, "")
+        self[code] = value
+        return value
+
+
+# Font standard di FPDF (Arial): solo latin-1
+LATIN1_TABLE = GlyphTable(lambda code: 32 <= code < 256)
+_unicode_table = None
+_fonts_lock = threading.Lock()
+_subset_cache = OrderedDict()
+
+
+def sanitize_text(text, table: Optional[GlyphTable] = None):
+    """Sostituisce o rimuove, in un solo passaggio, i caratteri che il font non può disegnare."""
+    return text.translate(table if table is not None else LATIN1_TABLE)
+
+
+class GlyphSubset(list):
+    """Codici del sottoinsieme senza duplicati, con test di appartenenza O(1)."""
+
+    def __init__(self, codes):
+        super().__init__(sorted(set(codes)))
+        self._codes = frozenset(self)
+
+    def __contains__(self, code):
+        return code in self._codes
+
+
+if FPDF is not None:
+    class PlanPDF(FPDF):
+        """FPDF con i sottoinsiemi di glifi deduplicati prima di scrivere i font."""
+
+        def _putfonts(self):
+            # FPDF aggiunge un codice per ogni carattere scritto e poi cerca ogni
+            # codice del font nella lista: senza duplicati e con un set resta lineare
+            for font in self.fonts.values():
+                if font.get("type") == "TTF":
+                    font["subset"] = GlyphSubset(font["subset"])
+            super()._putfonts()
+
+    class CachedTTFontFile(TTFontFile):
+        """Sottoinsiemi TTF in cache, indicizzati per file e insieme di glifi."""
+
+        def makeSubset(self, file, subset):
+            glyphs = BASE_GLYPHS.union(subset)
+            key = (file, glyphs)
+            with _fonts_lock:
+                cached = _subset_cache.get(key)
+                if cached is not None:
+                    _subset_cache.move_to_end(key)
+            if cached is None:
+                stream = super().makeSubset(file, sorted(glyphs))
+                cached = (stream, self.codeToGlyph, self.maxUni)
+                with _fonts_lock:
+                    _subset_cache[key] = cached
+                    while len(_subset_cache) > SUBSET_CACHE_SIZE:
+                        _subset_cache.popitem(last=False)
+            stream, self.codeToGlyph, self.maxUni = cached
+            return stream
+
+    # FPDF istanzia TTFontFile al salvataggio: usa la versione con cache
+    fpdf.fpdf.TTFontFile = CachedTTFontFile
+
+
+def setup_fonts(pdf) -> tuple:
+    """Registra il font Unicode incluso; restituisce (famiglia, tabella dei glifi).
+
+    Se i file TTF mancano si ripiega su Arial con il solo latin-1.
+    """
+    global _unicode_table
+    paths = {style: os.path.join(FONT_DIR, name) for style, name in UNICODE_FONTS.items()}
+    if not all(os.path.exists(path) for path in paths.values()):
+        return "Arial", LATIN1_TABLE
+    try:
+        os.makedirs(FONT_CACHE_DIR, exist_ok=True)
+        fpdf.set_global("FPDF_CACHE_MODE", 2)
+        fpdf.set_global("FPDF_CACHE_DIR", FONT_CACHE_DIR)
+    except OSError:
+        # Cartella dati non scrivibile: metriche rilette dal TTF a ogni documento
+        fpdf.set_global("FPDF_CACHE_MODE", 1)
+    # FPDF scrive le metriche nella cache senza file temporaneo: chi le legge mentre un
+    # altro thread (es. il warm-up) le sta scrivendo trova un file vuoto
+    with _fonts_lock:
+        for style, path in paths.items():
+            try:
+                pdf.add_font(UNICODE_FAMILY, style, path, uni=True)
+            except (EOFError, pickle.UnpicklingError):
+                # File troncato da un altro processo: si rigenera dal TTF
+                os.remove(os.path.join(FONT_CACHE_DIR, fpdf.fpdf.hashpath(path) + ".pkl"))
+                pdf.add_font(UNICODE_FAMILY, style, path, uni=True)
+    if _unicode_table is None:
+        widths = pdf.fonts[UNICODE_FAMILY.lower()]["cw"]
+        _unicode_table = GlyphTable(lambda code: code < len(widths) and widths[code] > 0)
+    return UNICODE_FAMILY, _unicode_table
+
+
+def clean_markdown(text):
+    """Rimuove i marcatori markdown dal testo."""
+    return text.replace("**", "").replace("*", "").replace("__", "").replace("_", "")
+
+
+def is_bold_text(text):
+    """Controlla se il testo è in grassetto markdown."""
+    return text.strip().startswith("**") and text.strip().endswith("**")
+
+
+class TextMeasure:
+    """Larghezze e a capo del testo con le metriche del font corrente di FPDF."""
+
+    def __init__(self, pdf):
+        self.pdf = pdf
+
+    def _cache(self, store: dict) -> dict:
+        pdf = self.pdf
+        key = (pdf.font_family, pdf.font_style, pdf.font_size_pt)
+        cache = store.get(key)
+        if cache is None or len(cache) > _CACHE_MAX:
+            cache = store[key] = {}
+        return cache
+
+    def _widths(self) -> dict:
+        return self._cache(_WIDTH_CACHE)
+
+    def width(self, text: str, cache: Optional[dict] = None) -> float:
+        """Larghezza della stringa nel font corrente (mm)."""
+        cache = self._widths() if cache is None else cache
+        w = cache.get(text)
+        if w is None:
+            cw = self.pdf.current_font["cw"]
+            if isinstance(cw, dict):
+                units = sum(cw.get(c, 0) for c in text)
+            else:
+                missing = self.pdf.current_font["desc"].get("MissingWidth") or 500
+                units = sum(cw[o] if o < len(cw) else missing for o in map(ord, text))
+            w = cache[text] = units * self.pdf.font_size / 1000.0
+        return w
+
+    def wrap(self, text: str, max_width: float) -> list:
+        """Spezza il testo in righe che stanno in `max_width`, parola per parola."""
+        if not text:
+            return [""]
+        wrap_cache = self._cache(_WRAP_CACHE)
+        lines = wrap_cache.get((text, max_width))
+        if lines is None:
+            lines = wrap_cache[(text, max_width)] = self._wrap(text, max_width)
+        return lines
+
+    def _wrap(self, text: str, max_width: float) -> list:
+        cache = self._widths()
+        space = self.width(" ", cache)
+        lines, current, current_w = [], "", 0.0
+        for word in text.split():
+            word_w = self.width(word, cache)
+            if current and current_w + space + word_w <= max_width:
+                current += " " + word
+                current_w += space + word_w
+                continue
+            if current:
+                lines.append(current)
+            # Parola più larga della colonna: spezzata carattere per carattere
+            while word_w > max_width and len(word) > 1:
+                cut = len(word) - 1
+                while cut > 1 and self.width(word[:cut], cache) > max_width:
+                    cut -= 1
+                lines.append(word[:cut])
+                word = word[cut:]
+                word_w = self.width(word, cache)
+            current, current_w = word, word_w
+        lines.append(current)
+        return lines
+
+
+def parse_table(table_lines: list) -> list:
+    """Righe della tabella Markdown come liste di celle, senza la riga separatrice."""
+    rows = []
+    for line in table_lines:
+        stripped = line.strip()
+        if stripped.startswith("|") and stripped.endswith("|"):
+            rows.append([cell.strip() for cell in stripped.split("|")[1:-1]])
+        elif "|" in stripped:
+            rows.append([cell.strip() for cell in stripped.strip("|").split("|")])
+    return [
+        r for r in rows
+        if not all(set(c.replace(" ", "").replace(":", "")) <= set("-") for c in r if c)
+    ]
+
+
+def column_widths(col_count: int, page_width: float) -> list:
+    """Larghezze fisse per le tabelle della scheda, ridotte se eccedono la pagina."""
+    if col_count == 5:
+        # Esercizio | Serie | Ripetizioni | Recupero | Note Tecniche
+        widths = [55, 12, 18, 16, page_width - 101]
+    elif col_count == 4:
+        widths = [50, 20, 25, page_width - 95]
+    else:
+        widths = [page_width / col_count] * col_count
+    total = sum(widths)
+    if total > page_width:
+        widths = [w * page_width / total for w in widths]
+    return widths
+
+
+class TableLayout:
+    """Tabella impaginata: righe già spezzate e altezze esatte, disegnate con le stesse righe."""
+
+    def __init__(self, pdf, rows: list, family: str = "Arial"):
+        self.pdf = pdf
+        self.family = family
+        self.measure = measure = TextMeasure(pdf)
+        page_width = pdf.w - pdf.l_margin - pdf.r_margin
+        self.widths = column_widths(len(rows[0]), page_width)
+        self.offsets = [pdf.l_margin + x for x in accumulate([0] + self.widths[:-1])]
+        text_widths = [w - 2 * CELL_PADDING for w in self.widths]
+        cols = len(self.widths)
+
+        pdf.set_font(family, "B", HEADER_FONT_SIZE)
+        header = (rows[0] + [""] * cols)[:cols]
+        self.header = [measure.wrap(clean_markdown(c), tw) for c, tw in zip(header, text_widths)]
+        self.header_height = self._height(self.header)
+
+        self.rows = []
+        pdf.set_font(family, "", TABLE_FONT_SIZE)
+        for r in rows[1:]:
+            cells = (r + [""] * cols)[:cols]
+            wrapped = [measure.wrap(clean_markdown(c), tw) for c, tw in zip(cells, text_widths)]
+            section = is_bold_text(cells[0])
+            if section:
+                # Riga di sezione: prima cella in grassetto
+                pdf.set_font(family, "B", TABLE_FONT_SIZE)
+                wrapped[0] = measure.wrap(clean_markdown(cells[0]), text_widths[0])
+                pdf.set_font(family, "", TABLE_FONT_SIZE)
+            self.rows.append((wrapped, self._height(wrapped), section))
+        self.height = self.header_height + sum(h for _, h, _ in self.rows)
+
+    @staticmethod
+    def _height(wrapped: list) -> float:
+        lines = max(len(cell) for cell in wrapped)
+        return max(MIN_ROW_HEIGHT, lines * LINE_HEIGHT + 2 * CELL_PADDING)
+
+    def _draw_row(self, wrapped: list, height: float, style: str, size: int, centered: bool = False,
+                  fill: bool = False, section: bool = False):
+        pdf = self.pdf
+        measure = self.measure
+        y = pdf.get_y()
+        pdf.set_font(self.family, "B" if section else style, size)
+        # Linea di base come in FPDF.cell: metà interlinea più il 30% del corpo
+        baseline = LINE_HEIGHT / 2 + 0.3 * pdf.font_size
+        for i, (lines, x, w) in enumerate(zip(wrapped, self.offsets, self.widths)):
+            if section and i == 1:
+                pdf.set_font(self.family, style, size)
+            pdf.rect(x, y, w, height, "DF" if fill else "D")
+            # Blocco di testo centrato in verticale nella cella
+            text_y = y + (height - len(lines) * LINE_HEIGHT) / 2 + baseline
+            for n, line in enumerate(lines):
+                if not line:
+                    continue
+                text_x = x + (w - measure.width(line)) / 2 if centered else x + CELL_PADDING
+                pdf.text(text_x, text_y + n * LINE_HEIGHT, line)
+        pdf.set_xy(pdf.l_margin, y + height)
+
+    def _draw_header(self):
+        self.pdf.set_fill_color(220, 220, 220)
+        self._draw_row(self.header, self.header_height, "B", HEADER_FONT_SIZE, centered=True, fill=True)
+
+    def render(self):
+        pdf = self.pdf
+        bottom = pdf.h - pdf.b_margin
+        space_left = bottom - pdf.get_y()
+        page_height = pdf.h - pdf.t_margin - pdf.b_margin
+        # Tabella che non entra nello spazio residuo (poco): si parte da una pagina nuova
+        if self.height > space_left and space_left < page_height * 0.5:
+            pdf.add_page()
+        elif pdf.get_y() + self.header_height + (self.rows[0][1] if self.rows else 0) > bottom:
+            pdf.add_page()
+        self._draw_header()
+        for wrapped, height, section in self.rows:
+            if pdf.get_y() + height > bottom:
+                pdf.add_page()
+                self._draw_header()
+            self._draw_row(wrapped, height, "", TABLE_FONT_SIZE, section=section)
+        pdf.ln(3)
+
+
+def render_gallery(pdf, images: list, family: str, glyphs: GlyphTable):
+    """Pagina finale con le figure `[(nome, percorso JPEG)]` in griglia, con il nome sotto."""
+    pdf.add_page()
+    pdf.set_font(family, "B", 12)
+    pdf.multi_cell(0, 7, txt="Esercizi")
+    pdf.ln(2)
+    measure = TextMeasure(pdf)
+    page_width = pdf.w - pdf.l_margin - pdf.r_margin
+    columns = max(1, int((page_width + GALLERY_GAP) // (GALLERY_IMAGE_SIZE + GALLERY_GAP)))
+    cell_height = GALLERY_IMAGE_SIZE + GALLERY_CAPTION_LINES * LINE_HEIGHT + GALLERY_GAP
+    y = pdf.get_y()
+    pdf.set_font(family, "", TABLE_FONT_SIZE)
+    for n, (name, path) in enumerate(images):
+        column = n % columns
+        if column == 0 and n:
+            y += cell_height
+        if y + cell_height > pdf.h - pdf.b_margin:
+            pdf.add_page()
+            y = pdf.get_y()
+        x = pdf.l_margin + column * (GALLERY_IMAGE_SIZE + GALLERY_GAP)
+        # Lato lungo della miniatura adattato al riquadro quadrato
+        try:
+            pdf.image(path, x, y, w=GALLERY_IMAGE_SIZE)
+        except (OSError, RuntimeError):
+            continue
+        caption = measure.wrap(sanitize_text(name, glyphs), GALLERY_IMAGE_SIZE)[:GALLERY_CAPTION_LINES]
+        for line_number, line in enumerate(caption):
+            pdf.text(x, y + GALLERY_IMAGE_SIZE + (line_number + 1) * LINE_HEIGHT, line)
+    pdf.set_xy(pdf.l_margin, y + cell_height)
+
+
+def render_markdown(md_text: str, images: Optional[list] = None):
+    """Impagina il Markdown della scheda e restituisce il documento FPDF.
+
+    `images` sono le figure `[(nome, percorso JPEG)]` della pagina finale.
+    """
+    if FPDF is None:
+        raise ImportError("Installa il pacchetto fpdf: pip install fpdf==1.7.2")
+
+    pdf = PlanPDF(orientation='L', format='A4')  # Landscape per tabelle più larghe
+    family, glyphs = setup_fonts(pdf)
+
+    # Pulisci il testo markdown all'inizio
+    md_text = sanitize_text(md_text, glyphs)
+
+    pdf.add_page()
+    pdf.set_auto_page_break(auto=True, margin=10)
+
+    def render_table(table_lines):
+        rows = parse_table(table_lines)
+        if rows:
+            TableLayout(pdf, rows, family).render()
+
+    # Process markdown
+    pdf.set_font(family, "", 10)
+    buffer_table = []
+
+    for line in md_text.splitlines():
+        stripped = line.strip()
+
+        # Detect table lines
+        if stripped.startswith("|"):
+            buffer_table.append(line)
+            continue
+
+        # Flush table buffer if we were in a table
+        if buffer_table:
+            render_table(buffer_table)
+            buffer_table = []
+
+        # Handle headers
+        if stripped.startswith("###"):
+            pdf.set_font(family, "B", 11)
+            pdf.multi_cell(0, 6, txt=clean_markdown(stripped.replace("#", "").strip()))
+            pdf.set_font(family, "", 10)
+        elif stripped.startswith("##"):
+            pdf.set_font(family, "B", 12)
+            pdf.multi_cell(0, 7, txt=clean_markdown(stripped.replace("#", "").strip()))
+            pdf.set_font(family, "", 10)
+        elif stripped.startswith("#"):
+            pdf.set_font(family, "B", 14)
+            pdf.multi_cell(0, 8, txt=clean_markdown(stripped.replace("#", "").strip()))
+            pdf.set_font(family, "", 10)
+        elif stripped.startswith("---"):
+            pdf.ln(2)
+            pdf.line(pdf.l_margin, pdf.get_y(), pdf.w - pdf.r_margin, pdf.get_y())
+            pdf.ln(2)
+        elif stripped:
+            # Check if text is bold
+            if is_bold_text(stripped):
+                pdf.set_font(family, "B", 10)
+                pdf.multi_cell(0, 5, txt=clean_markdown(stripped))
+                pdf.set_font(family, "", 10)
+            else:
+                pdf.multi_cell(0, 5, txt=clean_markdown(stripped))
+        else:
+            pdf.ln(2)
+
+    # Flush any remaining table
+    if buffer_table:
+        render_table(buffer_table)
+
+    if images:
+        render_gallery(pdf, images, family, glyphs)
+
+    return pdf
+
+
+def build_pdf_from_markdown(md_text: str, images: Optional[list] = None) -> bytes:
+    """Crea un PDF dal markdown con supporto migliorato alle tabelle (e le figure, se indicate)."""
+    started = time.perf_counter()
+    pdf_bytes = render_markdown(md_text, images).output(dest="S").encode("latin-1")
+    metrics.record_pdf(time.perf_counter() - started, len(pdf_bytes))
+    return pdf_bytes
@@ -0,0 +1,133 @@
+"""Periodizzazione multi-settimana calcolata localmente a partire dalla settimana 1.
+
+La settimana 1 arriva dal percorso di generazione normale (AI o motore locale);
+le successive applicano regole di progressione per obiettivo e livello:
+progressione di carico o di ripetizioni, rampe di volume e settimane di scarico.
+Nessuna chiamata aggiuntiva al modello.
+"""
+import re
+from typing import Optional
+
+from catalog import CatalogIndex
+from plan_engine import GOAL_PRIORITY
+from plan_ir import plan_to_markdown
+from session_time import day_minutes, parse_seconds, row_role, timed_seconds
+
+# Tipo di progressione per obiettivo principale
+PROGRESSION_RULES = {
+    "Forza Pura": {"type": "load", "load_step": 2.5},
+    "Ipertrofia (Massa)": {"type": "double", "load_step": 2.5},
+    "Tonificazione": {"type": "reps", "rest_step": 5, "min_rest": 45},
+    "Miglioramento Posturale": {"type": "reps", "rest_step": 0, "min_rest": 60},
+    "Dimagrimento (Cutting)": {"type": "density", "rest_step": 10, "min_rest": 30},
+    "Equilibrato": {"type": "double", "load_step": 2.5},
+}
+# Frequenza delle settimane di scarico e serie extra massime per livello
+LEVEL_PERIODIZATION = {
+    "Principiante": {"deload_every": 6, "max_extra_sets": 1},
+    "Esperto": {"deload_every": 5, "max_extra_sets": 1},
+    "Super Esperto": {"deload_every": 4, "max_extra_sets": 2},
+}
+# Ogni quante settimane di carico si aggiunge una serie ai multiarticolari
+SET_RAMP_EVERY = 3
+
+
+def _parse_reps(reps: str) -> Optional[tuple]:
+    """'8-12' -> (8, 12); '10 reps' -> (10, 10); None se non numerico o a tempo (es. '30-45s')."""
+    if timed_seconds(reps) is not None:
+        return None
+    numbers = [int(n) for n in re.findall(r"\d+", str(reps))]
+    if not numbers:
+        return None
+    return numbers[0], numbers[-1]
+
+
+def main_goal(goals: list) -> str:
+    """Obiettivo che guida la progressione (stessa priorità del motore locale)."""
+    known = [g for g in goals if g in PROGRESSION_RULES] or ["Equilibrato"]
+    return min(known, key=GOAL_PRIORITY.index)
+
+
+def is_deload(week: int, training_level: str) -> bool:
+    settings = LEVEL_PERIODIZATION.get(training_level, LEVEL_PERIODIZATION["Principiante"])
+    return week > 1 and week % settings["deload_every"] == 0
+
+
+def _progress_row(row: dict, rule: dict, step: int, deload: bool, extra_sets: int, compound: bool) -> dict:
+    """Applica la progressione di una settimana a una riga della settimana 1."""
+    row = dict(row)
+    row.pop("progression", None)
+    sets = int(row.get("sets") or 0)
+    reps = _parse_reps(row.get("reps", ""))
+    rest = parse_seconds(row.get("rest", ""))
+
+    if deload:
+        row["sets"] = max(1, round(sets * 0.6))
+        row["note"] = "Scarico: carico -10%, RIR 3-4"
+        return row
+
+    notes = []
+    if compound and extra_sets:
+        row["sets"] = sets + extra_sets
+    if rule["type"] == "load":
+        notes.append(f"Carico +{rule['load_step'] * step:g}%")
+    elif rule["type"] == "double" and reps:
+        # Doppia progressione: ripetizioni dal minimo al massimo, poi si aumenta il carico
+        lo, hi = reps
+        row["reps"] = str(lo + (hi - lo) * (step % 3) // 2)
+        load = rule["load_step"] * (step // 3)
+        notes.append(f"Carico +{load:g}%" if load else "Stesso carico, più ripetizioni")
+    elif rule["type"] in ("reps", "density"):
+        if reps:
+            lo, hi = reps
+            bump = step // 2 if rule["type"] == "reps" else 0
+            row["reps"] = f"{lo + bump}-{hi + bump}" if lo != hi else str(lo + bump)
+        if rest and rule["rest_step"]:
+            row["rest"] = f"{max(rule['min_rest'], round(rest) - rule['rest_step'] * step)}s"
+        notes.append("Recuperi più brevi" if rule["type"] == "density" else "Ripetizioni in aumento")
+    if row.get("note"):
+        notes.append(row["note"])
+    row["note"] = "; ".join(notes)
+    return row
+
+
+def build_program(plan: dict, profile: dict, weeks: int, index: Optional[CatalogIndex] = None) -> list:
+    """Restituisce la lista delle schede settimanali (la prima è `plan` invariata)."""
+    rule = PROGRESSION_RULES[main_goal(profile.get("goals", []))]
+    level = profile.get("training_level", "Principiante")
+    max_extra = LEVEL_PERIODIZATION.get(level, LEVEL_PERIODIZATION["Principiante"])["max_extra_sets"]
+
+    program = [plan]
+    step = 0
+    for week in range(2, weeks + 1):
+        deload = is_deload(week, level)
+        if not deload:
+            step += 1
+        extra_sets = min(max_extra, step // SET_RAMP_EVERY)
+        days = []
+        for day in plan.get("days", []):
+            rows = [
+                row if row_role(row, index) == "warmup"
+                else _progress_row(row, rule, step, deload, extra_sets, row_role(row, index) == "compound")
+                for row in day.get("rows", [])
+            ]
+            week_day = dict(day, rows=rows)
+            if "minutes" in day:
+                week_day["minutes"] = day_minutes(rows, index)
+            days.append(week_day)
+        program.append(dict(plan, days=days, week=week, deload=deload))
+    return program
+
+
+def week_title(week: int, deload: bool = False) -> str:
+    return f"Settimana {week}" + (" (scarico)" if deload else "")
+
+
+def program_markdown(plan_md: str, program: list) -> str:
+    """Markdown del programma: settimana 1 originale + sezioni per le settimane derivate."""
+    if len(program) <= 1:
+        return plan_md
+    parts = [f"## {week_title(1)}", "", plan_md.strip(), ""]
+    for week_plan in program[1:]:
+        parts += ["---", "", plan_to_markdown(week_plan, title=week_title(week_plan["week"], week_plan["deload"]))]
+    return "\n".join(parts)
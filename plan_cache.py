@@ -0,0 +1,263 @@
+"""Cache delle schede per profilo, riempita fuori picco da warm_cache.py.
+
+La chiave è l'hash dei campi del profilo che influenzano la generazione. Ogni voce
+ricorda la versione del catalogo con cui è stata creata: se il catalogo cambia la
+voce viene ignorata e poi eliminata da `purge`.
+
+Età e durata sono slider quasi continui, quindi le voci sono indicizzate anche per
+profilo quantizzato (fasce di età e di durata): senza corrispondenza esatta si
+riusa la scheda più vicina nella stessa fascia, adattata localmente alla durata.
+L'adattamento (`patch_plan`, che chiude con `fit_plan`) si applica a ogni riuso,
+anche quando le due durate prevedono lo stesso numero di esercizi.
+"""
+import bisect
+import json
+import os
+import time
+from typing import Optional
+
+import metrics
+from catalog import CatalogIndex
+from plan_engine import GUIDED_AGE, OLDER_AGE, exercises_per_day, patch_plan
+from plan_ir import plan_to_markdown
+from plan_store import plan_hash
+from prefs_store import DEFAULT_PREFERENCES
+from session_time import day_seconds
+from storage import connect, db_path
+
+# Le settimane del programma sono derivate localmente dalla prima: non fanno parte della chiave
+EXCLUDED_FIELDS = ("weeks",)
+
+# Riuso delle schede vicine: "adapt" (adatta alla durata), "as-is" oppure "off"
+NEAR_MATCH = os.environ.get("HEVY_NEAR_MATCH", "adapt")
+
+# Limiti inferiori delle fasce: <18 in crescita, adulti, 35-49, poi le soglie del motore
+# locale (50: tetto di serie e nota di mobilità, 55: varianti guidate), 65+
+AGE_BANDS = (18, 35, OLDER_AGE, GUIDED_AGE, 65)
+# Fasce di durata di 15 minuti (1-2 esercizi di differenza, recuperati da patch_plan)
+DURATION_BANDS = (45, 60, 75)
+# Anni e minuti che valgono un punto di distanza tra due profili della stessa fascia
+AGE_SCALE = 10
+DURATION_SCALE = 15
+
+EXACT, NEAR, MISS = "exact", "near", "miss"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plan_cache (
+    key TEXT PRIMARY KEY,
+    catalog_version TEXT NOT NULL,
+    profile TEXT NOT NULL,
+    model TEXT,
+    plan_md TEXT NOT NULL,
+    plan_ir TEXT,
+    created_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    last_hit REAL
+);
+CREATE TABLE IF NOT EXISTS cache_lookups (
+    at REAL NOT NULL,
+    kind TEXT NOT NULL,
+    age_delta INTEGER,
+    duration_delta INTEGER,
+    exercise_error INTEGER,
+    duration_error REAL
+);
+CREATE INDEX IF NOT EXISTS cache_lookups_at ON cache_lookups (at);
+"""
+# Colonne aggiunte dopo la prima versione della tabella
+COLUMNS = {"bucket": "TEXT", "age": "INTEGER", "duration": "INTEGER"}
+LOOKUP_COLUMNS = {"duration_error": "REAL"}
+BUCKET_INDEX = "CREATE INDEX IF NOT EXISTS plan_cache_bucket ON plan_cache (bucket, catalog_version)"
+
+
+def _key_fields(profile: dict) -> dict:
+    fields = {}
+    for field, default in DEFAULT_PREFERENCES.items():
+        if field in EXCLUDED_FIELDS:
+            continue
+        value = profile.get(field, default)
+        fields[field] = sorted(value) if isinstance(value, list) else value
+    return fields
+
+
+def profile_key(profile: dict) -> str:
+    """Hash dei campi del profilo rilevanti per la generazione (liste senza ordine)."""
+    return plan_hash(_key_fields(profile))
+
+
+def quantize(profile: dict) -> dict:
+    """Profilo con età e durata sostituite dall'indice della rispettiva fascia."""
+    fields = _key_fields(profile)
+    fields["age"] = bisect.bisect_right(AGE_BANDS, int(fields["age"]))
+    fields["duration"] = bisect.bisect_right(DURATION_BANDS, int(fields["duration"]))
+    return fields
+
+
+def bucket_key(profile: dict) -> str:
+    return plan_hash(quantize(profile))
+
+
+def duration_error(plan_ir: dict, profile: dict, index: CatalogIndex) -> float:
+    """Massimo scarto relativo (0.1 = 10%) tra la durata stimata dei giorni e quella richiesta."""
+    budget = int(profile.get("duration", 60)) * 60
+    return max((abs(day_seconds(day["rows"], index) - budget) / budget for day in plan_ir["days"]), default=0.0)
+
+
+def adapt_plan(plan_ir: dict, profile: dict, index: CatalogIndex) -> tuple:
+    """Adatta una scheda vicina a giorni e durata richiesti: (scheda, scarto residuo).
+
+    Lo scarto è quello di `duration_error`: entro `DURATION_TOLERANCE` se
+    l'adattamento è riuscito.
+    """
+    adapted = patch_plan(plan_ir, profile, index)
+    return adapted, duration_error(adapted, profile, index)
+
+
+class PlanCache:
+    """Schede pronte per i profili più richiesti, valide per una versione del catalogo."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or db_path("plan_cache.db")
+        conn = connect(self.path)
+        conn.executescript(SCHEMA)
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(plan_cache)")}
+        for column, kind in COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE plan_cache ADD COLUMN {column} {kind}")
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(cache_lookups)")}
+        for column, kind in LOOKUP_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE cache_lookups ADD COLUMN {column} {kind}")
+        conn.execute(BUCKET_INDEX)
+        # Voci salvate prima della quantizzazione o con fasce diverse da quelle attuali
+        rows = conn.execute("SELECT key, profile, bucket FROM plan_cache").fetchall()
+        for row in rows:
+            profile = json.loads(row["profile"])
+            if row["bucket"] == bucket_key(profile):
+                continue
+            conn.execute(
+                "UPDATE plan_cache SET bucket = ?, age = ?, duration = ? WHERE key = ?",
+                (bucket_key(profile), int(profile.get("age", 30)), int(profile.get("duration", 60)), row["key"]),
+            )
+
+    def get(self, profile: dict, catalog_version: str) -> Optional[dict]:
+        """Scheda in cache per il profilo, o None se assente o creata con un altro catalogo."""
+        key = profile_key(profile)
+        conn = connect(self.path)
+        row = conn.execute(
+            "SELECT model, plan_md, plan_ir, created_at FROM plan_cache WHERE key = ? AND catalog_version = ?",
+            (key, catalog_version),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE plan_cache SET hits = hits + 1, last_hit = ? WHERE key = ?", (time.time(), key))
+        return dict(row, plan_ir=json.loads(row["plan_ir"]) if row["plan_ir"] else None)
+
+    def contains(self, profile: dict, catalog_version: str) -> bool:
+        """Come `get` ma senza contare l'accesso (per il job di warming)."""
+        return connect(self.path).execute(
+            "SELECT 1 FROM plan_cache WHERE key = ? AND catalog_version = ?",
+            (profile_key(profile), catalog_version),
+        ).fetchone() is not None
+
+    def put(self, profile: dict, catalog_version: str, model: Optional[str], plan_md: str,
+            plan_ir: Optional[dict] = None):
+        connect(self.path).execute(
+            "INSERT OR REPLACE INTO plan_cache "
+            "(key, catalog_version, profile, model, plan_md, plan_ir, created_at, bucket, age, duration) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                profile_key(profile), catalog_version, json.dumps(profile, ensure_ascii=False), model, plan_md,
+                json.dumps(plan_ir, ensure_ascii=False) if plan_ir else None, time.time(),
+                bucket_key(profile), int(profile.get("age", 30)), int(profile.get("duration", 60)),
+            ),
+        )
+
+    def nearest(self, profile: dict, catalog_version: str) -> Optional[dict]:
+        """Voce più vicina nella stessa fascia del profilo, con le differenze di età e durata."""
+        age, duration = int(profile.get("age", 30)), int(profile.get("duration", 60))
+        rows = connect(self.path).execute(
+            "SELECT key, model, plan_md, plan_ir, profile, age, duration FROM plan_cache "
+            "WHERE bucket = ? AND catalog_version = ?",
+            (bucket_key(profile), catalog_version),
+        ).fetchall()
+        if not rows:
+            return None
+        row = min(rows, key=lambda r: abs(r["age"] - age) / AGE_SCALE + abs(r["duration"] - duration) / DURATION_SCALE)
+        connect(self.path).execute(
+            "UPDATE plan_cache SET hits = hits + 1, last_hit = ? WHERE key = ?", (time.time(), row["key"])
+        )
+        return dict(
+            model=row["model"], plan_md=row["plan_md"], profile=json.loads(row["profile"]),
+            plan_ir=json.loads(row["plan_ir"]) if row["plan_ir"] else None,
+            age_delta=abs(row["age"] - age), duration_delta=abs(row["duration"] - duration),
+        )
+
+    def lookup(self, profile: dict, catalog_version: str, index: CatalogIndex, mode: str = NEAR_MATCH) -> Optional[dict]:
+        """Corrispondenza esatta o, secondo `mode`, la scheda vicina (adattata); registra l'esito."""
+        cached = self.get(profile, catalog_version)
+        if cached:
+            self.record_lookup(EXACT)
+            return dict(cached, match=EXACT)
+        near = self.nearest(profile, catalog_version) if mode != "off" else None
+        if near is None:
+            self.record_lookup(MISS)
+            return None
+        if mode == "adapt" and near["plan_ir"]:
+            # Sempre, anche a parità di esercizi: serie e recuperi seguono la durata richiesta
+            near["plan_ir"], error = adapt_plan(near["plan_ir"], profile, index)
+            near["plan_md"] = plan_to_markdown(near["plan_ir"])
+        elif near["plan_ir"]:
+            error = duration_error(near["plan_ir"], profile, index)
+        elif exercises_per_day(int(profile.get("duration", 60))) == exercises_per_day(int(near["profile"].get("duration", 60))):
+            # Markdown libero senza IR: non adattabile né stimabile, si riusa solo a parità di esercizi
+            error = None
+        else:
+            self.record_lookup(MISS)
+            return None
+        self.record_lookup(NEAR, near["age_delta"], near["duration_delta"], error)
+        return dict(near, match=NEAR, duration_error=error)
+
+    def record_lookup(self, kind: str, age_delta: Optional[int] = None, duration_delta: Optional[int] = None,
+                      duration_error: Optional[float] = None):
+        metrics.CACHE_LOOKUPS.inc(kind)
+        connect(self.path).execute(
+            "INSERT INTO cache_lookups (at, kind, age_delta, duration_delta, duration_error) VALUES (?, ?, ?, ?, ?)",
+            (time.time(), kind, age_delta, duration_delta, duration_error),
+        )
+
+    def lookup_stats(self, since: float = 0) -> dict:
+        """Hit rate (esatti e vicini) ed errore massimo/medio dei riusi dal momento `since`."""
+        conn = connect(self.path)
+        counts = dict(conn.execute(
+            "SELECT kind, COUNT(*) FROM cache_lookups WHERE at >= ? GROUP BY kind", (since,)
+        ).fetchall())
+        errors = conn.execute(
+            "SELECT MAX(age_delta) AS max_age, AVG(age_delta) AS avg_age, "
+            "MAX(duration_delta) AS max_duration, AVG(duration_delta) AS avg_duration, "
+            "MAX(duration_error) AS max_fit, AVG(duration_error) AS avg_fit "
+            "FROM cache_lookups WHERE at >= ? AND kind = ?",
+            (since, NEAR),
+        ).fetchone()
+        total = sum(counts.values())
+        return {
+            "lookups": total,
+            "exact": counts.get(EXACT, 0),
+            "near": counts.get(NEAR, 0),
+            "miss": counts.get(MISS, 0),
+            "hit_rate": (counts.get(EXACT, 0) + counts.get(NEAR, 0)) / total if total else 0.0,
+            "errors": dict(errors),
+        }
+
+    def purge(self, catalog_version: str) -> int:
+        """Elimina le voci create con un catalogo diverso; restituisce quante."""
+        return connect(self.path).execute(
+            "DELETE FROM plan_cache WHERE catalog_version != ?", (catalog_version,)
+        ).rowcount
+
+    def stats(self, catalog_version: str) -> dict:
+        row = connect(self.path).execute(
+            "SELECT COUNT(*) AS entries, COALESCE(SUM(hits), 0) AS hits FROM plan_cache WHERE catalog_version = ?",
+            (catalog_version,),
+        ).fetchone()
+        return dict(row)
@@ -0,0 +1,425 @@
+"""Motore locale a regole: genera una scheda completa senza chiamare l'AI.
+
+Applica le stesse regole del prompt (ripetizioni e recuperi per obiettivo,
+ordine warm-up -> multiarticolari -> unilaterali -> isolamento -> core,
+difficoltà per livello e preferenza attrezzi) sugli indici del catalogo.
+Il risultato è una scheda IR (vedi plan_ir.py) pronta per Markdown e PDF.
+`fit_plan` adatta serie ed esercizi complementari alla durata richiesta usando la
+stima di session_time.py, anche per le schede generate dall'AI.
+"""
+import math
+from typing import Optional
+
+from catalog import CARDIO_KEYWORDS, GYM_EQUIPMENT, HOME_EQUIPMENT, ROLE_ORDER, CatalogIndex
+from session_time import annotate_plan, day_seconds, row_role
+
+# Ripetizioni e recuperi per obiettivo (stesse regole del prompt)
+GOAL_RULES = {
+    "Forza Pura": {"reps": "3-5", "rest": "150s"},
+    "Ipertrofia (Massa)": {"reps": "8-12", "rest": "90s"},
+    "Tonificazione": {"reps": "10-15", "rest": "60s"},
+    "Miglioramento Posturale": {"reps": "12-15", "rest": "60s"},
+    "Dimagrimento (Cutting)": {"reps": "12-15", "rest": "60s"},
+    "Equilibrato": {"reps": "8-12", "rest": "90s"},
+}
+# Priorità per scegliere lo schema dei multiarticolari quando ci sono più obiettivi
+GOAL_PRIORITY = list(GOAL_RULES)
+
+# Gruppi muscolari allenati in ciascun tipo di giorno
+SPLIT_DAYS = {
+    "Full Body": [
+        ("Full Body", ["Quadriceps", "Chest", "Lats", "Hamstrings", "Shoulders", "Middle Back", "Glutes", "Triceps", "Biceps", "Calves"]),
+    ],
+    "Alto/Basso": [
+        ("Parte Alta", ["Chest", "Lats", "Shoulders", "Middle Back", "Triceps", "Biceps", "Traps"]),
+        ("Parte Bassa", ["Quadriceps", "Hamstrings", "Glutes", "Calves", "Adductors", "Abductors"]),
+    ],
+    "Spinta/Tirata/Gambe": [
+        ("Spinta", ["Chest", "Shoulders", "Triceps"]),
+        ("Tirata", ["Lats", "Middle Back", "Biceps", "Traps", "Forearms"]),
+        ("Gambe", ["Quadriceps", "Hamstrings", "Glutes", "Calves", "Adductors"]),
+    ],
+    "Split per Gruppo Muscolare": [
+        ("Petto e Tricipiti", ["Chest", "Triceps"]),
+        ("Schiena e Bicipiti", ["Lats", "Middle Back", "Biceps", "Traps"]),
+        ("Gambe", ["Quadriceps", "Hamstrings", "Glutes", "Calves"]),
+        ("Spalle e Trapezio", ["Shoulders", "Traps", "Forearms"]),
+        ("Braccia", ["Biceps", "Triceps", "Forearms"]),
+    ],
+}
+LOWER_BODY = {"Quadriceps", "Hamstrings", "Glutes", "Calves", "Adductors", "Abductors"}
+
+# Parole chiave per esercizi "classici" e per varianti tecnicamente complesse
+STAPLE_KEYWORDS = (
+    "squat", "bench press", "deadlift", "row", "pullup", "pull-up", "chin-up", "pulldown",
+    "shoulder press", "military press", "lunge", "hip thrust", "leg press", "curl",
+    "pushdown", "lateral raise", "plank", "crunch", "push-up", "pushups", "dip",
+    "calf raise", "leg extension", "fly", "face pull", "glute bridge", "good morning",
+)
+COMPLEX_KEYWORDS = (
+    "clean", "snatch", "jerk", "olympic", "plyo", "jump", "depth", "muscle up",
+    "kipping", "one arm push", "handstand", "pistol", "atlas", "tire", "yoke", "sled",
+)
+
+EQUIPMENT_SCORES = {
+    "Con attrezzi": {"Barbell": 3, "Dumbbell": 3, "Machine": 2, "Cable": 2, "E-Z Curl Bar": 2, "Kettlebells": 1, "Bodyweight": 1},
+    "Senza attrezzi": {"Bodyweight": 3, "Bands": 2, "Exercise Ball": 1, "Medicine Ball": 1},
+}
+LEVEL_SETTINGS = {
+    "Principiante": {"sets": 3, "complex": -4, "stable_bonus": 2, "rir": "RIR 3"},
+    "Esperto": {"sets": 4, "complex": -1, "stable_bonus": 0, "rir": "RIR 1-3"},
+    "Super Esperto": {"sets": 4, "complex": 1, "stable_bonus": -1, "rir": "RIR 0-2"},
+}
+ROLE_NOTES = {
+    "warmup": "Attivazione progressiva, ampiezza crescente",
+    "compound": "Tecnica controllata, core attivo",
+    "unilateral": "Bacino stabile, stesso volume per lato",
+    "isolation": "Eccentrica lenta (2-3s), niente slanci",
+    "core": "Addome attivo, respirazione controllata",
+}
+# Prescrizione del riscaldamento: cardio e rullo (SMR) a tempo, allungamenti statici
+# tenuti, mobilità dinamica (circles, swings, dynamic) a ripetizioni
+WARMUP_REPS = {"cardio": "5 min", "smr": "30-45s", "stretch": "20-30s", "dynamic": "10-12"}
+# Età da cui cambia la scheda: tetto di 3 serie e nota di mobilità, poi varianti guidate
+OLDER_AGE = 50
+GUIDED_AGE = 55
+# Scarto ammesso tra durata stimata e richiesta prima di adattare la scheda
+DURATION_TOLERANCE = 0.1
+# Ruoli che l'adattamento può accorciare o allungare, e limiti di serie
+ACCESSORY_ROLES = ("unilateral", "isolation", "core")
+MIN_ACCESSORY_SETS = 2
+MAX_ACCESSORY_SETS = 4
+MIN_COMPOUND_SETS = 3
+MAX_COMPOUND_SETS = 5
+
+
+def goal_rules(goals: list) -> tuple:
+    """Restituisce (regola multiarticolari, regola complementari) per gli obiettivi."""
+    known = [g for g in goals if g in GOAL_RULES] or ["Equilibrato"]
+    main = min(known, key=GOAL_PRIORITY.index)
+    accessory = max(known, key=GOAL_PRIORITY.index)
+    return GOAL_RULES[main], GOAL_RULES[accessory]
+
+
+def allowed_equipment(equipment_pref: str) -> set:
+    """Attrezzi ammessi per la preferenza della sidebar."""
+    if equipment_pref == "Senza attrezzi":
+        return set(HOME_EQUIPMENT)
+    return GYM_EQUIPMENT | {"Bodyweight"}
+
+
+def score_exercise(rec: dict, profile: dict) -> float:
+    """Punteggio di idoneità dell'esercizio per il profilo (più alto = migliore)."""
+    level = LEVEL_SETTINGS.get(profile.get("training_level"), LEVEL_SETTINGS["Principiante"])
+    name = rec["name"].lower()
+    score = EQUIPMENT_SCORES.get(profile.get("equipment_pref"), EQUIPMENT_SCORES["Con attrezzi"]).get(rec["equipment"], 0)
+    if any(k in name for k in STAPLE_KEYWORDS):
+        score += 3
+    if any(k in name for k in COMPLEX_KEYWORDS):
+        score += level["complex"]
+        if profile.get("age", 30) >= GUIDED_AGE:
+            score -= 3
+    stable = rec["equipment"] in ("Machine", "Cable")
+    if stable:
+        score += level["stable_bonus"]
+        # Over 55: preferisci varianti guidate per ridurre lo stress articolare
+        if profile.get("age", 30) >= GUIDED_AGE:
+            score += 1
+    # A parità di punteggio, preferisci nomi semplici (varianti meno esotiche)
+    return score - len(name) / 40
+
+
+def day_templates(split_type: str, days: int) -> list:
+    """Titolo e muscoli per ciascun giorno della settimana."""
+    cycle = SPLIT_DAYS.get(split_type, SPLIT_DAYS["Full Body"])
+    return [cycle[i % len(cycle)] for i in range(days)]
+
+
+def exercises_per_day(duration: int) -> int:
+    """Numero di esercizi allenanti che stanno nella durata (circa 10 minuti l'uno)."""
+    return max(3, min(10, duration // 10))
+
+
+def _day_slots(muscles: list, profile: dict, n_slots: int) -> list:
+    """Sequenza (muscolo, ruolo) per un giorno, già in ordine fisiologico."""
+    focus = [m for m in profile.get("focus_area", []) if m]
+    muscles = list(muscles)
+    if profile.get("split_type") == "Full Body":
+        muscles = [m for m in focus if m not in muscles] + muscles
+    if profile.get("sex_pref") == "Femmina" and LOWER_BODY & set(muscles) and "Glutes" in muscles:
+        muscles.remove("Glutes")
+        muscles.insert(1, "Glutes")
+    # I muscoli in focus vengono allenati per primi e con uno slot di isolamento extra
+    muscles.sort(key=lambda m: m not in focus)
+
+    with_core = n_slots >= 5
+    work_slots = n_slots - (1 if with_core else 0)
+    n_compound = max(1, math.ceil(work_slots / 2))
+    slots = []
+    for i, muscle in enumerate(muscles[:work_slots]):
+        slots.append((muscle, "compound" if i < n_compound else "isolation"))
+    # Uno slot unilaterale sul primo gruppo degli arti inferiori (o il primo del giorno)
+    if work_slots >= 4:
+        uni_muscle = next((m for m in muscles if m in LOWER_BODY), muscles[0])
+        idx = next((i for i, s in enumerate(slots) if s[1] == "isolation"), len(slots))
+        slots.insert(idx, (uni_muscle, "unilateral"))
+    for muscle in focus:
+        if muscle in muscles and len(slots) < work_slots + 1:
+            slots.append((muscle, "isolation"))
+    slots = slots[:work_slots]
+    # Riempi gli slot mancanti ripartendo dai muscoli principali
+    i = 0
+    while len(slots) < work_slots and muscles:
+        slots.append((muscles[i % len(muscles)], "isolation"))
+        i += 1
+    if with_core:
+        slots.append(("Abdominals", "core"))
+    slots.sort(key=lambda s: ROLE_ORDER[s[1]])
+    return slots
+
+
+def _pick(index: CatalogIndex, muscle: str, role: str, profile: dict, used_week: set, used_day: set):
+    """Sceglie il miglior esercizio per (muscolo, ruolo) evitando ripetizioni."""
+    equipment = allowed_equipment(profile.get("equipment_pref"))
+    pool = [r for r in index.by_muscle.get(muscle, []) if r["equipment"] in equipment and r["role"] != "warmup"]
+    preferred = [r for r in pool if r["role"] == role] or pool
+    if role == "core":
+        preferred = [r for r in index.by_role.get("core", []) if r["equipment"] in equipment] or preferred
+    ranked = sorted(preferred, key=lambda r: (-score_exercise(r, profile), r["name"]))
+    for candidates in (
+        [r for r in ranked if r["id"] not in used_week],
+        [r for r in ranked if r["id"] not in used_day],
+    ):
+        if candidates:
+            return candidates[0]
+    return None
+
+
+def warmup_reps(rec: dict) -> str:
+    """Ripetizioni o durata di un esercizio di riscaldamento secondo il tipo."""
+    name = rec["name"].lower()
+    if any(k in name for k in CARDIO_KEYWORDS):
+        return WARMUP_REPS["cardio"]
+    if rec.get("equipment") == "Foam Roll" or "smr" in name:
+        return WARMUP_REPS["smr"]
+    if "stretch" in name and "dynamic" not in name:
+        return WARMUP_REPS["stretch"]
+    return WARMUP_REPS["dynamic"]
+
+
+def _pick_warmup(index: CatalogIndex, muscles: list, profile: dict, used_week: set):
+    """Sceglie un esercizio di attivazione coerente con i muscoli del giorno."""
+    pool = index.by_role.get("warmup", [])
+    ranked = sorted(pool, key=lambda r: (r["muscle_group"] not in muscles, r["id"] in used_week, len(r["name"]), r["name"]))
+    return ranked[0] if ranked else None
+
+
+def build_plan(profile: dict, index: CatalogIndex) -> dict:
+    """Genera una scheda completa applicando le regole in modo deterministico."""
+    main_rule, accessory_rule = goal_rules(profile.get("goals", []))
+    level = LEVEL_SETTINGS.get(profile.get("training_level"), LEVEL_SETTINGS["Principiante"])
+    n_slots = exercises_per_day(int(profile.get("duration", 60)))
+    older = profile.get("age", 30) >= OLDER_AGE
+
+    used_week = set()
+    days = []
+    for day_num, (label, muscles) in enumerate(day_templates(profile.get("split_type"), int(profile.get("days", 4))), start=1):
+        used_day = set()
+        rows = []
+        warmup = _pick_warmup(index, muscles, profile, used_week)
+        if warmup:
+            note = ROLE_NOTES["warmup"] + ("; mobilità articolare extra" if older else "")
+            rows.append({"id": warmup["id"], "name": warmup["name"], "sets": 1, "reps": warmup_reps(warmup), "rest": "-", "note": note})
+            used_week.add(warmup["id"])
+        for muscle, role in _day_slots(muscles, profile, n_slots):
+            rec = _pick(index, muscle, role, profile, used_week, used_day)
+            if rec is None:
+                continue
+            used_week.add(rec["id"])
+            used_day.add(rec["id"])
+            rule = main_rule if role == "compound" else accessory_rule
+            sets = level["sets"] if role == "compound" else 3
+            if older:
+                sets = min(sets, 3)
+            note = ROLE_NOTES[role]
+            if role == "compound":
+                note += f", {level['rir']}"
+            rows.append({
+                "id": rec["id"],
+                "name": rec["name"],
+                "sets": sets,
+                "reps": "30-45s" if role == "core" and "plank" in rec["name"].lower() else rule["reps"],
+                "rest": "60s" if role == "core" else rule["rest"],
+                "note": note,
+            })
+        days.append({"title": f"Giorno {day_num} - {label}", "rows": rows})
+    return fit_plan({"days": days, "source": "local"}, profile, index)
+
+
+def swap_candidates(plan: dict, day_idx: int, row_idx: int, index: CatalogIndex, limit: int = 8) -> list:
+    """Alternative locali per una riga, escludendo gli esercizi già presenti nel giorno."""
+    day = plan["days"][day_idx]
+    in_day = {r.get("id") for r in day["rows"]}
+    return index.alternatives(day["rows"][row_idx].get("id"), exclude=in_day, limit=limit)
+
+
+def swap_exercise(plan: dict, day_idx: int, row_idx: int, new_id: str, index: CatalogIndex) -> dict:
+    """Sostituisce un esercizio mantenendo serie, ripetizioni, recupero e note.
+
+    Per il riscaldamento la prescrizione segue il nuovo esercizio (es. cardio a minuti).
+    """
+    rec = index.by_id[new_id]
+    days = [dict(d, rows=list(d["rows"])) for d in plan["days"]]
+    row = dict(days[day_idx]["rows"][row_idx], id=rec["id"], name=rec["name"])
+    if rec["role"] == "warmup":
+        row["reps"] = warmup_reps(rec)
+    days[day_idx]["rows"][row_idx] = row
+    return dict(plan, days=days)
+
+
+def reshuffle_day(plan: dict, day_idx: int, index: CatalogIndex) -> dict:
+    """Rigenera localmente un giorno sostituendo ogni esercizio con la prima alternativa libera."""
+    used = {r.get("id") for d in plan["days"] for r in d["rows"]}
+    for row_idx, row in enumerate(plan["days"][day_idx]["rows"]):
+        options = index.alternatives(row.get("id"), exclude=used, limit=1)
+        if options:
+            used.add(options[0]["id"])
+            plan = swap_exercise(plan, day_idx, row_idx, options[0]["id"], index)
+    return plan
+
+
+def patch_plan(plan: dict, profile: dict, index: CatalogIndex) -> dict:
+    """Adatta la scheda a nuovi giorni/durata senza rigenerarla.
+
+    I giorni in più e gli esercizi mancanti vengono presi dalla scheda locale per
+    lo stesso profilo; quelli in eccesso si tolgono partendo dai complementari.
+    """
+    reference = build_plan(profile, index)
+    n_days = int(profile.get("days", len(plan["days"])))
+    days = [dict(d, rows=list(d["rows"])) for d in plan["days"][:n_days]]
+    days += reference["days"][len(days):n_days]
+    target = exercises_per_day(int(profile.get("duration", 60)))
+
+    for i, day in enumerate(days):
+        rows = day["rows"]
+        working = [r for r in rows if row_role(r, index, "compound") != "warmup"]
+        # Troppi esercizi: togli dal fondo, prima complementari, poi core, poi multiarticolari
+        for roles in (("isolation", "unilateral"), ("core",), ("compound",)):
+            while len(working) > target:
+                victim = next((r for r in reversed(rows) if row_role(r, index, "compound") in roles), None)
+                if victim is None:
+                    break
+                rows.remove(victim)
+                working.remove(victim)
+        # Troppo pochi: aggiungi dalla scheda locale prima del core
+        present = {r.get("id") for r in rows}
+        extra = [
+            r for r in reference["days"][i % len(reference["days"])]["rows"]
+            if r["id"] not in present and row_role(r, index, "compound") not in ("warmup", "core")
+        ] if reference["days"] else []
+        while len(working) < target and extra:
+            row = extra.pop()
+            pos = next((j for j, r in enumerate(rows) if row_role(r, index, "compound") == "core"), len(rows))
+            rows.insert(pos, row)
+            working.append(row)
+        day["rows"] = rows
+    return fit_plan(dict(plan, days=days), profile, index, reference)
+
+
+def _extra_rows(day_idx: int, rows: list, profile: dict, index: CatalogIndex, used: set,
+                reference: Optional[dict], rounds: int = 3) -> list:
+    """Esercizi da aggiungere a un giorno troppo corto: prima dalla scheda di riferimento,
+    poi alternative del catalogo agli esercizi del giorno, con l'attrezzatura ammessa."""
+    extra = []
+    if reference and reference["days"]:
+        extra = [
+            r for r in reference["days"][day_idx % len(reference["days"])]["rows"]
+            if r["id"] not in used and row_role(r, index, "compound") not in ("warmup", "core")
+        ]
+    equipment = allowed_equipment(profile.get("equipment_pref"))
+    seen = used | {r["id"] for r in extra}
+    sources = [r for r in rows if row_role(r, index, "compound") not in ("warmup", "core")]
+    options = {r.get("id"): [a for a in index.alternatives(r.get("id"), exclude=seen, limit=4 * rounds)
+                             if a["equipment"] in equipment] for r in sources}
+    # Un'alternativa per esercizio a ogni giro, così le aggiunte restano varie
+    for turn in range(rounds):
+        for row in sources:
+            rec = next((a for a in options[row.get("id")] if a["id"] not in seen), None)
+            if rec is None:
+                continue
+            seen.add(rec["id"])
+            extra.append({"id": rec["id"], "name": rec["name"], "sets": 3, "reps": row.get("reps", ""),
+                          "rest": row.get("rest", ""), "note": ROLE_NOTES.get(rec["role"], "")})
+    return extra
+
+
+def _set_changes(rows: list, index: CatalogIndex, roles: tuple, step: int, limit: int) -> list:
+    """Varianti del giorno con una serie in più o in meno su un esercizio dei ruoli dati."""
+    return [
+        rows[:i] + [dict(row, sets=int(row["sets"]) + step)] + rows[i + 1:]
+        for i, row in enumerate(rows)
+        if row_role(row, index, "compound") in roles and (int(row.get("sets") or 0) - limit) * step < 0
+    ]
+
+
+def _removals(rows: list, index: CatalogIndex, roles: tuple) -> list:
+    return [rows[:i] + rows[i + 1:] for i, row in enumerate(rows) if row_role(row, index, "compound") in roles]
+
+
+def _fit_day(rows: list, budget: float, index: CatalogIndex, extra: list) -> list:
+    """Toglie o aggiunge serie ed esercizi finché la seduta non rientra nel budget.
+
+    A ogni passo applica la modifica che porta la stima più vicina al budget, cercando
+    prima tra i complementari; i multiarticolari cambiano solo quando non resta altro.
+    """
+    low, high = budget * (1 - DURATION_TOLERANCE), budget * (1 + DURATION_TOLERANCE)
+    extra = list(extra)
+    while True:
+        current = day_seconds(rows, index)
+        if low <= current <= high:
+            return rows
+        if current > high:
+            working = [r for r in rows if row_role(r, index, "compound") != "warmup"]
+            tiers = [
+                _removals(rows, index, ACCESSORY_ROLES)
+                + _set_changes(rows, index, ACCESSORY_ROLES, -1, MIN_ACCESSORY_SETS),
+                _set_changes(rows, index, ("compound",), -1, MIN_COMPOUND_SETS),
+                _removals(rows, index, ("compound",)) if len(working) > 1 else [],
+            ]
+        else:
+            added = []
+            if extra:
+                order = ROLE_ORDER.get(row_role(extra[0], index, "compound"), 0)
+                pos = next((j for j, r in enumerate(rows) if ROLE_ORDER.get(row_role(r, index, "compound"), 0) > order), len(rows))
+                added = [rows[:pos] + [extra[0]] + rows[pos:]]
+            tiers = [
+                added + _set_changes(rows, index, ACCESSORY_ROLES, 1, MAX_ACCESSORY_SETS),
+                _set_changes(rows, index, ("compound",), 1, MAX_COMPOUND_SETS),
+            ]
+        options = next((tier for tier in tiers if tier), [])
+        best = min(options, key=lambda o: abs(day_seconds(o, index) - budget), default=None)
+        if best is None or abs(day_seconds(best, index) - budget) >= abs(current - budget):
+            return rows
+        if extra and len(best) > len(rows):
+            extra.pop(0)
+        rows = best
+
+
+def fit_plan(plan: dict, profile: dict, index: CatalogIndex, reference: Optional[dict] = None) -> dict:
+    """Adatta ogni giorno alla durata del profilo (±10%) e annota la durata stimata.
+
+    Non chiama il modello: le serie e gli esercizi aggiunti arrivano da `reference`
+    (una scheda locale per lo stesso profilo) o dalle alternative del catalogo.
+    """
+    budget = int(profile.get("duration") or 0) * 60
+    used = {r.get("id") for d in plan.get("days", []) for r in d.get("rows", [])}
+    days = []
+    for i, day in enumerate(plan.get("days", [])):
+        rows = list(day.get("rows", []))
+        if budget and rows:
+            short = day_seconds(rows, index) < budget * (1 - DURATION_TOLERANCE)
+            extra = _extra_rows(i, rows, profile, index, used, reference) if short else []
+            rows = _fit_day(rows, budget, index, extra)
+        used |= {r.get("id") for r in rows}
+        days.append(dict(day, rows=rows))
+    return annotate_plan(dict(plan, days=days), index)
@@ -0,0 +1,122 @@
+"""Storico locale delle schede generate, con ricerca full-text (SQLite FTS5)."""
+import json
+import re
+import sqlite3
+import time
+from typing import Optional
+
+from storage import connect, db_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    id INTEGER PRIMARY KEY,
+    token TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    model TEXT,
+    engine_mode TEXT,
+    profile TEXT NOT NULL,
+    plan_md TEXT NOT NULL,
+    plan_ir TEXT,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS plans_token_created ON plans (token, created_at DESC);
+"""
+FTS_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS plans_fts USING fts5(exercises, notes, tokenize='unicode61 remove_diacritics 2')"
+
+
+def _search_text(plan_md: str, plan_ir: Optional[dict]) -> tuple:
+    """Testo indicizzato: nomi degli esercizi e note (da IR se presente, altrimenti dal Markdown)."""
+    if plan_ir:
+        rows = [r for d in plan_ir.get("days", []) for r in d.get("rows", [])]
+        exercises = " ".join(r.get("name") or r.get("id", "") for r in rows)
+        notes = " ".join(f"{r.get('note', '')} {r.get('progression', '')}" for r in rows)
+        return exercises, notes
+    return "", plan_md
+
+
+def _fts_query(text: str) -> str:
+    """Trasforma l'input utente in una query FTS5 sicura (prefisso su ogni parola)."""
+    words = re.findall(r"\w+", text, flags=re.UNICODE)
+    return " ".join(f'"{w}"*' for w in words)
+
+
+class PlanHistory:
+    """Storico per utente: salvataggio, ricerca paginata e ripristino senza chiamare il modello."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or db_path("history.db")
+        conn = connect(self.path)
+        conn.executescript(SCHEMA)
+        try:
+            conn.execute(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # SQLite compilato senza FTS5: la ricerca ripiega su LIKE
+            self.fts = False
+
+    def record(self, token: str, profile: dict, model: Optional[str], plan_md: str,
+               plan_ir: Optional[dict] = None, timings: Optional[dict] = None) -> int:
+        """Registra una scheda generata e ne restituisce l'id."""
+        conn = connect(self.path)
+        with conn:
+            conn.execute("BEGIN")
+            cur = conn.execute(
+                "INSERT INTO plans (token, created_at, model, engine_mode, profile, plan_md, plan_ir, timings) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    token, time.time(), model, profile.get("engine_mode"),
+                    json.dumps(profile, ensure_ascii=False), plan_md,
+                    json.dumps(plan_ir, ensure_ascii=False) if plan_ir else None,
+                    json.dumps(timings or {}),
+                ),
+            )
+            if self.fts:
+                conn.execute(
+                    "INSERT INTO plans_fts (rowid, exercises, notes) VALUES (?, ?, ?)",
+                    (cur.lastrowid, *_search_text(plan_md, plan_ir)),
+                )
+        return cur.lastrowid
+
+    def search(self, token: str, query: str = "", page: int = 0, page_size: int = 10) -> tuple:
+        """Restituisce (righe della pagina, totale) per l'utente, le più recenti prima."""
+        conn = connect(self.path)
+        columns = "p.id, p.created_at, p.model, p.engine_mode, p.profile, p.timings"
+        match = _fts_query(query) if query else ""
+        if match and self.fts:
+            where = "p.token = ? AND p.id IN (SELECT rowid FROM plans_fts WHERE plans_fts MATCH ?)"
+            params = (token, match)
+        elif query:
+            where = "p.token = ? AND p.plan_md LIKE ?"
+            params = (token, f"%{query}%")
+        else:
+            where, params = "p.token = ?", (token,)
+        total = conn.execute(f"SELECT COUNT(*) FROM plans p WHERE {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT {columns} FROM plans p WHERE {where} ORDER BY p.created_at DESC LIMIT ? OFFSET ?",
+            params + (page_size, page * page_size),
+        ).fetchall()
+        return [
+            dict(row, profile=json.loads(row["profile"]), timings=json.loads(row["timings"] or "{}"))
+            for row in rows
+        ], total
+
+    def get(self, token: str, plan_id: int) -> Optional[dict]:
+        """Scheda completa per il ripristino (lookup per chiave primaria)."""
+        row = connect(self.path).execute(
+            "SELECT * FROM plans WHERE id = ? AND token = ?", (plan_id, token)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(
+            row,
+            profile=json.loads(row["profile"]),
+            plan_ir=json.loads(row["plan_ir"]) if row["plan_ir"] else None,
+            timings=json.loads(row["timings"] or "{}"),
+        )
+
+    def profiles_since(self, since: float) -> list:
+        """Profili delle schede generate da `since` in poi, di tutti gli utenti (per il warming)."""
+        rows = connect(self.path).execute(
+            "SELECT profile FROM plans WHERE created_at >= ?", (since,)
+        ).fetchall()
+        return [json.loads(row["profile"]) for row in rows]
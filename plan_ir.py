@@ -0,0 +1,249 @@
+"""Rappresentazione strutturata (IR) delle schede di allenamento.
+
+La scheda è un dizionario semplice, serializzabile in JSON:
+
+    {"days": [{"title": "Giorno 1 - Spinta", "minutes": 55,
+               "rows": [{"id": "Barbell_Bench_Press_-_Medium_Grip",
+                         "name": "Barbell Bench Press - Medium Grip",
+                         "sets": 4, "reps": "8-10", "rest": "90s",
+                         "note": "Scapole addotte"}]}]}
+
+Il modello restituisce solo gli `id` del catalogo: i nomi vengono espansi
+localmente e Markdown/PDF sono generati da questa struttura. `minutes`, facoltativo,
+è la durata stimata della seduta (vedi session_time.py).
+"""
+import json
+from typing import Optional
+
+# Colonne della tabella Markdown, nello stesso ordine usato dal PDF
+PLAN_COLUMNS = ["Esercizio", "Serie", "Ripetizioni", "Recupero", "Note Tecniche"]
+
+# Schema di risposta per la modalità JSON di Gemini (formato OpenAPI ridotto)
+PLAN_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "days": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "title": {"type": "STRING"},
+                    "rows": {
+                        "type": "ARRAY",
+                        "items": {
+                            "type": "OBJECT",
+                            "properties": {
+                                "id": {"type": "STRING"},
+                                "sets": {"type": "INTEGER"},
+                                "reps": {"type": "STRING"},
+                                "rest": {"type": "STRING"},
+                                "note": {"type": "STRING"},
+                            },
+                            "required": ["id", "sets", "reps", "rest"],
+                            "propertyOrdering": ["id", "sets", "reps", "rest", "note"],
+                        },
+                    },
+                },
+                "required": ["title", "rows"],
+                "propertyOrdering": ["title", "rows"],
+            },
+        },
+    },
+    "required": ["days"],
+}
+
+# Schema di un singolo giorno (rigenerazione parziale)
+DAY_RESPONSE_SCHEMA = PLAN_RESPONSE_SCHEMA["properties"]["days"]["items"]
+
+# Schema per la modalità ibrida: l'AI scrive solo note e progressioni
+NOTES_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "notes": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "id": {"type": "STRING"},
+                    "note": {"type": "STRING"},
+                    "progression": {"type": "STRING"},
+                },
+                "required": ["id", "note"],
+                "propertyOrdering": ["id", "note", "progression"],
+            },
+        },
+    },
+    "required": ["notes"],
+}
+
+
+def _normalize_day(day: dict, number: int) -> dict:
+    """Normalizza un giorno restituito dal modello; ValueError se la struttura non è quella attesa."""
+    if not isinstance(day, dict):
+        raise ValueError(f"Giorno {number}: atteso un oggetto, trovato {type(day).__name__}")
+    rows_in = day.get("rows") or []
+    if not isinstance(rows_in, list) or not all(isinstance(row, dict) for row in rows_in):
+        raise ValueError(f"Giorno {number}: `rows` deve essere una lista di oggetti")
+    rows = []
+    for row in rows_in:
+        ex_id = str(row.get("id", "")).strip()
+        if not ex_id:
+            continue
+        try:
+            sets = int(row.get("sets") or 0)
+        except (TypeError, ValueError):
+            sets = 0
+        rows.append({
+            "id": ex_id,
+            "sets": sets,
+            "reps": str(row.get("reps", "")).strip(),
+            "rest": str(row.get("rest", "")).strip(),
+            "note": str(row.get("note", "") or "").strip(),
+        })
+    return {"title": str(day.get("title") or f"Giorno {number}").strip(), "rows": rows}
+
+
+def plan_from_json(text: str) -> dict:
+    """Valida e normalizza la risposta JSON del modello in una scheda IR (ValueError se malformata)."""
+    data = json.loads(text)
+    if isinstance(data, list):
+        data = {"days": data}
+    days = data.get("days") if isinstance(data, dict) else None
+    if not isinstance(days, list):
+        raise ValueError("La risposta non contiene una lista `days`")
+    return {"days": [_normalize_day(day, i) for i, day in enumerate(days, start=1)]}
+
+
+def day_from_json(text: str, number: int) -> dict:
+    """Come plan_from_json, ma per la risposta di un singolo giorno."""
+    return _normalize_day(json.loads(text), number)
+
+
+def _split_row(line: str) -> list:
+    """Celle di una riga di tabella Markdown."""
+    return [cell.strip() for cell in line.strip().strip("|").split("|")]
+
+
+def _strip_md(text: str) -> str:
+    return text.replace("**", "").replace("__", "").strip()
+
+
+def plan_from_markdown(md_text: str, ids_by_name: Optional[dict] = None) -> dict:
+    """Ricostruisce la scheda IR dalle tabelle Markdown (output AI in formato libero).
+
+    `ids_by_name` mappa il nome in minuscolo all'id del catalogo; le righe con
+    nomi sconosciuti mantengono id vuoto.
+    """
+    ids_by_name = ids_by_name or {}
+    days = []
+    current = None
+    for line in md_text.splitlines():
+        stripped = line.strip()
+        if not stripped.startswith("|"):
+            title = _strip_md(stripped.lstrip("#").strip())
+            if stripped.startswith("#") or (stripped.startswith("**") and "giorno" in stripped.lower()):
+                if "giorno" in title.lower() or current is None:
+                    current = {"title": title, "rows": []}
+                    days.append(current)
+            continue
+        cells = _split_row(stripped)
+        if all(set(c.replace(":", "").replace(" ", "")) <= set("-") for c in cells):
+            continue
+        if cells and _strip_md(cells[0]).lower() in ("esercizio", "exercise"):
+            continue
+        cells += [""] * (len(PLAN_COLUMNS) - len(cells))
+        name = _strip_md(cells[0])
+        # Righe di sezione (es. "**Warm-up**" senza serie né ripetizioni)
+        if not name or not any(cells[1:4]):
+            continue
+        if current is None:
+            current = {"title": f"Giorno {len(days) + 1}", "rows": []}
+            days.append(current)
+        try:
+            sets = int("".join(ch for ch in cells[1].split("-")[0] if ch.isdigit()) or 0)
+        except ValueError:
+            sets = 0
+        current["rows"].append({
+            "id": ids_by_name.get(name.lower(), ""),
+            "name": name,
+            "sets": sets,
+            "reps": cells[2],
+            "rest": cells[3],
+            "note": " ".join(c for c in cells[4:] if c),
+        })
+    return {"days": [d for d in days if d["rows"]]}
+
+
+def expand_plan(plan: dict, names_by_id: dict) -> dict:
+    """Sostituisce gli id con i nomi del catalogo, scartando id inesistenti e i giorni rimasti vuoti."""
+    days = []
+    for day in plan.get("days", []):
+        rows = [
+            dict(row, name=names_by_id[row["id"]])
+            for row in day.get("rows", [])
+            if row.get("id") in names_by_id
+        ]
+        if rows:
+            days.append(dict(day, rows=rows))
+    return dict(plan, days=days)
+
+
+def merge_notes(plan: dict, text: str) -> dict:
+    """Applica alla scheda le note per id restituite in modalità ibrida."""
+    data = json.loads(text)
+    notes = {
+        str(item.get("id", "")).strip(): item
+        for item in (data.get("notes") if isinstance(data, dict) else data) or []
+    }
+    days = []
+    for day in plan.get("days", []):
+        rows = []
+        for row in day.get("rows", []):
+            item = notes.get(row["id"])
+            if item:
+                row = dict(
+                    row,
+                    note=str(item.get("note") or row.get("note", "")).strip(),
+                    progression=str(item.get("progression") or "").strip(),
+                )
+            rows.append(row)
+        days.append(dict(day, rows=rows))
+    return dict(plan, days=days)
+
+
+def _cell(value) -> str:
+    """Rende un valore sicuro dentro una cella Markdown."""
+    return str(value).replace("|", "/").replace("\n", " ").strip()
+
+
+def _note_text(row: dict) -> str:
+    """Nota tecnica con l'eventuale indicazione di progressione."""
+    note = row.get("note", "")
+    if row.get("progression"):
+        note = f"{note} - Progressione: {row['progression']}" if note else f"Progressione: {row['progression']}"
+    return note
+
+
+def plan_to_markdown(plan: dict, title: Optional[str] = None) -> str:
+    """Genera il Markdown della scheda (una tabella per giorno)."""
+    lines = []
+    if title:
+        lines += [f"## {title}", ""]
+    header = "| " + " | ".join(PLAN_COLUMNS) + " |"
+    separator = "|" + "|".join("---" for _ in PLAN_COLUMNS) + "|"
+    for day in plan.get("days", []):
+        lines += [f"### {day.get('title', '')}", ""]
+        if day.get("minutes"):
+            lines += [f"_Durata stimata: ~{day['minutes']} min_", ""]
+        lines += [header, separator]
+        for row in day.get("rows", []):
+            cells = [
+                row.get("name") or row.get("id", ""),
+                row.get("sets", ""),
+                row.get("reps", ""),
+                row.get("rest", ""),
+                _note_text(row),
+            ]
+            lines.append("| " + " | ".join(_cell(c) for c in cells) + " |")
+        lines.append("")
+    return "\n".join(lines).strip() + "\n"
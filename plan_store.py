@@ -0,0 +1,106 @@
+"""Archivio content-addressed delle schede, per i link condivisibili (?plan=<hash>).
+
+Ogni scheda è salvata sotto l'hash del suo contenuto, in JSON compatto compresso
+con zlib, insieme al PDF già generato. Quando l'archivio supera la dimensione
+massima vengono eliminate le schede lette meno di recente (LRU).
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from typing import Optional
+
+from storage import connect, db_path
+
+# Dimensione massima dell'archivio (schede + PDF compressi)
+MAX_STORE_BYTES = int(float(os.environ.get("HEVY_PLAN_STORE_MAX_MB", "200")) * 1024 * 1024)
+HASH_RE = re.compile(r"[0-9a-f]{16}")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shared_plans (
+    hash TEXT PRIMARY KEY,
+    payload BLOB NOT NULL,
+    pdf BLOB,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shared_plans_access ON shared_plans (last_access);
+"""
+
+
+def _encode(payload: dict) -> bytes:
+    return zlib.compress(json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8"), 9)
+
+
+def plan_hash(payload: dict) -> str:
+    """Hash corto e stabile del contenuto della scheda."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class PlanStore:
+    """Schede condivise indirizzate per hash, con PDF in cache ed eviction LRU."""
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = MAX_STORE_BYTES):
+        self.path = path or db_path("shared_plans.db")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        connect(self.path).executescript(SCHEMA)
+
+    def put(self, plan_md: str, plan_ir: Optional[dict] = None, profile: Optional[dict] = None) -> str:
+        """Salva la scheda (idempotente) e ne restituisce l'hash."""
+        payload = {"plan_md": plan_md, "plan_ir": plan_ir, "profile": profile or {}}
+        key = plan_hash(payload)
+        blob = _encode(payload)
+        now = time.time()
+        conn = connect(self.path)
+        cur = conn.execute(
+            "INSERT INTO shared_plans (hash, payload, size, created_at, last_access) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(hash) DO UPDATE SET last_access = excluded.last_access",
+            (key, blob, len(blob), now, now),
+        )
+        if cur.rowcount:
+            self._evict()
+        return key
+
+    def get(self, key: str) -> Optional[dict]:
+        """Scheda per hash, o None se inesistente o eliminata."""
+        if not HASH_RE.fullmatch(key or ""):
+            return None
+        conn = connect(self.path)
+        row = conn.execute("SELECT payload FROM shared_plans WHERE hash = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE shared_plans SET last_access = ? WHERE hash = ?", (time.time(), key))
+        return json.loads(zlib.decompress(row["payload"]).decode("utf-8"))
+
+    def get_pdf(self, key: str) -> Optional[bytes]:
+        row = connect(self.path).execute("SELECT pdf FROM shared_plans WHERE hash = ?", (key,)).fetchone()
+        return bytes(row["pdf"]) if row and row["pdf"] is not None else None
+
+    def put_pdf(self, key: str, pdf_bytes: bytes):
+        """Associa il PDF generato alla scheda (il PDF è già compresso da FPDF)."""
+        connect(self.path).execute(
+            "UPDATE shared_plans SET pdf = ?, size = length(payload) + ? WHERE hash = ?",
+            (pdf_bytes, len(pdf_bytes), key),
+        )
+        self._evict()
+
+    def _evict(self):
+        """Elimina le schede lette meno di recente finché l'archivio non rientra nel limite."""
+        with self._lock:
+            conn = connect(self.path)
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM shared_plans").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            victims = []
+            for row in conn.execute("SELECT hash, size FROM shared_plans ORDER BY last_access"):
+                if total <= self.max_bytes:
+                    break
+                victims.append((row["hash"],))
+                total -= row["size"]
+            conn.executemany("DELETE FROM shared_plans WHERE hash = ?", victims)
@@ -0,0 +1,80 @@
+"""Preferenze utente per token di sessione, salvate in SQLite (WAL)."""
+import copy
+import json
+import threading
+import time
+from typing import Optional
+
+from storage import connect, db_path
+
+# Valori iniziali della sidebar (e campi del profilo accettati dalla generazione in blocco)
+DEFAULT_PREFERENCES = {
+    "goals": ["Ipertrofia (Massa)"],
+    "days": 4,
+    "split_type": "Full Body",
+    "focus_area": [],
+    "equipment_pref": "Con attrezzi",
+    "sex_pref": "Maschio",
+    "age": 30,
+    "training_level": "Principiante",
+    "duration": 60,
+    "weeks": 1,
+    "structured_output": True,
+    "engine_mode": "AI completa"
+}
+
+
+def default_preferences() -> dict:
+    """Copia modificabile delle preferenze predefinite."""
+    return copy.deepcopy(DEFAULT_PREFERENCES)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS preferences (
+    token TEXT PRIMARY KEY,
+    prefs TEXT NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class PreferenceStore:
+    """Store chiave -> preferenze con cache in memoria e upsert atomici.
+
+    Le letture passano dalla cache (nessun I/O ai rerun successivi); le scritture
+    avvengono solo se il valore è cambiato davvero.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or db_path("preferences.db")
+        self._cache = {}
+        self._lock = threading.Lock()
+        connect(self.path).execute(SCHEMA)
+
+    def get(self, token: str) -> Optional[dict]:
+        with self._lock:
+            if token in self._cache:
+                cached = self._cache[token]
+                return json.loads(cached) if cached is not None else None
+        row = connect(self.path).execute("SELECT prefs FROM preferences WHERE token = ?", (token,)).fetchone()
+        value = row["prefs"] if row else None
+        with self._lock:
+            self._cache[token] = value
+        return json.loads(value) if value is not None else None
+
+    def set(self, token: str, prefs: dict) -> bool:
+        """Salva le preferenze; restituisce False se erano già identiche."""
+        value = json.dumps(prefs, sort_keys=True, ensure_ascii=False)
+        with self._lock:
+            if self._cache.get(token) == value:
+                return False
+        connect(self.path).execute(
+            "INSERT INTO preferences (token, prefs, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(token) DO UPDATE SET prefs = excluded.prefs, updated_at = excluded.updated_at "
+            "WHERE preferences.prefs != excluded.prefs",
+            (token, value, time.time()),
+        )
+        # La cache segue solo le scritture riuscite: dopo un errore SQLite il retry riscrive
+        with self._lock:
+            self._cache[token] = value
+        return True
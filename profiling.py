@@ -0,0 +1,242 @@
+"""Profilazione opt-in di un singolo rerun dello script (cProfile, campionamento, tracemalloc).
+
+Si attiva con HEVY_PROFILE=1 (ogni rerun) oppure con ?profile=1 nell'URL; se
+HEVY_ADMIN_TOKEN è impostato la query richiede anche ?admin=<token>. Disattivata,
+`start` restituisce un profiler nullo e `mark`/`stop` non fanno nulla; chiude però
+sempre il profiler rimasto aperto sullo stesso thread da un rerun interrotto.
+
+Le sezioni si delimitano con `profiler.mark(nome)`: il tempo e la memoria fino al
+mark successivo sono attribuiti alla sezione. I risultati si scaricano come file
+pstats (cProfile) o speedscope (campioni dello stack del thread dello script).
+"""
+import cProfile
+import json
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+SAMPLE_INTERVAL = 0.001
+# Ultima difesa se nessuno chiama stop: il campionatore si ferma da solo
+MAX_SECONDS = 120
+TOP_N = 15
+
+_lock = threading.Lock()
+_tracing = 0  # profiler attivi che usano tracemalloc
+_active = {}  # id del thread -> profiler avviato e non ancora fermato
+
+
+def requested(query_params) -> bool:
+    """True se il rerun corrente va profilato (variabile d'ambiente o parametro dell'URL)."""
+    if os.environ.get("HEVY_PROFILE", "").lower() in ("1", "true", "yes"):
+        return True
+    if query_params.get("profile") not in ("1", "true"):
+        return False
+    admin_token = os.environ.get("HEVY_ADMIN_TOKEN", "")
+    return not admin_token or query_params.get("admin") == admin_token
+
+
+class _NullProfiler:
+    active = False
+
+    def mark(self, name: str):
+        pass
+
+    def stop(self) -> bool:
+        return False
+
+
+DISABLED = _NullProfiler()
+
+
+def _acquire_tracemalloc():
+    global _tracing
+    with _lock:
+        if _tracing == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing += 1
+
+
+def _release_tracemalloc():
+    global _tracing
+    with _lock:
+        _tracing -= 1
+        if _tracing == 0:
+            tracemalloc.stop()
+
+
+class _Sampler(threading.Thread):
+    """Campiona lo stack di un thread a intervalli regolari (per il formato speedscope)."""
+
+    def __init__(self, thread_id: int, on_abandon):
+        super().__init__(name="hevy-profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.samples = []
+        self.done = threading.Event()
+        self._on_abandon = on_abandon
+
+    def run(self):
+        deadline = time.monotonic() + MAX_SECONDS
+        while not self.done.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None or time.monotonic() > deadline:
+                self._on_abandon()
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            self.samples.append((time.perf_counter(), tuple(reversed(stack))))
+
+
+class RerunProfiler:
+    active = True
+
+    def __init__(self):
+        self.sections = []
+        self.profile = cProfile.Profile()
+        self.stopped = False
+        self._section = None
+        self._stop_lock = threading.Lock()
+
+    def start(self, first_section: str) -> "RerunProfiler":
+        _acquire_tracemalloc()
+        self._snapshot_start = tracemalloc.take_snapshot()
+        self.started = time.perf_counter()
+        self._sampler = _Sampler(threading.get_ident(), self._abandon)
+        self._sampler.start()
+        self._begin(first_section)
+        with _lock:
+            _active[threading.get_ident()] = self
+        self.profile.enable()
+        return self
+
+    def _begin(self, name: str):
+        tracemalloc.reset_peak()
+        self._section = (name, time.perf_counter(), tracemalloc.get_traced_memory()[0])
+
+    def _close(self):
+        name, started, memory = self._section
+        current, peak = tracemalloc.get_traced_memory()
+        self.sections.append({
+            "sezione": name,
+            "ms": round((time.perf_counter() - started) * 1000, 1),
+            "memoria_kb": round((current - memory) / 1024, 1),
+            "picco_kb": round((peak - memory) / 1024, 1),
+        })
+
+    def mark(self, name: str):
+        """Chiude la sezione corrente e ne apre una nuova."""
+        if not self.stopped:
+            self._close()
+            self._begin(name)
+
+    def _abandon(self):
+        # Rerun interrotto prima di stop: libera tracemalloc senza risultati
+        with self._stop_lock:
+            if not self.stopped:
+                self.stopped = True
+                _release_tracemalloc()
+        with _lock:
+            if _active.get(self._sampler.thread_id) is self:
+                del _active[self._sampler.thread_id]
+
+    def abort(self):
+        """Termina senza risultati: hook di cProfile, campionatore e tracemalloc (dal thread dello script)."""
+        self.profile.disable()
+        self._abandon()
+        self._sampler.done.set()
+
+    def stop(self) -> bool:
+        """Termina la profilazione; False se era già stata abbandonata (nessun risultato)."""
+        self.profile.disable()
+        with _lock:
+            if _active.get(self._sampler.thread_id) is self:
+                del _active[self._sampler.thread_id]
+        with self._stop_lock:
+            if self.stopped:
+                return False
+            self.stopped = True
+            self._close()
+            self.total_ms = round((time.perf_counter() - self.started) * 1000, 1)
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+            _release_tracemalloc()
+        self._sampler.done.set()
+        self._sampler.join()
+        self.allocations = snapshot.compare_to(self._snapshot_start, "lineno")
+        self.profile.create_stats()
+        return True
+
+    def top_functions(self, limit: int = TOP_N) -> list:
+        """Funzioni con il tempo cumulativo più alto."""
+        stats = pstats.Stats(self.profile).stats
+        rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        return [
+            {
+                "funzione": f"{func} ({os.path.basename(filename)}:{line})",
+                "chiamate": calls,
+                "totale_ms": round(total * 1000, 1),
+                "cumulativo_ms": round(cumulative * 1000, 1),
+            }
+            for (filename, line, func), (_, calls, total, cumulative, _) in rows
+        ]
+
+    def top_allocations(self, limit: int = TOP_N) -> list:
+        """Righe con la maggiore crescita di memoria durante il rerun."""
+        return [
+            {
+                "riga": f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                "kb": round(stat.size_diff / 1024, 1),
+                "blocchi": stat.count_diff,
+            }
+            for stat in self.allocations[:limit]
+        ]
+
+    def pstats_bytes(self) -> bytes:
+        """File nel formato di pstats.Stats.dump_stats (apribile con snakeviz o pstats)."""
+        return marshal.dumps(self.profile.stats)
+
+    def speedscope_bytes(self, name: str = "rerun") -> bytes:
+        """Profilo campionato nel formato JSON di speedscope.app."""
+        frames, frame_ids, samples, weights = [], {}, [], []
+        previous = self.started
+        for at, stack in self._sampler.samples:
+            ids = []
+            for key in stack:
+                if key not in frame_ids:
+                    frame_ids[key] = len(frames)
+                    frames.append({"name": key[0], "file": key[1], "line": key[2]})
+                ids.append(frame_ids[key])
+            samples.append(ids)
+            weights.append(round((at - previous) * 1000, 3))
+            previous = at
+        document = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "hevy-ai-architect",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled", "name": name, "unit": "milliseconds",
+                "startValue": 0, "endValue": round(sum(weights), 3),
+                "samples": samples, "weights": weights,
+            }],
+        }
+        return json.dumps(document).encode("utf-8")
+
+
+def start(enabled: bool, first_section: str = "avvio"):
+    """Profiler del rerun corrente: reale se `enabled`, altrimenti quello nullo.
+
+    Un profiler lasciato aperto sul thread da un rerun precedente (st.rerun, st.stop,
+    eccezione) viene chiuso in ogni caso: il suo hook di cProfile rallenterebbe
+    anche i rerun non profilati.
+    """
+    with _lock:
+        stale = _active.pop(threading.get_ident(), None)
+    if stale is not None:
+        stale.abort()
+    return RerunProfiler().start(first_section) if enabled else DISABLED
@@ -0,0 +1,171 @@
+"""Esportazione PDF in blocco delle schede, in parallelo su più processi.
+
+Uso:
+    python render_pdfs.py schede/ -o pdf/
+    python render_pdfs.py schede.jsonl -o pdf/ --workers 8
+
+L'input è una cartella (file .md con la scheda in Markdown, oppure .json) o un
+file JSONL con una scheda per riga. Ogni scheda JSON può contenere `plan_md`
+oppure `plan_ir` (come l'archivio dei link condivisibili), più un `profile`
+opzionale: con `weeks` > 1 il PDF contiene l'intero programma, come nell'app.
+Il nome del PDF viene da `name`/`id`, o dal nome del file o dal numero di riga.
+
+Le schede sono lette in streaming (al massimo qualche job per processo in coda),
+un errore su una scheda non ferma le altre e il riepilogo finale elenca i falliti.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator, Optional
+
+from pdf_export import build_pdf_from_markdown
+from periodization import build_program, program_markdown
+from plan_ir import plan_to_markdown
+
+# Job in volo per processo: abbastanza da non lasciare processi fermi, memoria costante
+JOBS_PER_WORKER = 4
+
+
+def safe_filename(name: str) -> str:
+    """Nome di file sicuro (senza spazi né separatori di percorso)."""
+    return re.sub(r"[^\w.-]+", "_", str(name)).strip("._") or "scheda"
+
+
+def _load(text: str) -> dict:
+    payload = json.loads(text)
+    if not isinstance(payload, dict):
+        raise ValueError("la scheda deve essere un oggetto JSON")
+    return payload
+
+
+def plan_markdown(payload: dict) -> str:
+    """Markdown da esportare: programma multi-settimana se il profilo lo prevede."""
+    plan_ir = payload.get("plan_ir")
+    plan_md = payload.get("plan_md") or (plan_to_markdown(plan_ir) if plan_ir else "")
+    if not plan_md:
+        raise ValueError("Né plan_md né plan_ir nella scheda")
+    profile = payload.get("profile") or {}
+    weeks = int(profile.get("weeks", 1) or 1)
+    if plan_ir and weeks > 1:
+        return program_markdown(plan_md, build_program(plan_ir, profile, weeks))
+    return plan_md
+
+
+def iter_plans(source: str) -> Iterator[tuple]:
+    """Restituisce (nome, payload o eccezione) leggendo l'input un elemento alla volta."""
+    if os.path.isdir(source):
+        for entry in sorted(os.scandir(source), key=lambda e: e.name):
+            stem, ext = os.path.splitext(entry.name)
+            if not entry.is_file() or ext.lower() not in (".md", ".json"):
+                continue
+            try:
+                with open(entry.path, encoding="utf-8") as f:
+                    text = f.read()
+                payload = {"plan_md": text} if ext.lower() == ".md" else _load(text)
+                yield payload.get("name") or stem, payload
+            except (OSError, ValueError) as e:
+                yield stem, e
+        return
+    with open(source, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                payload = _load(line)
+                yield payload.get("name") or payload.get("id") or f"scheda_{number}", payload
+            except ValueError as e:
+                yield f"riga_{number}", e
+
+
+def render_one(name: str, payload: dict, path: str) -> tuple:
+    """Eseguito nei processi: scrive il PDF e restituisce (nome, byte scritti, errore)."""
+    try:
+        pdf_bytes = build_pdf_from_markdown(plan_markdown(payload))
+        with open(path, "wb") as f:
+            f.write(pdf_bytes)
+        return name, len(pdf_bytes), None
+    except Exception as e:
+        return name, 0, f"{type(e).__name__}: {e}"
+
+
+def render_all(source: str, out_dir: str, workers: Optional[int] = None, quiet: bool = False) -> dict:
+    """Esporta tutte le schede di `source` in `out_dir`; restituisce il riepilogo."""
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    done, written, errors = 0, 0, []
+    used_names = set()
+
+    def output_path(name):
+        # Nomi ripetuti nell'input: suffisso numerico invece di sovrascrivere
+        base = candidate = safe_filename(name)
+        n = 1
+        while candidate in used_names:
+            n += 1
+            candidate = f"{base}_{n}"
+        used_names.add(candidate)
+        return os.path.join(out_dir, candidate + ".pdf")
+
+    def report(name, size, error):
+        nonlocal done, written
+        done += 1
+        written += size
+        if error:
+            errors.append((name, error))
+        if not quiet:
+            status = f"❌ {error}" if error else f"✅ {size / 1024:.1f} KB"
+            rate = done / max(time.perf_counter() - started, 1e-9)
+            print(f"[{done}] {name}: {status} ({rate:.1f} PDF/s)", file=sys.stderr)
+
+    def collect(futures):
+        for future in futures:
+            name = pending.pop(future)
+            try:
+                report(*future.result())
+            except Exception as e:
+                # Processo terminato in modo anomalo: fallisce solo questa scheda
+                report(name, 0, f"{type(e).__name__}: {e}")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        for name, payload in iter_plans(source):
+            if isinstance(payload, Exception):
+                report(name, 0, f"Input non valido: {payload}")
+                continue
+            if len(pending) >= workers * JOBS_PER_WORKER:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            pending[pool.submit(render_one, name, payload, output_path(name))] = name
+        collect(wait(pending).done)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "total": done, "ok": done - len(errors), "errors": errors,
+        "bytes": written, "seconds": elapsed, "workers": workers,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Esporta in PDF una cartella o un file JSONL di schede.")
+    parser.add_argument("source", help="cartella con file .md/.json oppure file .jsonl")
+    parser.add_argument("-o", "--output", default="pdf", help="cartella di destinazione (default: pdf)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="processi (default: numero di core)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="solo il riepilogo finale")
+    args = parser.parse_args(argv)
+
+    summary = render_all(args.source, args.output, args.workers, args.quiet)
+    print(
+        f"🎉 {summary['ok']}/{summary['total']} PDF in {summary['seconds']:.1f}s "
+        f"con {summary['workers']} processi "
+        f"({summary['total'] / max(summary['seconds'], 1e-9):.1f} PDF/s, {summary['bytes'] / 1024 / 1024:.1f} MB)"
+    )
+    for name, error in summary["errors"]:
+        print(f"❌ {name}: {error}")
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
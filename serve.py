@@ -0,0 +1,38 @@
+"""Avvio dell'app con warm-up del processo e /ready per il bilanciatore.
+
+Streamlit esegue app.py solo quando si collega una sessione: avviato con
+`streamlit run` il primo utente paga import, catalogo, client Gemini e font del
+PDF. Questo launcher avvia il server delle metriche (con /ready) e il warm-up in
+un thread, poi passa il controllo a Streamlit; gli argomenti sono inoltrati:
+
+    python serve.py --server.port 8501
+    curl -s localhost:9464/ready    # 503 durante il warm-up, poi 200
+"""
+import os
+import sys
+
+# Porta delle metriche e di /ready: va impostata prima di importare metrics
+os.environ.setdefault("HEVY_METRICS_PORT", "9464")
+
+import metrics  # noqa: E402
+import warmup  # noqa: E402
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+
+def main():
+    if metrics.METRICS_PORT:
+        try:
+            metrics.start_server()
+        except OSError as e:
+            print(f"Server delle metriche non avviato: {e}", file=sys.stderr)
+    warmup.start(warmup.gemini_api_key())
+
+    from streamlit.web import cli
+
+    sys.argv = ["streamlit", "run", APP, *sys.argv[1:]]
+    sys.exit(cli.main())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Stima locale della durata di una seduta a partire dalla scheda IR.
+
+Ogni esercizio costa serie × (tempo delle ripetizioni + recupero) più un tempo fisso
+per tipo di esercizio: serie di avvicinamento dei multiarticolari, preparazione
+dell'attrezzo e cambio di postazione. A ogni seduta si aggiungono riscaldamento
+generale e defaticamento. Gli unilaterali contano le ripetizioni per lato.
+"""
+import re
+from typing import Optional
+
+from catalog import CatalogIndex
+
+# Secondi per ripetizione (cadenza 2-0-2)
+SECONDS_PER_REP = 4
+# Valori usati quando ripetizioni o recupero non sono numerici (es. "AMRAP", "a sensazione")
+DEFAULT_REPS = 10
+DEFAULT_REST = 60
+# Ruolo -> secondi di avvicinamento, preparazione e cambio postazione per esercizio
+ROLE_OVERHEAD = {"warmup": 60, "compound": 150, "unilateral": 90, "isolation": 60, "core": 45}
+# Esercizi fuori catalogo (Markdown libero): ruolo sconosciuto
+DEFAULT_OVERHEAD = 90
+# Riscaldamento generale e defaticamento
+SESSION_OVERHEAD = 300
+
+
+# Un numero con la sua unità: 1'30", 1 min 30s, 1m30s, 45 sec, 2m
+_TIME_TOKEN = re.compile(r"""(\d+(?:[.,]\d+)?)\s*(min[a-z]*|m(?![a-z])|sec[a-z]*|s(?![a-z])|''|'|"|′|″)?""")
+_CLOCK = re.compile(r"(\d+):(\d{2})")
+_MINUTE_UNITS = ("min", "m", "'", "′")
+# Celle delle ripetizioni espresse come durata ("30-45s", "1 min") e non come conteggio
+_TIMED = re.compile(r"""\d\s*(?:sec|s(?![a-z])|min|m(?![a-z])|['"′″])|\d:\d{2}""")
+_REP_WORDS = re.compile(r"\brep|ripetizion")
+
+
+def _numbers(text: str) -> list:
+    return [float(n.replace(",", ".")) for n in re.findall(r"\d+(?:[.,]\d+)?", str(text))]
+
+
+def _unit_seconds(unit: str) -> int:
+    return 60 if unit.startswith(_MINUTE_UNITS) else 1
+
+
+def _part_seconds(part: str, default_unit: str) -> Optional[float]:
+    """Secondi di un singolo tempo ('1:30', "1'30\"", '1 min 30s', '90'); None senza numeri."""
+    clock = _CLOCK.search(part)
+    if clock:
+        return int(clock.group(1)) * 60 + int(clock.group(2))
+    total, previous = None, None
+    for number, unit in _TIME_TOKEN.findall(part):
+        value = float(number.replace(",", "."))
+        if not unit:
+            # "1'30" e "1 min 30": il numero dopo i minuti sono secondi
+            unit = "s" if previous and previous.startswith(_MINUTE_UNITS) else default_unit
+        total = (total or 0) + value * _unit_seconds(unit)
+        previous = unit
+    return total
+
+
+def seconds_range(text) -> Optional[tuple]:
+    """(minimo, massimo) in secondi di un tempo o di un intervallo ('60-90s' -> (60, 90)).
+
+    '90s' -> 90; '2 min' -> 120; '1:30', "1'30\"" e '1 min 30s' -> 90; '60/90s' e
+    '1-2 min' sono intervalli. Senza unità sono secondi. None se non c'è un numero.
+    """
+    text = str(text or "").strip().lower()
+    parts = [p for p in re.split(r"\s*[-–/]\s*|\s+a\s+", text) if p]
+    if not parts:
+        return None
+    # L'unità scritta solo alla fine vale per tutto l'intervallo
+    units = [u for _, u in _TIME_TOKEN.findall(parts[-1]) if u]
+    default_unit = units[-1] if units and not _CLOCK.search(parts[-1]) else "s"
+    values = [v for v in (_part_seconds(p, default_unit) for p in parts) if v is not None]
+    if not values:
+        return None
+    return values[0], values[-1]
+
+
+def parse_seconds(text) -> Optional[float]:
+    """Secondi di un tempo scritto nella scheda; con un intervallo la media degli estremi."""
+    bounds = seconds_range(text)
+    return None if bounds is None else (bounds[0] + bounds[1]) / 2
+
+
+def timed_range(reps) -> Optional[tuple]:
+    """(minimo, massimo) in secondi se le ripetizioni sono una durata ('30-45s', '1 min'), altrimenti None."""
+    text = str(reps or "").strip().lower()
+    if _REP_WORDS.search(text) or not _TIMED.search(text):
+        return None
+    return seconds_range(text)
+
+
+def timed_seconds(reps) -> Optional[float]:
+    """Secondi di lavoro se le ripetizioni sono una durata (media di un intervallo), altrimenti None."""
+    bounds = timed_range(reps)
+    return None if bounds is None else (bounds[0] + bounds[1]) / 2
+
+
+def rep_seconds(reps: str) -> float:
+    """Secondi di lavoro di una serie: '8-12' e '10 reps' a 4 s per ripetizione; '30-45s' -> 37.5."""
+    seconds = timed_seconds(reps)
+    if seconds is not None:
+        return seconds
+    numbers = _numbers(reps)
+    count = (numbers[0] + numbers[-1]) / 2 if numbers else DEFAULT_REPS
+    return count * SECONDS_PER_REP
+
+
+def rest_seconds(rest: str) -> float:
+    """Secondi di recupero per la stima: '-' -> 0, testo senza numeri -> DEFAULT_REST."""
+    text = str(rest).strip()
+    if text in ("", "-", "0"):
+        return 0
+    seconds = parse_seconds(text)
+    return DEFAULT_REST if seconds is None else seconds
+
+
+def row_role(row: dict, index: Optional[CatalogIndex] = None, default: Optional[str] = None) -> Optional[str]:
+    """Ruolo dell'esercizio nel catalogo; fuori catalogo warm-up se non ha recupero, altrimenti `default`."""
+    rec = index.by_id.get(row.get("id")) if index else None
+    if rec:
+        return rec["role"]
+    return "warmup" if str(row.get("rest", "")).strip() in ("-", "") else default
+
+
+def row_seconds(row: dict, index: Optional[CatalogIndex] = None) -> float:
+    """Secondi stimati per un esercizio della scheda."""
+    role = row_role(row, index)
+    work = rep_seconds(row.get("reps", ""))
+    if role == "unilateral":
+        work *= 2
+    try:
+        sets = max(0, int(row.get("sets") or 0))
+    except (TypeError, ValueError):
+        sets = 1
+    return sets * (work + rest_seconds(row.get("rest", ""))) + ROLE_OVERHEAD.get(role, DEFAULT_OVERHEAD)
+
+
+def day_seconds(rows: list, index: Optional[CatalogIndex] = None) -> float:
+    """Secondi stimati per una seduta; 0 se non ci sono esercizi."""
+    if not rows:
+        return 0
+    return SESSION_OVERHEAD + sum(row_seconds(r, index) for r in rows)
+
+
+def day_minutes(rows: list, index: Optional[CatalogIndex] = None) -> int:
+    """Durata stimata della seduta in minuti interi."""
+    return round(day_seconds(rows, index) / 60)
+
+
+def annotate_plan(plan: dict, index: Optional[CatalogIndex] = None) -> dict:
+    """Copia della scheda con `minutes` (durata stimata) in ogni giorno."""
+    days = [dict(d, minutes=day_minutes(d.get("rows", []), index)) for d in plan.get("days", [])]
+    return dict(plan, days=days)
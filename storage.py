@@ -0,0 +1,31 @@
+"""Connessioni SQLite condivise dagli store locali (preferenze, storico, cache)."""
+import os
+import sqlite3
+import threading
+
+# Cartella dati locale (sovrascrivibile per i deploy con volume persistente)
+DATA_DIR = os.environ.get("HEVY_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+
+_local = threading.local()
+
+
+def db_path(name: str) -> str:
+    """Percorso di un database nella cartella dati."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, name)
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Connessione per thread in modalità WAL (letture concorrenti, un solo scrittore)."""
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        conns[path] = conn
+    return conn
@@ -0,0 +1,146 @@
+"""Pre-generazione fuori picco delle schede per i profili più richiesti.
+
+Uso (es. da cron alle 3 di notte):
+    python warm_cache.py --top 50 --days 30 --max-requests 40 --rpm 10
+    python warm_cache.py --profiles popolari.csv --max-minutes 20
+
+I profili sono ordinati per frequenza nello storico delle generazioni degli ultimi
+`--days` giorni, oppure letti da un elenco configurato (CSV/JSONL con gli stessi
+campi del roster di bulk_generation.py, nell'ordine di priorità). Le schede sono
+salvate in PlanCache per la versione corrente del catalogo: nelle ore di punta
+l'app le serve subito, senza consumare quota. Le voci di un catalogo precedente
+vengono eliminate a ogni esecuzione.
+
+Con `--stub` le schede sono finte: serve `--cache` con un database diverso da
+quello dell'app, altrimenti il comando si rifiuta di partire.
+
+    python warm_cache.py --stub --profiles popolari.csv --cache /tmp/prova_cache.db
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from typing import Optional
+
+from bulk_generation import DEFAULT_MODEL, RateLimiter, generate_with_retry, load_roster
+from catalog import CatalogIndex, CatalogMetadata
+from generation import ENGINE_LOCAL
+from plan_cache import PlanCache, profile_key
+from plan_history import PlanHistory
+from storage import db_path
+
+# Modello registrato per le schede del client finto
+STUB_MODEL = "stub"
+
+
+def rank_profiles(profiles: list, top: Optional[int] = None) -> list:
+    """Profili distinti (per chiave di cache) dal più frequente, come (profilo, conteggio).
+
+    Il motore locale è già istantaneo e non viene messo in cache.
+    """
+    counts, representative = Counter(), {}
+    for profile in profiles:
+        if profile.get("engine_mode") == ENGINE_LOCAL:
+            continue
+        key = profile_key(profile)
+        counts[key] += 1
+        representative.setdefault(key, profile)
+    return [(representative[key], count) for key, count in counts.most_common(top)]
+
+
+def warm(ranked: list, cache: PlanCache, catalog_version: str, client, model: str, df, index: CatalogIndex,
+         max_requests: int = 50, max_seconds: float = 0, rpm: float = 10, quiet: bool = False) -> dict:
+    """Genera le schede mancanti in ordine di priorità finché il budget lo consente."""
+    limiter = RateLimiter(rpm)
+    started = time.perf_counter()
+    summary = {"cached": 0, "generated": 0, "failed": 0, "budget_left": 0}
+    for position, (profile, count) in enumerate(ranked):
+        if cache.contains(profile, catalog_version):
+            summary["cached"] += 1
+            continue
+        out_of_time = max_seconds and time.perf_counter() - started >= max_seconds
+        if summary["generated"] + summary["failed"] >= max_requests or out_of_time:
+            summary["budget_left"] = len(ranked) - position
+            break
+        try:
+            # Un solo tentativo e niente ripiego locale: in cache vanno solo schede dell'AI
+            plan_md, plan_ir, _ = generate_with_retry(
+                client, model, profile, df, index, limiter, retries=1, fallback=False
+            )
+        except Exception as e:
+            summary["failed"] += 1
+            status = f"❌ {type(e).__name__}: {e}"
+        else:
+            cache.put(profile, catalog_version, model, plan_md, plan_ir)
+            summary["generated"] += 1
+            status = "✅"
+        if not quiet:
+            print(f"[{position + 1}/{len(ranked)}] {profile_key(profile)} ({count} richieste): {status}", file=sys.stderr)
+    summary["seconds"] = time.perf_counter() - started
+    return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Pre-genera in cache le schede dei profili più richiesti.")
+    parser.add_argument("--profiles", help="elenco configurato (CSV/JSONL) al posto dello storico")
+    parser.add_argument("--days", type=float, default=30, help="finestra dello storico in giorni (default: 30)")
+    parser.add_argument("--top", type=int, default=50, help="profili più frequenti da considerare (default: 50)")
+    parser.add_argument("--max-requests", type=int, default=50, help="richieste all'AI al massimo (default: 50)")
+    parser.add_argument("--max-minutes", type=float, default=0, help="durata massima, 0 = nessun limite")
+    parser.add_argument("--rpm", type=float, default=10, help="richieste al minuto (default: 10)")
+    parser.add_argument("--model", default=os.environ.get("GEMINI_MODEL", DEFAULT_MODEL))
+    parser.add_argument("--stub", action="store_true",
+                        help="usa il client finto locale (nessuna chiamata di rete); richiede --cache")
+    parser.add_argument("--cache", help="database della cache (default: plan_cache.db nella cartella dati)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="solo il riepilogo finale")
+    args = parser.parse_args(argv)
+    app_cache = os.path.abspath(db_path("plan_cache.db"))
+    cache_path = os.path.abspath(args.cache) if args.cache else app_cache
+    if args.stub and cache_path == app_cache:
+        # Le schede finte finirebbero servite agli utenti come schede dell'AI
+        print("❌ Con --stub indica con --cache un database diverso da quello dell'app", file=sys.stderr)
+        return 2
+
+    import pandas as pd
+
+    df = pd.read_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), "exercises_db.csv"))
+    index = CatalogIndex.from_dataframe(df)
+    catalog_version = CatalogMetadata(index).catalog_hash
+    if args.stub:
+        from genai_stub import StubClient
+        client = StubClient(index)
+        args.model = STUB_MODEL
+    else:
+        import google.genai as genai
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            print("❌ Imposta GEMINI_API_KEY (oppure usa --stub)")
+            return 2
+        client = genai.Client(api_key=api_key)
+
+    if args.profiles:
+        entries, invalid = load_roster(args.profiles)
+        for client_id, error in invalid:
+            print(f"Profilo scartato {client_id}: {error}", file=sys.stderr)
+        profiles = [profile for _, profile in entries]
+    else:
+        profiles = PlanHistory().profiles_since(time.time() - args.days * 86400)
+    ranked = rank_profiles(profiles, args.top)
+
+    cache = PlanCache(cache_path)
+    purged = cache.purge(catalog_version)
+    summary = warm(
+        ranked, cache, catalog_version, client, args.model, df, index,
+        max_requests=args.max_requests, max_seconds=args.max_minutes * 60, rpm=args.rpm, quiet=args.quiet,
+    )
+    print(
+        f"🔥 {summary['generated']} schede generate, {summary['cached']} già in cache, "
+        f"{summary['failed']} fallite, {summary['budget_left']} rimandate per budget "
+        f"({len(ranked)} profili, {purged} voci obsolete eliminate, {summary['seconds']:.1f}s)"
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""Riscaldamento delle cache del processo all'avvio e stato di readiness.
+
+Senza warm-up, il primo utente di ogni replica paga da solo questi passi: import
+dei moduli pesanti, lettura e indicizzazione del catalogo, client Gemini e lista
+dei modelli, serializzazione del catalogo per il prompt, font del PDF e miniature
+della prima pagina del database. `start()` li esegue in un thread. Ogni passo
+riempie una cache di processo che l'app riusa: le funzioni di questo modulo e
+`generation.catalog_text`.
+
+`/ready`, sul server delle metriche, risponde 200 solo quando il warm-up è finito
+e Streamlit è in ascolto; prima risponde 503. Un passo fallito (es. la lista dei
+modelli senza rete) è riportato negli errori e non blocca la readiness:
+
+    python serve.py
+    curl -s localhost:9464/ready
+"""
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+import pandas as pd
+
+import metrics
+from catalog import CatalogIndex, CatalogMetadata
+
+CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "exercises_db.csv")
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+COLD, WARMING, READY = "cold", "warming", "ready"
+
+_lock = threading.Lock()
+_catalog = {}
+_clients = {}
+_models = {}
+_state = {"status": COLD, "steps": {}, "errors": {}, "started_at": None, "ready_at": None}
+
+
+def gemini_api_key() -> Optional[str]:
+    """API key Gemini da Streamlit secrets (Streamlit Cloud) o dalla variabile d'ambiente."""
+    try:
+        import streamlit as st
+        return st.secrets["GEMINI_API_KEY"]
+    except Exception:
+        pass
+    return os.environ.get("GEMINI_API_KEY") or None
+
+
+def catalog_frame() -> pd.DataFrame:
+    """Catalogo letto dal CSV una volta per processo (da non modificare: è condiviso)."""
+    with _lock:
+        if "frame" not in _catalog:
+            _catalog["frame"] = pd.read_csv(CSV_PATH)
+        return _catalog["frame"]
+
+
+def catalog_index(df: Optional[pd.DataFrame] = None) -> CatalogIndex:
+    """Indice del catalogo condiviso; un DataFrame diverso dal catalogo ne ottiene uno nuovo."""
+    frame = _catalog.get("frame")
+    if df is not None and (frame is None or (df is not frame and not df.equals(frame))):
+        return CatalogIndex.from_dataframe(df)
+    frame = catalog_frame()
+    with _lock:
+        if "index" not in _catalog:
+            _catalog["index"] = CatalogIndex.from_dataframe(frame)
+        return _catalog["index"]
+
+
+def catalog_metadata(index: CatalogIndex) -> CatalogMetadata:
+    """Metadati del catalogo, calcolati una volta per l'indice condiviso."""
+    with _lock:
+        if _catalog.get("index") is not index:
+            return CatalogMetadata(index)
+        if "metadata" not in _catalog:
+            _catalog["metadata"] = CatalogMetadata(index)
+        return _catalog["metadata"]
+
+
+def genai_client(api_key: str):
+    """Client Gemini riusato tra sessioni e rerun (la costruzione costa ~150 ms)."""
+    with _lock:
+        client = _clients.get(api_key)
+    if client is None:
+        import google.genai as genai
+        client = genai.Client(api_key=api_key)
+        with _lock:
+            client = _clients.setdefault(api_key, client)
+    return client
+
+
+def available_model(api_key: str) -> tuple:
+    """(modello, errore): il primo modello con generateContent, o quello predefinito.
+
+    Solo le risposte riuscite restano in cache: dopo un errore si riprova alla chiamata successiva.
+    """
+    with _lock:
+        cached = _models.get(api_key)
+    if cached is not None:
+        return cached, None
+    try:
+        model = DEFAULT_MODEL
+        for candidate in genai_client(api_key).models.list():
+            if "generateContent" in (getattr(candidate, "supported_actions", None) or []):
+                model = candidate.name.split("/")[-1]
+                break
+    except Exception as e:
+        return DEFAULT_MODEL, str(e)
+    with _lock:
+        _models[api_key] = model
+    return model, None
+
+
+def _warm_pdf():
+    import pdf_export
+    from plan_engine import build_plan
+    from plan_ir import plan_to_markdown
+    from prefs_store import default_preferences
+
+    # Metriche del font e sottoinsieme dei glifi base: il primo PDF reale li trova pronti
+    pdf_export.build_pdf_from_markdown(plan_to_markdown(build_plan(default_preferences(), catalog_index())))
+
+
+def _warm_thumbnails():
+    import exercise_images
+
+    if os.path.isdir(exercise_images.IMAGES_DIR):
+        for row in catalog_index().search()[0]:
+            exercise_images.thumbnail_path(row["id"], "explorer")
+
+
+def _warm_prompt():
+    from generation import catalog_text
+
+    for structured in (True, False):
+        catalog_text(catalog_frame(), structured)
+
+
+def _steps(api_key: Optional[str]) -> list:
+    def metadata():
+        meta = catalog_metadata(catalog_index())
+        metrics.set_catalog(meta.catalog_hash, meta.total)
+
+    def models():
+        error = available_model(api_key)[1]
+        if error:
+            raise RuntimeError(error)
+
+    steps = [("catalogo", catalog_index), ("metadati", metadata), ("prompt", _warm_prompt)]
+    if api_key:
+        steps += [("client gemini", lambda: genai_client(api_key)), ("modelli", models)]
+    return steps + [("pdf", _warm_pdf), ("miniature", _warm_thumbnails)]
+
+
+def warm(api_key: Optional[str] = None) -> dict:
+    """Esegue tutti i passi (in sequenza, tempi in ms) e segna il processo come pronto."""
+    with _lock:
+        _state.update(status=WARMING, started_at=time.time())
+    for name, step in _steps(api_key):
+        started = time.perf_counter()
+        error = None
+        try:
+            step()
+        except Exception as e:
+            error = str(e)
+        with _lock:
+            if error:
+                _state["errors"][name] = error
+            _state["steps"][name] = round((time.perf_counter() - started) * 1000, 1)
+    with _lock:
+        _state.update(status=READY, ready_at=time.time())
+    return snapshot()
+
+
+def snapshot() -> dict:
+    """Copia coerente dello stato del warm-up, sicura da serializzare mentre il thread avanza."""
+    with _lock:
+        return dict(_state, steps=dict(_state["steps"]), errors=dict(_state["errors"]))
+
+
+def start(api_key: Optional[str] = None) -> bool:
+    """Avvia il warm-up in un thread daemon; False se era già stato avviato."""
+    with _lock:
+        if _state["status"] != COLD:
+            return False
+        _state["status"] = WARMING
+    threading.Thread(target=warm, args=(api_key,), name="hevy-warmup", daemon=True).start()
+    return True
+
+
+def server_running() -> bool:
+    """True se il server Streamlit di questo processo è avviato e accetta sessioni."""
+    from streamlit import runtime
+    from streamlit.runtime.runtime import RuntimeState
+
+    if not runtime.exists():
+        return False
+    return runtime.get_instance().state in (RuntimeState.NO_SESSIONS_CONNECTED,
+                                            RuntimeState.ONE_OR_MORE_SESSIONS_CONNECTED)
+
+
+def readiness() -> tuple:
+    """(codice HTTP, stato): 200 solo a warm-up finito e con Streamlit in ascolto."""
+    state = dict(snapshot(), server=server_running())
+    ready = state["status"] == READY and state["server"]
+    return (200 if ready else 503), state
+
+
+def _ready_route() -> tuple:
+    status, state = readiness()
+    return status, "application/json", json.dumps(state).encode("utf-8")
+
+
+metrics.add_route("/ready", _ready_route)